@@ -0,0 +1,61 @@
+"""
+Compare Ziplog(auto_tune=True), which picks the kernel of every column,
+whether it goes through its numeric codec (and at level 3 whether its
+parameters are indexed) from a sample, with one
+kernel for all columns, on synthetic logs from loggen.py. Every archive is
+decompressed and checked against the log.
+
+    $ cd logzip/benchmark/
+    $ python3 bench_autotune.py --lines 200000 --min-mb-s 20 --min-ratio 8
+"""
+
+import sys
+sys.path.append("../")
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from logzip.logzipper import Ziplog
+from logzip.logunzipper import Unziplog
+from logzip.metrics import RunMetrics
+import loggen
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--formats", nargs="+", default=sorted(loggen.FORMATS), choices=sorted(loggen.FORMATS))
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--level", type=int, default=3)
+    parser.add_argument("--min-mb-s", type=float, default=20)
+    parser.add_argument("--min-ratio", type=float, default=8)
+    args = parser.parse_args()
+
+    settings = [("gz", {"kernel": "gz"}), ("bz2", {"kernel": "bz2"}), ("lzma", {"kernel": "lzma"}),
+                ("auto", {"auto_tune": True}),
+                ("auto min_mb_s", {"auto_tune": True, "tune_min_mb_s": args.min_mb_s}),
+                ("auto min_ratio", {"auto_tune": True, "tune_min_ratio": args.min_ratio})]
+    work_dir = tempfile.mkdtemp(prefix="logzip_bench_")
+    try:
+        for log_format in args.formats:
+            log_path = os.path.join(work_dir, log_format + ".log")
+            templates_path = os.path.join(work_dir, log_format + "_templates.txt")
+            logformat = loggen.generate_log(log_format, args.lines, log_path, templates_path)
+            n_bytes = os.path.getsize(log_path)
+            with open(log_path) as fr:
+                lines = fr.read().splitlines()
+            for name, kwargs in settings:
+                metrics = RunMetrics(quiet=True)
+                zipper = Ziplog(logformat=logformat, outdir=work_dir, outname=log_format, level=args.level,
+                                column_kernel=True, metrics=metrics, run_report=False, **kwargs)
+                t1 = time.time()
+                zipper.zip_file(log_path, templates_path)
+                seconds = time.time() - t1
+                archive_path = zipper.archive_path()
+                if Unziplog(archive_path).read_lines() != lines:
+                    raise RuntimeError("{} archive of {} does not decompress to the log!".format(name, log_format))
+                print("{:<6} {:<15} ratio {:6.2f}  {:6.2f}s  {:6.2f} MB/s  tuning {:.2f}s".format(
+                      log_format, name, n_bytes / float(os.path.getsize(archive_path)), seconds,
+                      n_bytes / 1e6 / seconds, metrics.gauges.get("tuning_seconds", 0)))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,70 @@
+"""
+Compare the per-line header split of LogLoader (HeaderSplitter, compiled from
+the logformat into str.split/partition/find steps) with the former per-line
+regex (kept below as legacy_formalize_message) on synthetic logs from
+loggen.py. Both must produce the same messages.
+
+    $ cd logzip/benchmark/
+    $ python3 bench_logloader.py --lines 200000
+"""
+
+import sys
+sys.path.append("../")
+import argparse
+import contextlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import time
+from logzip.logloader import LogLoader, formalize_message
+import loggen
+
+
+def legacy_formalize_message(enumerated_lines, regex, headers):
+    log_messages = []
+    failed_messages = {}
+    for line_count, line in enumerated_lines:
+        line = line.strip()
+        if not line:
+            continue
+        line = re.sub(r'[^\x00-\x7F]+', '<NASCII>', line)
+        try:
+            match = regex.search(line)
+            message = [match.group(header) for header in headers]
+            message.insert(0, line_count + 1)
+            log_messages.append(message)
+        except Exception:
+            failed_messages[line_count] = line
+    return log_messages, failed_messages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--formats", nargs="+", default=sorted(loggen.FORMATS), choices=sorted(loggen.FORMATS))
+    parser.add_argument("--lines", type=int, default=100000)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="logzip_bench_")
+    try:
+        for log_format in args.formats:
+            log_path = os.path.join(work_dir, log_format + ".log")
+            logformat = loggen.generate_log(log_format, args.lines, log_path,
+                                            os.path.join(work_dir, log_format + "_templates.txt"))
+            with open(log_path) as fr:
+                lines = fr.readlines()
+            loader = LogLoader(logformat, None)
+            t1 = time.time()
+            expected = legacy_formalize_message(enumerate(lines), loader.regex, loader.headers)
+            t2 = time.time()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = formalize_message(enumerate(lines), loader.splitter)
+            t3 = time.time()
+            if result != expected:
+                raise RuntimeError("HeaderSplitter and the regex disagree on {}!".format(log_format))
+            print("{:<6} steps {}: regex {:.3f}s, splitter {:.3f}s ({:.1f}x, {:.0f} lines/s)".format(
+                  log_format, [step[0] for step in loader.splitter.steps or []], t2 - t1, t3 - t2,
+                  (t2 - t1) / max(t3 - t2, 1e-9), len(lines) / max(t3 - t2, 1e-9)))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
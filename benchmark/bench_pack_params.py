@@ -0,0 +1,71 @@
+"""
+Show how Ziplog.__pack_params scales with the number of templates, compared
+with the former per-event boolean-mask implementation (kept below as
+legacy_pack_params), which needs every parameter split beforehand
+(split_para); __pack_params gathers them from the flat parameter buffer of
+a StructuredLog and splits each distinct value once instead. Both must
+produce the same parameter columns.
+
+    $ cd logzip/benchmark/
+    $ python3 bench_pack_params.py --lines 200000 --templates 10 100 1000 5000
+"""
+
+import sys
+sys.path.append("../")
+import argparse
+import random
+import time
+from itertools import zip_longest
+import numpy as np
+import pandas as pd
+from logzip.logzipper import Ziplog, split_para
+from logzip.structuredlog import StructuredLog
+
+
+def legacy_pack_params(dataframe):
+    file_para_dict = {}
+    for eid in dataframe["EventId"].unique():
+        paras = dataframe.loc[dataframe["EventId"]==eid, "ParameterList"]
+        paracolumns = list(zip_longest(*paras, fillvalue=""))
+        for para_idx, subparas in enumerate(paracolumns):
+            subparas_columns = list(zip_longest(*subparas, fillvalue=""))
+            for sub_para_idx, sub_subparas in enumerate(subparas_columns):
+                filename = f"{eid}_{para_idx}_{sub_para_idx}"
+                file_para_dict[filename] = sub_subparas
+    return file_para_dict
+
+
+def generate_dataframe(n_lines, n_templates, seed=0):
+    rng = random.Random(seed)
+    n_params = [rng.randint(1, 4) for _ in range(n_templates)]
+    eids, templates, paras = [], [], []
+    for _ in range(n_lines):
+        tidx = rng.randrange(n_templates)
+        eids.append("E{}".format(tidx + 1))
+        templates.append(" ".join(["event{}".format(tidx + 1)] + ["<*>"] * n_params[tidx]))
+        paras.append(tuple("blk_{}".format(rng.randrange(10**6)) if rng.random() < 0.5
+                           else "/10.{}.{}.{}:50010".format(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+                           for _ in range(n_params[tidx])))
+    return pd.DataFrame({"LineId": range(1, n_lines + 1), "Content": "", "EventTemplate": templates,
+                         "ParameterList": paras, "EventId": eids})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--templates", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+
+    zipper = Ziplog(logformat="<Content>", outdir="../zip_out/", outname="bench", tmp_dir="../zip_out/tmp_dir")
+    for n_templates in args.templates:
+        dataframe = generate_dataframe(args.lines, n_templates)
+        structured_log = StructuredLog.from_dataframe(dataframe)
+        t1 = time.time()
+        expected = legacy_pack_params(dataframe.assign(ParameterList=split_para(dataframe["ParameterList"])))
+        t2 = time.time()
+        zipper._Ziplog__pack_params(structured_log, np.arange(len(structured_log)))
+        t3 = time.time()
+        assert list(expected) == list(zipper.file_para_dict), "Column order differs"
+        assert all(list(expected[k]) == list(zipper.file_para_dict[k]) for k in expected), "Columns differ"
+        print("templates {:>6}: legacy {:.2f}s, grouped {:.2f}s, speedup {:.1f}x, {} columns".format(
+              n_templates, t2 - t1, t3 - t2, (t2 - t1) / max(t3 - t2, 1e-9), len(expected)))
@@ -0,0 +1,194 @@
+"""
+Time every stage of logzip (LogLoader, PatternMatch.match, compress_all /
+compress_normal / compress_content and __kernel_compress) on synthetic logs
+from loggen.py, for each format, level and kernel. Every case runs in a fresh
+process so its peak RSS is its own. Results are written as JSON (MB/s and
+lines/s per stage and end to end, peak RSS, archive size and compression
+ratio next to plain gzip/bz2 of the same file), and a previous result file
+can be compared against:
+
+    $ cd logzip/benchmark/
+    $ python3 bench_suite.py --lines 200000 --output base.json
+    $ python3 bench_suite.py --lines 200000 --output new.json --compare base.json
+"""
+
+import sys
+sys.path.append("../")
+import argparse
+import bz2
+import gzip
+import json
+import multiprocessing as mp
+import os
+import platform
+import queue
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from logzip.logloader import LogLoader
+from logzip.treematch import PatternMatch
+from logzip.logzipper import Ziplog, KERNEL_SUFFIX
+import loggen
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def stage_rates(seconds, n_lines, n_bytes):
+    return {"seconds": seconds, "lines_s": n_lines / max(seconds, 1e-9), "mb_s": n_bytes / 1e6 / max(seconds, 1e-9)}
+
+
+def run_case(case, results):
+    try:
+        results.put(time_case(*case))
+    except BaseException as error:
+        results.put({"error": "{}: {}".format(type(error).__name__, error)})
+
+
+def time_case(log_path, templates_path, logformat, level, kernel, out_dir):
+    n_bytes = os.path.getsize(log_path)
+    seconds = {}
+    t1 = time.time()
+    loader = LogLoader(logformat, None)
+    log_dataframe = loader.load_to_dataframe(log_path)
+    t2 = time.time()
+    seconds["load"] = t2 - t1
+    with open(templates_path) as fr:
+        templates = [line.strip() for line in fr]
+    matcher = PatternMatch(tmp_dir="", outdir=out_dir, logformat=logformat, structured=True, keep_content=level == 1)
+    structured_log = matcher.match(templates, log_dataframe=log_dataframe)
+    t3 = time.time()
+    seconds["match"] = t3 - t2
+    zipper = Ziplog(logformat=logformat, outdir=out_dir, outname="bench", kernel=kernel, level=level)
+    zipper.loader = loader
+    zipper.zip_dataframe(structured_log)
+    seconds["total"] = time.time() - t1
+    seconds.update(zipper.stage_times)
+
+    archive_path = os.path.join(out_dir, "bench.tar.{}".format(kernel))
+    n_lines = loader.total_lines
+    return {"stages": {stage: stage_rates(value, n_lines, n_bytes) for stage, value in seconds.items()},
+            "archive_bytes": os.path.getsize(archive_path), "peak_rss_mb": peak_rss_mb()}
+
+
+def wait_result(process, results, timeout):
+    """ Result of a case process, or {"error": ...} if it dies without one or
+        runs longer than timeout seconds
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            pass
+        if not process.is_alive():
+            # the result may have been put right before the process exited
+            try:
+                return results.get(timeout=1)
+            except queue.Empty:
+                return {"error": "case process exited with code {}".format(process.exitcode)}
+        if time.time() > deadline:
+            process.terminate()
+            return {"error": "timed out after {}s".format(timeout)}
+
+
+def baseline(log_path):
+    with open(log_path, "rb") as fr:
+        raw = fr.read()
+    sizes = {}
+    for name, compress in [("gzip", lambda x: gzip.compress(x, compresslevel=9)),
+                           ("bz2", lambda x: bz2.compress(x, compresslevel=9))]:
+        t1 = time.time()
+        sizes[name] = {"bytes": len(compress(raw)), "seconds": time.time() - t1}
+    return sizes
+
+
+def compare(results, previous):
+    previous = {(r["format"], r["level"], r["kernel"]): r for r in previous["results"]}
+    print("\n{:<6} {:>5} {:>6} {:>12} {:>12} {:>10}".format("format", "level", "kernel", "MB/s", "ratio", "RSS MB"))
+    for result in results:
+        old = previous.get((result["format"], result["level"], result["kernel"]))
+        if old is None or "error" in result or "error" in old:
+            continue
+        print("{:<6} {:>5} {:>6} {:>+11.1%} {:>+11.1%} {:>+9.1%}".format(
+              result["format"], result["level"], result["kernel"],
+              result["mb_s"] / old["mb_s"] - 1, result["ratio"] / old["ratio"] - 1,
+              result["peak_rss_mb"] / old["peak_rss_mb"] - 1))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--formats", nargs="+", default=sorted(loggen.FORMATS), choices=sorted(loggen.FORMATS))
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--kernels", nargs="+", default=["gz", "bz2", "lzma"], choices=sorted(KERNEL_SUFFIX))
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--templates", type=int, default=50)
+    parser.add_argument("--cardinality", type=int, default=1000)
+    parser.add_argument("--line-length", type=int, default=80)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=3600, help="seconds before a case is given up")
+    parser.add_argument("--output", default="bench_suite.json")
+    parser.add_argument("--compare", help="a previous --output file")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="logzip_bench_")
+    report = {"commit": git_commit(), "python": platform.python_version(), "cpu_count": os.cpu_count(),
+              "args": vars(args), "results": []}
+    try:
+        for log_format in args.formats:
+            log_path = os.path.join(work_dir, log_format + ".log")
+            templates_path = os.path.join(work_dir, log_format + "_templates.txt")
+            logformat = loggen.generate_log(log_format, args.lines, log_path, templates_path, args.templates,
+                                            args.cardinality, args.line_length, args.seed)
+            n_bytes = os.path.getsize(log_path)
+            plain = baseline(log_path)
+            for level in args.levels:
+                for kernel in args.kernels:
+                    out_dir = os.path.join(work_dir, "{}_{}_{}".format(log_format, level, kernel))
+                    results = mp.Queue()
+                    process = mp.Process(target=run_case, args=((log_path, templates_path, logformat,
+                                                                 level, kernel, out_dir), results))
+                    process.start()
+                    result = wait_result(process, results, args.timeout)
+                    process.join()
+                    shutil.rmtree(out_dir, ignore_errors=True)
+                    result.update({"format": log_format, "level": level, "kernel": kernel, "lines": args.lines,
+                                   "input_bytes": n_bytes})
+                    if "error" not in result:
+                        total = result["stages"]["total"]
+                        result.update({"mb_s": total["mb_s"], "lines_s": total["lines_s"],
+                                       "ratio": n_bytes / float(result["archive_bytes"]),
+                                       "gzip_ratio": n_bytes / float(plain["gzip"]["bytes"]),
+                                       "bz2_ratio": n_bytes / float(plain["bz2"]["bytes"])})
+                    report["results"].append(result)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w") as fw:
+        json.dump(report, fw, indent=2)
+    print("\n{:<6} {:>5} {:>6} {:>8} {:>10} {:>8} {:>8} {:>8} {:>8}".format(
+          "format", "level", "kernel", "MB/s", "lines/s", "RSS MB", "ratio", "gzip", "bz2"))
+    for result in report["results"]:
+        if "error" in result:
+            print("{:<6} {:>5} {:>6} failed: {}".format(result["format"], result["level"], result["kernel"],
+                                                       result["error"]))
+            continue
+        print("{:<6} {:>5} {:>6} {:>8.2f} {:>10.0f} {:>8.1f} {:>8.2f} {:>8.2f} {:>8.2f}".format(
+              result["format"], result["level"], result["kernel"], result["mb_s"], result["lines_s"],
+              result["peak_rss_mb"], result["ratio"], result["gzip_ratio"], result["bz2_ratio"]))
+    if args.compare:
+        with open(args.compare) as fr:
+            compare(report["results"], json.load(fr))
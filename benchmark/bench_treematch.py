@@ -0,0 +1,42 @@
+"""
+Compare the recursive matcher (treematch.match_template) with the compiled,
+iterative one (treematch.CompiledMatchTree) on synthetic HDFS/BGL-style logs.
+Both must return the same (template, parameters) for every message.
+
+    $ cd logzip/benchmark/
+    $ python3 bench_treematch.py --lines 200000
+"""
+
+import sys
+sys.path.append("../")
+import argparse
+import time
+from logzip import treematch
+from loggen import HDFS_TEMPLATES, BGL_TEMPLATES, generate_messages
+
+def run(name, templates, messages):
+    matcher = treematch.PatternMatch(tmp_dir="", outdir="./result/")
+    match_tree = matcher._build_match_tree(matcher._read_templates(templates))
+    compiled_tree = treematch.CompiledMatchTree(match_tree)
+    tokens_list = [treematch.message_split(message) for message in messages]
+
+    t1 = time.time()
+    recursive_results = [treematch.match_template(match_tree, tokens) for tokens in tokens_list]
+    t2 = time.time()
+    compiled_results = [compiled_tree.match_template(tokens) for tokens in tokens_list]
+    t3 = time.time()
+
+    assert recursive_results == compiled_results, "Compiled matcher disagrees with find_template"
+    print("{}: {} lines, recursive {:.2f}s ({:.0f} lines/s), compiled {:.2f}s ({:.0f} lines/s), speedup {:.2f}x".format(
+          name, len(messages), t2 - t1, len(messages) / max(t2 - t1, 1e-9),
+          t3 - t2, len(messages) / max(t3 - t2, 1e-9), (t2 - t1) / max(t3 - t2, 1e-9)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    run("HDFS", HDFS_TEMPLATES, generate_messages(HDFS_TEMPLATES, args.lines, args.seed))
+    run("BGL", BGL_TEMPLATES, generate_messages(BGL_TEMPLATES, args.lines, args.seed))
@@ -0,0 +1,178 @@
+"""
+Deterministic synthetic logs for the benchmarks. A format gives the
+logformat, the header fields and a few real templates; more templates are
+made up to reach the requested count. Parameters are drawn from pools of
+`cardinality` values per parameter kind, and made-up templates are padded
+with words up to about `line_length` characters. The same arguments and seed
+always give the same file.
+
+    $ cd logzip/benchmark/
+    $ python3 loggen.py --format BGL --lines 100000 --templates 500 --out /tmp/BGL
+"""
+
+import argparse
+import random
+import re
+
+HDFS_TEMPLATES = [
+    "Receiving block <*> src: <*> dest: <*>",
+    "Received block <*> of size <*> from <*>",
+    "PacketResponder <*> for block <*> terminating",
+    "BLOCK* NameSystem.addStoredBlock: blockMap updated: <*> is added to <*> size <*>",
+    "BLOCK* NameSystem.allocateBlock: <*> <*>",
+    "Verification succeeded for <*>",
+    "Deleting block <*> file <*>",
+    "<*> Served block <*> to <*>",
+    "<*>:Got exception while serving <*> to <*>:",
+    "BLOCK* ask <*> to delete <*>",
+]
+
+BGL_TEMPLATES = [
+    "instruction cache parity error corrected",
+    "generating core.<*>",
+    "CE sym <*>, at <*>, mask <*>",
+    "total of <*> ddr error(s) detected and corrected",
+    "Lustre mount FAILED : <*> : point <*>",
+    "ciod: failed to read message prefix on control stream (CioStream socket to <*>",
+    "data TLB error interrupt",
+    "<*> double-hummer alignment exceptions",
+    "machine check interrupt (bit=<*>): L2 dcache unit data parity error",
+    "ciod: LOGIN chdir(<*>) failed: No such file or directory",
+]
+
+SPARK_TEMPLATES = [
+    "Registered signal handlers for [TERM, HUP, INT]",
+    "Changing view acls to: <*>",
+    "Started reading broadcast variable <*>",
+    "Block <*> stored as bytes in memory (estimated size <*> KB, free <*> KB)",
+    "Reading broadcast variable <*> took <*> ms",
+    "Found block <*> locally",
+    "Finished task <*> in stage <*> (TID <*>). <*> bytes result sent to driver",
+    "Running task <*> in stage <*> (TID <*>)",
+    "Got assigned task <*>",
+    "Input split: <*>:<*>+<*>",
+]
+
+WORDS = ["block", "request", "server", "client", "cache", "node", "error", "task", "stage", "packet",
+         "session", "thread", "queue", "disk", "memory", "socket", "lock", "replica", "volume", "job"]
+
+
+def hdfs_headers(rng, seconds):
+    return {"Date": "0811{:02d}".format(9 + seconds // 86400 % 20),
+            "Time": "{:02d}{:02d}{:02d}".format(seconds // 3600 % 24, seconds // 60 % 60, seconds % 60),
+            "Pid": str(rng.randrange(1, 30000)),
+            "Level": rng.choice(["INFO", "INFO", "INFO", "WARN"]),
+            "Component": rng.choice(["dfs.DataNode$DataXceiver", "dfs.FSNamesystem", "dfs.DataNode$PacketResponder"])}
+
+
+def bgl_headers(rng, seconds):
+    node = "R{:02d}-M{}-N{}-C:J{:02d}-U{:02d}".format(rng.randrange(64), rng.randrange(2), rng.randrange(16),
+                                                     rng.randrange(18), rng.randrange(12))
+    return {"Label": rng.choice(["-", "-", "-", "KERNDTLB"]),
+            "Timestamp": str(1117838570 + seconds),
+            "Date": "2005.06.{:02d}".format(3 + seconds // 86400 % 25),
+            "Node": node,
+            "Time": "2005-06-{:02d}-{:02d}.{:02d}.{:02d}.{:06d}".format(3 + seconds // 86400 % 25, seconds // 3600 % 24,
+                                                                     seconds // 60 % 60, seconds % 60, rng.randrange(10**6)),
+            "NodeRepeat": node,
+            "Type": "RAS",
+            "Component": rng.choice(["KERNEL", "KERNEL", "APP", "MMCS"]),
+            "Level": rng.choice(["INFO", "INFO", "FATAL", "ERROR"])}
+
+
+def spark_headers(rng, seconds):
+    return {"Date": "17/06/{:02d}".format(9 + seconds // 86400 % 20),
+            "Time": "{:02d}:{:02d}:{:02d}".format(seconds // 3600 % 24, seconds // 60 % 60, seconds % 60),
+            "Level": rng.choice(["INFO", "INFO", "INFO", "WARN"]),
+            "Component": rng.choice(["executor.CoarseGrainedExecutorBackend", "storage.MemoryStore",
+                                     "broadcast.TorrentBroadcast", "executor.Executor"])}
+
+
+FORMATS = {
+    "HDFS": ("<Date> <Time> <Pid> <Level> <Component>: <Content>", hdfs_headers, HDFS_TEMPLATES),
+    "BGL": ("<Label> <Timestamp> <Date> <Node> <Time> <NodeRepeat> <Type> <Component> <Level> <Content>",
+            bgl_headers, BGL_TEMPLATES),
+    "Spark": ("<Date> <Time> <Level> <Component>: <Content>", spark_headers, SPARK_TEMPLATES),
+}
+
+
+def random_parameter(rng, kind=None):
+    kind = rng.randrange(5) if kind is None else kind
+    if kind == 0:
+        return "blk_{}".format(rng.randint(-2**63, 2**63))
+    if kind == 1:
+        return "/10.{}.{}.{}:{}".format(rng.randrange(256), rng.randrange(256), rng.randrange(256), rng.choice([50010, 50020]))
+    if kind == 2:
+        return str(rng.randrange(10**6))
+    if kind == 3:
+        return "0x{:08x}".format(rng.randrange(2**32))
+    return "/p/gb{}/stella/RAPTOR/{}".format(rng.randrange(10), rng.randrange(10**4))
+
+
+def generate_messages(templates, n_lines, seed=0):
+    """ Fill templates (chosen uniformly) with fresh random parameters
+    """
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(n_lines):
+        message = rng.choice(templates)
+        while "<*>" in message:
+            message = message.replace("<*>", random_parameter(rng), 1)
+        messages.append(message)
+    return messages
+
+
+def make_templates(base_templates, n_templates, line_length, rng):
+    templates = list(base_templates[:n_templates])
+    while len(templates) < n_templates:
+        # the leading op<idx> token keeps made-up templates distinct
+        tokens = ["op{}".format(len(templates))]
+        while len(" ".join(tokens)) < line_length:
+            tokens.append("<*>" if rng.random() < 0.3 else rng.choice(WORDS))
+        templates.append(" ".join(tokens))
+    return templates
+
+
+def generate_log(log_format, n_lines, log_path, templates_path, n_templates=50, cardinality=1000,
+                 line_length=80, seed=0):
+    """ Write n_lines lines and their templates; returns the logformat
+    """
+    logformat, make_headers, base_templates = FORMATS[log_format]
+    rng = random.Random(seed)
+    templates = make_templates(base_templates, n_templates, line_length, rng)
+    pools = [[random_parameter(rng, kind) for _ in range(cardinality)] for kind in range(5)]
+    # a few templates are much more frequent than the rest, as in real logs
+    weights = [1.0 / (rank + 1) for rank in range(len(templates))]
+    line_format = re.sub(r"<([^<>]+)>", r"{\1}", logformat)
+
+    seconds = 0
+    with open(log_path, "w") as fw:
+        for template in rng.choices(templates, weights, k=n_lines):
+            seconds += rng.random() < 0.2
+            content = template
+            while "<*>" in content:
+                content = content.replace("<*>", rng.choice(pools[rng.randrange(5)]), 1)
+            fields = make_headers(rng, seconds)
+            fields["Content"] = content
+            fw.write(line_format.format(**fields))
+            fw.write("\n")
+    with open(templates_path, "w") as fw:
+        fw.write("\n".join(templates))
+        fw.write("\n")
+    return logformat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--format", choices=sorted(FORMATS), default="HDFS")
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--templates", type=int, default=50)
+    parser.add_argument("--cardinality", type=int, default=1000)
+    parser.add_argument("--line-length", type=int, default=80)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="../zip_out/synthetic", help="writes OUT.log and OUT_templates.txt")
+    args = parser.parse_args()
+
+    logformat = generate_log(args.format, args.lines, args.out + ".log", args.out + "_templates.txt",
+                             args.templates, args.cardinality, args.line_length, args.seed)
+    print("logformat: {}".format(logformat))
@@ -0,0 +1,13 @@
+import sys
+sys.path.append("../")
+from logzip.logunzipper import Unziplog
+
+if __name__ == "__main__":
+    archive_path = "../zip_out/HDFS_2k.logzip.tar.bz2"
+    out_filepath = "../zip_out/HDFS_2k.log"
+    n_workers = 1
+
+    unzipper = Unziplog(archive_path, n_workers=n_workers)
+    unzipper.unzip_file(out_filepath)             # whole file
+    print(unzipper.read_lines(start=100, end=110)) # or only a range of lines
+    unzipper.close()
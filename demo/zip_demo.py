@@ -19,5 +19,6 @@ if __name__ == "__main__":
                     outname=outname,
                     kernel=kernel,
                     tmp_dir=tmp_dir,
-                    level=level)
+                    level=level,
+                    n_workers=n_workers)
     zipper.zip_file(filepath, templates_filepath)
\ No newline at end of file
@@ -0,0 +1,260 @@
+# Copyright 2018 The LogPAI Team (https://github.com/logpai).
+#
+# Licensed under the MIT License:
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# =============================================================================
+""" This file implements the per-column choices of Ziplog(auto_tune=True),
+    estimated by compressing a sample of every column:
+
+    - the kernel and compression level of every column member of the .lzc
+      container, among CANDIDATE_KERNELS ("store" keeps the bytes as they
+      are, for columns that do not compress);
+    - for a column columncodec can encode, whether it is stored through its
+      numeric codec or as text: the kernels are tried on both forms, and
+      the encoding time counts against the numeric form;
+    - at level 3, whether a parameter column is dictionary-indexed or keeps
+      its values as text: its sample ids plus the dictionary entries of the
+      values no other column holds, against its sample values as text. The
+      dictionary entries of shared values are paid once for all columns, so
+      they are left out.
+
+    lzma is only tried on members of at least MIN_LZMA_BYTES: below that its
+    setup time and framing outweigh what it saves. Columns of less than
+    MIN_TUNE_BYTES are not tuned at all: they take the default kernel, their
+    numeric codec whenever it is smaller and the dictionary index, since
+    sampling them would cost more than compressing them. Larger members are
+    sampled, at most a SAMPLE_FRACTION of them, or a BUDGET_SAMPLE_FRACTION
+    under min_mb_s, so that sampling leaves room in the budget.
+
+    Budgets are rates, so they hold for every column as for the archive: with
+    min_mb_s the smallest output among the kernels estimated to compress at
+    least min_mb_s MB/s, counting the time spent sampling the column, is
+    taken (the fastest kernel if none is), with min_ratio the fastest kernel
+    reaching the ratio (the smallest output if none does), and without a
+    budget the smallest output. Outputs within TIE_RATIO of each other count
+    as equal, and the faster kernel wins. Under min_mb_s the kernels are
+    sampled cheapest first, as CANDIDATE_KERNELS are listed, and the first
+    one found too slow ends the sampling of the column.
+"""
+
+import os
+import time
+import numpy as np
+import pandas as pd
+from . import columncodec
+from .metrics import column_key
+
+CANDIDATE_KERNELS = [("store", None), ("gz", 1), ("gz", 9), ("bz2", 9), ("lzma", 6)]
+TIE_RATIO = 0.01
+MIN_LZMA_BYTES = 1 << 12
+MIN_TUNE_BYTES = 1 << 14
+SAMPLE_FRACTION = 4
+BUDGET_SAMPLE_FRACTION = 16
+N_SAMPLE_RUNS = 4
+
+
+def sample_runs(content, sample_size, n_runs=N_SAMPLE_RUNS):
+    """ n_runs evenly spaced runs of content (bytes or an array of rows),
+        sample_size items in total, or content itself if that is not longer
+    """
+    if len(content) <= sample_size:
+        return content
+    run_size = sample_size // n_runs
+    starts = np.linspace(0, len(content) - run_size, n_runs).astype(np.int64)
+    if isinstance(content, bytes):
+        return b"".join(content[start:start + run_size] for start in starts)
+    return np.concatenate([content[start:start + run_size] for start in starts])
+
+
+def sample_file(filepath, sample_size, n_runs=N_SAMPLE_RUNS):
+    """ sample_runs of the bytes of a file, read without loading the rest
+    """
+    file_size = os.path.getsize(filepath)
+    with open(filepath, "rb") as fr:
+        if file_size <= sample_size:
+            return fr.read()
+        run_size = sample_size // n_runs
+        runs = []
+        for start in np.linspace(0, file_size - run_size, n_runs).astype(np.int64):
+            fr.seek(int(start))
+            runs.append(fr.read(run_size))
+    return b"".join(runs)
+
+
+def index_payloads(values, encode_id, shared=None):
+    """ Level-3 form of values: the ids (encode_id of the ranks by decreasing
+        frequency) and the dictionary of the distinct values, without those
+        flagged in shared (a boolean array aligned with values)
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    uniques = np.asarray(uniques, dtype=object)
+    counts = np.bincount(codes, minlength=len(uniques))
+    order = np.argsort(-counts, kind="stable")
+    order = order[uniques[order] != ""]
+    ids = np.full(len(uniques), "", dtype=object)
+    ids[order] = [encode_id(rank) for rank in range(len(order))]
+    private = np.ones(len(uniques), dtype=bool)
+    if shared is not None:
+        private[codes[shared]] = False
+    return "\n".join(ids[codes]).encode("utf-8"), columncodec.dump_length_prefixed(uniques[order[private[order]]])
+
+
+class ColumnTuner(object):
+    def __init__(self, compress, encode_id, kernels=CANDIDATE_KERNELS, min_mb_s=None, min_ratio=None,
+                 sample_bytes=1 << 15, sample_rows=4096, default_kernel=("gz", None)):
+        '''
+        compress is logzipper.compress_member, given (arcname, content,
+        kernel, kernel_level) tasks, encode_id turns a dictionary rank into
+        its level-3 id, and default_kernel is the (kernel, level) of the
+        columns too small to tune
+        '''
+        self.compress = compress
+        self.encode_id = encode_id
+        self.kernels = [tuple(kernel) for kernel in kernels]
+        self.default_kernel = tuple(default_kernel)
+        self.min_mb_s = min_mb_s
+        self.min_ratio = min_ratio
+        self.sample_bytes = sample_bytes
+        self.sample_rows = sample_rows
+        self.decisions = {}
+        self.numeric = set()
+        self.chosen = {}
+        self.seconds = 0
+
+    def budget(self):
+        return {"min_mb_s": self.min_mb_s, "min_ratio": self.min_ratio, "kernels": self.kernels,
+                "sample_bytes": self.sample_bytes, "sample_rows": self.sample_rows}
+
+    def reset(self):
+        '''
+        Start a new set of decisions (e.g. for the next block); returns the
+        {column: [kernel, level]} decisions made so far. The columns stored
+        through their numeric codec are forgotten too.
+        '''
+        decisions = self.decisions
+        self.decisions = {}
+        self.numeric = set()
+        return decisions
+
+    def estimate(self, content, kernel, level):
+        '''
+        (compressed bytes, seconds) of content with kernel at level,
+        extrapolated from its sample
+        '''
+        fraction = SAMPLE_FRACTION if self.min_mb_s is None else BUDGET_SAMPLE_FRACTION
+        sample_size = max(len(content), MIN_TUNE_BYTES) // fraction
+        sample = sample_runs(content, min(self.sample_bytes, sample_size))
+        t1 = time.time()
+        compressed = self.compress(("", sample, kernel, level))[1]
+        seconds = time.time() - t1
+        scale = len(content) / float(max(len(sample), 1))
+        return len(compressed) * scale, seconds * scale
+
+    def __candidates(self, content, raw_bytes, t1, extra_seconds=0):
+        '''
+        [((kernel, level), bytes, seconds)] of content. Under min_mb_s the
+        kernels, cheapest first, stop at the first one estimated slower than
+        the budget over raw_bytes with the tuning time since t1: the slower
+        ones cannot meet it either, so they are not worth sampling.
+        '''
+        candidates = []
+        for kernel in self.kernels:
+            if kernel[0] == "lzma" and len(content) < MIN_LZMA_BYTES:
+                continue
+            size, seconds = self.estimate(content, *kernel)
+            candidates.append((kernel, size, seconds + extra_seconds))
+            if self.min_mb_s is not None and not self.__fast(candidates[-1], raw_bytes, time.time() - t1):
+                break
+        return candidates
+
+    def __fast(self, candidate, raw_bytes, tuning_seconds):
+        return raw_bytes / 1e6 / max(candidate[2] + tuning_seconds, 1e-9) >= self.min_mb_s
+
+    def choose_kernel(self, arcname, content):
+        '''
+        (kernel, level) of a column member, or the one choose_codec picked
+        along with its form
+        '''
+        t1 = time.time()
+        kernel = self.chosen.pop(arcname, None)
+        if kernel is None and len(content) < MIN_TUNE_BYTES:
+            kernel = self.default_kernel
+        elif kernel is None:
+            kernel = self.__pick(self.__candidates(content, len(content), t1), len(content), time.time() - t1)
+        self.decisions[column_key(arcname)] = list(kernel)
+        self.seconds += time.time() - t1
+        return kernel
+
+    def choose_codec(self, name, text, payload, encode_seconds):
+        '''
+        Whether the column name (an arcname without suffix) is stored as its
+        numeric codec payload rather than as text. The kernels are estimated
+        on both forms under the budget, with encode_seconds added to those of
+        the payload, and the kernel picked is kept for the member.
+        '''
+        t1 = time.time()
+        if len(text) < MIN_TUNE_BYTES:
+            self.numeric.add(column_key(name))
+            return True
+        candidates = [(("csv",) + kernel, size, seconds)
+                      for kernel, size, seconds in self.__candidates(text, len(text), t1)]
+        candidates += [(("num",) + kernel, size, seconds)
+                       for kernel, size, seconds in self.__candidates(payload, len(text), t1, encode_seconds)]
+        suffix, kernel, level = self.__pick(candidates, len(text), time.time() - t1)
+        self.chosen["{}.{}".format(name, suffix)] = (kernel, level)
+        if suffix == "num":
+            self.numeric.add(column_key(name))
+        self.seconds += time.time() - t1
+        return suffix == "num"
+
+    def choose_indexed(self, values, shared, kernel, level):
+        '''
+        Whether the level-3 ids of values (with the dictionary entries of the 
+        values not flagged in shared) are estimated smaller than the values as 
+        text, all compressed with kernel
+        '''
+        t1 = time.time()
+        sample = sample_runs(np.asarray(values, dtype=object), self.sample_rows)
+        text = "\n".join(sample).encode("utf-8")
+        if len(text) < MIN_TUNE_BYTES and len(sample) == len(values):
+            return True
+        text_bytes = self.estimate(text, kernel, level)[0]
+        ids, dictionary = index_payloads(sample, self.encode_id, sample_runs(shared, self.sample_rows))
+        indexed_bytes = self.estimate(ids, kernel, level)[0] + self.estimate(dictionary, kernel, level)[0]
+        self.seconds += time.time() - t1
+        return indexed_bytes <= text_bytes
+
+    def __pick(self, candidates, raw_bytes, tuning_seconds=0):
+        '''
+        The (kernel, level) of candidates [((kernel, level), bytes, seconds)]
+        under the budget, where tuning_seconds were spent estimating them
+        '''
+        if self.min_mb_s is not None:
+            fast = [candidate for candidate in candidates if self.__fast(candidate, raw_bytes, tuning_seconds)]
+            if not fast:
+                return min(candidates, key=lambda candidate: candidate[2])[0]
+            candidates = fast
+        if self.min_ratio is not None:
+            reaching = [candidate for candidate in candidates
+                        if raw_bytes / max(candidate[1], 1.0) >= self.min_ratio]
+            if reaching:
+                return min(reaching, key=lambda candidate: candidate[2])[0]
+        smallest = min(candidate[1] for candidate in candidates)
+        near = [candidate for candidate in candidates if candidate[1] <= smallest * (1 + TIE_RATIO)]
+        return min(near, key=lambda candidate: candidate[2])[0]
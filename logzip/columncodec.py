@@ -0,0 +1,254 @@
+# Copyright 2018 The LogPAI Team (https://github.com/logpai).
+#
+# Licensed under the MIT License:
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# =============================================================================
+""" This file implements the binary encodings used for archive members
+"""
+
+import re
+import numpy as np
+
+
+def encode_varint(num):
+    out = bytearray()
+    while num >= 0x80:
+        out.append((num & 0x7F) | 0x80)
+        num >>= 7
+    out.append(num)
+    return bytes(out)
+
+
+def decode_varint(buf, pos):
+    num = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        num |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return num, pos
+        shift += 7
+
+
+def dump_length_prefixed(values):
+    """ Serialize strings as (varint byte length, utf-8 bytes) records
+    """
+    out = bytearray()
+    for value in values:
+        encoded = value.encode("utf-8")
+        out += encode_varint(len(encoded))
+        out += encoded
+    return bytes(out)
+
+
+def load_length_prefixed(buf):
+    values = []
+    pos = 0
+    while pos < len(buf):
+        length, pos = decode_varint(buf, pos)
+        values.append(buf[pos:pos + length].decode("utf-8"))
+        pos += length
+    return values
+
+
+## numeric column codecs
+# A numeric column is stored as:
+#   codec id (1 byte) | varint rows | format (1 byte) | varint width | null flag (1 byte)
+#   [packbits mask of the non-empty rows] | codec body over the non-empty rows
+# codec bodies:
+#   delta: zigzag varints of the successive differences
+#   for:   zigzag varint of the minimum, item size (1 byte), little-endian (value - min)
+# A column encoded in chunks of rows is stored as frames instead:
+#   CODEC_FRAMES (1 byte) | (varint length | payload of the chunk) ...
+CODEC_DELTA = 1
+CODEC_FOR = 2
+CODEC_FRAMES = 3
+CODEC_NAMES = {CODEC_DELTA: "delta", CODEC_FOR: "for"}
+
+FORMAT_DEC = 0        # canonical decimal, e.g. 0, 17, -4
+FORMAT_DEC_FIXED = 1  # zero-padded decimal of a fixed width, e.g. 03616
+FORMAT_HEX = 2        # lower-case hex of a fixed width, e.g. 0a5d2f34
+FORMAT_HEX_UPPER = 3  # upper-case hex of a fixed width, e.g. 0A5D2F34
+
+FORMAT_PATTERNS = [(FORMAT_DEC, r"-?(?:0|[1-9][0-9]{0,17})"),
+                   (FORMAT_DEC_FIXED, r"[0-9]{1,18}"),
+                   (FORMAT_HEX, r"[0-9a-f]{1,15}"),
+                   (FORMAT_HEX_UPPER, r"[0-9A-F]{1,15}")]
+FORMAT_REGEXES = [(fmt, re.compile(r"{0}(?:\n{0})*".format(pattern))) for fmt, pattern in FORMAT_PATTERNS]
+
+
+def zigzag_encode(values):
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def zigzag_decode(values):
+    values = values.astype(np.uint64)
+    return ((values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64))
+
+
+def encode_varints(values):
+    """ Vectorized LEB128 encoding of an uint64 array
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b""
+    shifts = np.arange(10, dtype=np.uint64) * np.uint64(7)
+    groups = (values[:, None] >> shifts) & np.uint64(0x7F)
+    n_bytes = np.maximum(1, np.sum((values[:, None] >> shifts) > 0, axis=1))
+    keep = np.arange(10) < n_bytes[:, None]
+    more = np.arange(10) < (n_bytes[:, None] - 1)
+    groups = (groups | (more * np.uint64(0x80))).astype(np.uint8)
+    return groups[keep].tobytes()
+
+
+def decode_varints(buf):
+    data = np.frombuffer(buf, dtype=np.uint8)
+    if not len(data):
+        return np.array([], dtype=np.uint64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    positions = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    contributions = (data & 0x7F).astype(np.uint64) << (positions.astype(np.uint64) * np.uint64(7))
+    return np.add.reduceat(contributions, starts)
+
+
+def detect_format(values):
+    """ Return (format, width) if every value is an integer this module can
+        round-trip, otherwise None
+    """
+    lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    fixed_width = lengths.min() == lengths.max()
+    joined = "\n".join(values)
+    if joined.count("\n") != len(values) - 1:
+        return None
+    for fmt, regex in FORMAT_REGEXES:
+        if fmt != FORMAT_DEC and not fixed_width:
+            continue
+        if regex.fullmatch(joined):
+            return fmt, int(lengths[0]) if fmt != FORMAT_DEC else 0
+    return None
+
+
+def parse_integers(values, fmt):
+    if fmt in (FORMAT_DEC, FORMAT_DEC_FIXED):
+        return np.array(values, dtype=object).astype(np.int64)
+    return np.array([int(value, 16) for value in values], dtype=np.int64)
+
+
+def format_integers(integers, fmt, width):
+    if fmt == FORMAT_DEC:
+        return integers.astype(str).astype(object)
+    if fmt == FORMAT_DEC_FIXED:
+        return np.char.zfill(integers.astype(str), width).astype(object)
+    spec = "0{}{}".format(width, "x" if fmt == FORMAT_HEX else "X")
+    return np.array([format(int(value), spec) for value in integers], dtype=object)
+
+
+def encode_column(values):
+    """ Encode a column of strings with the smallest numeric codec. Returns 
+        (codec name, payload), or None if the column is not numeric or the 
+        payload is not smaller than the newline-joined text.
+    """
+    values = np.asarray(values, dtype=object)
+    present = values != ""
+    nonempty = values[present]
+    if not len(nonempty):
+        return None
+    detected = detect_format(nonempty)
+    if detected is None:
+        return None
+    fmt, width = detected
+    integers = parse_integers(nonempty, fmt)
+
+    header = bytearray(encode_varint(len(values)))
+    header.append(fmt)
+    header += encode_varint(width)
+    has_nulls = not present.all()
+    header.append(int(has_nulls))
+    if has_nulls:
+        header += np.packbits(present).tobytes()
+
+    deltas = np.diff(integers, prepend=np.int64(0))
+    delta_body = encode_varints(zigzag_encode(deltas))
+    minimum = integers.min()
+    span = (integers - minimum).astype(np.uint64)
+    itemsize = next(size for size, dtype in [(1, np.uint8), (2, np.uint16), (4, np.uint32), (8, np.uint64)]
+                    if span.max() <= np.iinfo(dtype).max)
+    for_body = encode_varint(int(zigzag_encode(np.array([minimum]))[0])) + bytes([itemsize]) \
+               + span.astype("<u{}".format(itemsize)).tobytes()
+    if len(delta_body) <= len(for_body):
+        codec, body = CODEC_DELTA, delta_body
+    else:
+        codec, body = CODEC_FOR, for_body
+    payload = bytes([codec]) + bytes(header) + body
+
+    text_size = sum(len(value) for value in values) + len(values) - 1
+    if len(payload) >= text_size:
+        return None
+    if not np.array_equal(decode_column(payload), values):
+        return None
+    return CODEC_NAMES[codec], payload
+
+
+def dump_frame(payload):
+    """ The length-prefixed payload of one chunk of rows, as stored after 
+        the CODEC_FRAMES byte
+    """
+    return encode_varint(len(payload)) + payload
+
+
+def decode_column(payload):
+    codec = payload[0]
+    if codec == CODEC_FRAMES:
+        frames = []
+        pos = 1
+        while pos < len(payload):
+            length, pos = decode_varint(payload, pos)
+            frames.append(decode_column(payload[pos:pos + length]))
+            pos += length
+        return np.concatenate(frames) if frames else np.array([], dtype=object)
+    n_rows, pos = decode_varint(payload, 1)
+    fmt = payload[pos]
+    width, pos = decode_varint(payload, pos + 1)
+    has_nulls = payload[pos]
+    pos += 1
+    if has_nulls:
+        n_mask_bytes = (n_rows + 7) // 8
+        present = np.unpackbits(np.frombuffer(payload[pos:pos + n_mask_bytes], dtype=np.uint8),
+                                count=n_rows).astype(bool)
+        pos += n_mask_bytes
+    else:
+        present = np.ones(n_rows, dtype=bool)
+
+    if codec == CODEC_DELTA:
+        integers = np.cumsum(zigzag_decode(decode_varints(payload[pos:])))
+    elif codec == CODEC_FOR:
+        minimum, pos = decode_varint(payload, pos)
+        minimum = zigzag_decode(np.array([minimum], dtype=np.uint64))[0]
+        itemsize = payload[pos]
+        span = np.frombuffer(payload[pos + 1:], dtype="<u{}".format(itemsize)).astype(np.int64)
+        integers = span + minimum
+    else:
+        raise RuntimeError(f"Unknown column codec {codec}!")
+
+    values = np.full(n_rows, "", dtype=object)
+    values[present] = format_integers(integers, fmt, width)
+    return values
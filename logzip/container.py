@@ -0,0 +1,248 @@
+# Copyright 2018 The LogPAI Team (https://github.com/logpai).
+#
+# Licensed under the MIT License:
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# =============================================================================
+""" This file implements the container of independently compressed members:
+
+    MAGIC | members | index | footer | members | index | footer | ...
+
+    Each write (the first one and every append) adds its members, then an 
+    index of them and a footer: the index offset and the end of the previous 
+    footer (0 for the first one), 8 bytes each, big endian, and MAGIC. The 
+    index lists the names of the earlier members it replaces, then (name, 
+    offset, size) of its own, so any member can be read without touching the 
+    others and an append writes an index of its own members only. The bytes 
+    of the container an append extends are never overwritten: until the new 
+    footer is on disk the previous one is the last valid footer and is read 
+    instead.
+"""
+
+import os
+import mmap
+import struct
+from . import columncodec
+
+MAGIC = b"LOGZIPC2"
+FOOTER_SIZE = 16 + len(MAGIC)
+READ_SIZE = 1 << 20
+
+
+def read_index(mm, path):
+    """ Return (end of the last valid footer, [(name, offset, size)] of the 
+        current members in the order added, bytes taken by the indexes and 
+        footers). Bytes after that footer are the torn tail of an interrupted 
+        append.
+    """
+    if mm[:len(MAGIC)] != MAGIC:
+        raise RuntimeError(f"{path} is not a logzip container!")
+    end = len(mm)
+    while end >= len(MAGIC) + FOOTER_SIZE:
+        if mm[end - len(MAGIC):end] == MAGIC and parse_segment(mm, end) is not None:
+            break
+        end = mm.rfind(MAGIC, len(MAGIC), end - 1)
+        if end == -1:
+            raise RuntimeError(f"{path} is not a logzip container!")
+        end += len(MAGIC)
+    else:
+        raise RuntimeError(f"{path} is not a logzip container!")
+    segments = []
+    segment_end = end
+    while segment_end:
+        segment = parse_segment(mm, segment_end)
+        if segment is None:
+            raise RuntimeError(f"{path} has a corrupted index!")
+        segments.append(segment)
+        segment_end = segment[0]
+    members = {}
+    index_bytes = 0
+    for _, removed, added, size in reversed(segments):
+        for name in removed:
+            members.pop(name, None)
+        for name, offset, size_ in added:
+            members.pop(name, None)
+            members[name] = (name, offset, size_)
+        index_bytes += size
+    return end, list(members.values()), index_bytes
+
+
+def parse_segment(mm, end):
+    """ (end of the previous footer, names replaced, [(name, offset, size)] 
+        added, bytes of index and footer) of the footer ending at end, or None 
+        if the bytes there are not a consistent index
+    """
+    index_offset, previous_end = struct.unpack(">QQ", mm[end - FOOTER_SIZE:end - len(MAGIC)])
+    if not (len(MAGIC) <= index_offset <= end - FOOTER_SIZE and previous_end <= index_offset
+            and (previous_end == 0 or previous_end >= len(MAGIC) + FOOTER_SIZE)):
+        return None
+    index = mm[index_offset:end - FOOTER_SIZE]
+    first_offset = max(previous_end, len(MAGIC))
+    try:
+        n_removed, pos = columncodec.decode_varint(index, 0)
+        removed = []
+        for _ in range(n_removed):
+            length, pos = columncodec.decode_varint(index, pos)
+            removed.append(index[pos:pos + length].decode("utf-8"))
+            pos += length
+        n_added, pos = columncodec.decode_varint(index, pos)
+        added = []
+        for _ in range(n_added):
+            length, pos = columncodec.decode_varint(index, pos)
+            name = index[pos:pos + length].decode("utf-8")
+            offset, pos = columncodec.decode_varint(index, pos + length)
+            size, pos = columncodec.decode_varint(index, pos)
+            if offset < first_offset or offset + size > index_offset:
+                return None
+            added.append((name, offset, size))
+    except (IndexError, UnicodeDecodeError):
+        return None
+    if pos != len(index):
+        return None
+    return previous_end, removed, added, end - index_offset
+
+
+class ContainerWriter(object):
+    def __init__(self, path, append=False, replace=()):
+        """ With append, the members of an existing container at path are kept 
+            and new ones are added after its last footer; the members named in 
+            replace, and those added again, are dropped from the index and 
+            their bytes become dead space. The container stays readable 
+            through its old footer until commit (or close) has written and 
+            synced the new one; close then rewrites it without the dead space 
+            once that is larger than the rest.
+        """
+        self.path = path
+        self.added = []
+        self.removed = []
+        if append and os.path.isfile(path):
+            with open(path, "rb") as fr:
+                with mmap.mmap(fr.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    self.previous_end, members, self.index_bytes = read_index(mm, path)
+            self.removed = [name for name, _, _ in members if name in replace]
+            self.members = {name: size for name, _, size in members if name not in replace}
+            self.fw = open(path, "r+b")
+            # drop only a torn tail left by an interrupted append
+            self.fw.seek(self.previous_end)
+            self.fw.truncate()
+            self.offset = self.previous_end
+        else:
+            self.fw = open(path, "wb")
+            self.fw.write(MAGIC)
+            self.offset = len(MAGIC)
+            self.previous_end = 0
+            self.members = {}
+            self.index_bytes = 0
+
+    def add(self, name, content):
+        if self.members.pop(name, None) is not None:
+            self.removed.append(name)
+        self.fw.write(content)
+        self.added.append((name, self.offset, len(content)))
+        self.offset += len(content)
+
+    def add_file(self, name, filepath):
+        """ Add the content of filepath, copied in READ_SIZE reads
+        """
+        if self.members.pop(name, None) is not None:
+            self.removed.append(name)
+        offset = self.offset
+        with open(filepath, "rb") as fr:
+            for chunk in iter(lambda: fr.read(READ_SIZE), b""):
+                self.fw.write(chunk)
+                self.offset += len(chunk)
+        self.added.append((name, offset, self.offset - offset))
+
+    def commit(self):
+        """ Write the index of the members added since the last commit and a 
+            footer, and sync them, so the container on disk holds them
+        """
+        index = bytearray(columncodec.encode_varint(len(self.removed)))
+        index += columncodec.dump_length_prefixed(self.removed)
+        index += columncodec.encode_varint(len(self.added))
+        for name, offset, size in self.added:
+            index += columncodec.dump_length_prefixed([name])
+            index += columncodec.encode_varint(offset)
+            index += columncodec.encode_varint(size)
+        self.fw.write(bytes(index))
+        self.fw.write(struct.pack(">QQ", self.offset, self.previous_end))
+        self.fw.write(MAGIC)
+        self.fw.flush()
+        os.fsync(self.fw.fileno())
+        self.members.update((name, size) for name, _, size in self.added)
+        self.index_bytes += len(index) + FOOTER_SIZE
+        self.offset += len(index) + FOOTER_SIZE
+        self.previous_end = self.offset
+        self.added = []
+        self.removed = []
+
+    def close(self):
+        appended = self.previous_end != 0
+        self.commit()
+        self.fw.close()
+        live_size = len(MAGIC) + sum(self.members.values()) + self.index_bytes
+        if appended and self.offset > 2 * live_size:
+            self._compact()
+
+    def _compact(self):
+        """ Copy the members to a new container and move it over path, so an 
+            interruption leaves either container whole
+        """
+        tmp_path = self.path + ".tmp"
+        with ContainerReader(self.path) as reader:
+            with ContainerWriter(tmp_path) as writer:
+                for name in reader.names():
+                    writer.add(name, reader.read(name))
+        os.replace(tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ContainerReader(object):
+    def __init__(self, path):
+        self.path = path
+        self.fr = open(path, "rb")
+        self.mm = mmap.mmap(self.fr.fileno(), 0, access=mmap.ACCESS_READ)
+        _, members, _ = read_index(self.mm, path)
+        self.members = {name: (offset, size) for name, offset, size in members}
+
+    def names(self):
+        return list(self.members)
+
+    def read(self, name):
+        offset, size = self.members[name]
+        return self.mm[offset:offset + size]
+
+    def close(self):
+        self.mm.close()
+        self.fr.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def is_container(path):
+        with open(path, "rb") as fr:
+            return fr.read(len(MAGIC)) == MAGIC
@@ -0,0 +1,240 @@
+# Copyright 2018 The LogPAI Team (https://github.com/logpai).
+#
+# Licensed under the MIT License:
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# =============================================================================
+""" This file implements the compression of many log files in one run (see
+    ZipBatch):
+
+    $ python3 -m logzip.logbatch out/ "logs/*.log" --templates templates.txt --logformat "..." --n-workers 8
+    $ python3 -m logzip.logbatch out/ logs/ --logformat "..." --n-workers 8
+
+    The templates are compiled into one match tree (or mined once from lines
+    sampled across the files) that is handed once to every process of one
+    long-lived pool. Each file is then a job, compressed by a single-process
+    Ziplog in its own scratch directory, largest files first. The archives
+    keep the layout of the input files under outdir, and the result of every
+    job and the aggregate throughput go to outdir/batch.report.json.
+"""
+
+import argparse
+import fnmatch
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+import multiprocessing as mp
+import pandas as pd
+from . import logloader
+from .logzipper import Ziplog
+from .metrics import RunMetrics
+
+_job_state = {}
+
+
+def collect_files(sources, pattern="*", exclude_dir=None):
+    """ [(filepath, relpath)] of the files of sources (directories, walked
+        recursively for names matching pattern, or glob patterns), relpath
+        being relative to the deepest directory holding all of them. Files
+        under exclude_dir are skipped.
+    """
+    filepaths = set()
+    for source in sources:
+        if os.path.isdir(source):
+            for dirpath, _, filenames in os.walk(source):
+                filepaths.update(os.path.join(dirpath, filename)
+                                 for filename in fnmatch.filter(filenames, pattern))
+        else:
+            filepaths.update(filepath for filepath in glob.glob(source, recursive=True)
+                             if os.path.isfile(filepath))
+    filepaths = sorted(os.path.abspath(filepath) for filepath in filepaths)
+    if exclude_dir is not None:
+        exclude_dir = os.path.abspath(exclude_dir)
+        filepaths = [filepath for filepath in filepaths
+                     if os.path.commonpath([filepath, exclude_dir]) != exclude_dir]
+    if not filepaths:
+        return []
+    root = os.path.commonpath([os.path.dirname(filepath) for filepath in filepaths])
+    return [(filepath, os.path.relpath(filepath, root)) for filepath in filepaths]
+
+
+def _init_worker(bundle, zip_kwargs):
+    _job_state["bundle"] = bundle
+    _job_state["zip_kwargs"] = zip_kwargs
+
+
+def _zip_job(job):
+    filepath, outdir, outname, scratch_root, chunk_lines = job
+    scratch = tempfile.mkdtemp(prefix="job_", dir=scratch_root)
+    result = {"file": filepath, "input_bytes": os.path.getsize(filepath)}
+    try:
+        zipper = Ziplog(outdir=outdir, outname=outname, tmp_dir=scratch, n_workers=1,
+                        metrics=RunMetrics(quiet=True), **_job_state["zip_kwargs"])
+        zipper.zip_file(filepath, _job_state["bundle"], chunk_lines=chunk_lines)
+        archive_path = zipper.archive_path()
+        result.update({"archive": archive_path, "archive_bytes": os.path.getsize(archive_path),
+                       "lines": zipper.metrics.counters.get("lines", 0), "seconds": zipper.total_time})
+    except Exception:
+        result["error"] = traceback.format_exc()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return result
+
+
+class ZipBatch(object):
+    def __init__(self, logformat, outdir, n_workers=1, chunk_lines=None, scratch_dir=None,
+                 mine_lines=200000, mine_files=16, metrics=None, **zip_kwargs):
+        '''
+        zip_kwargs are passed to the Ziplog of every job (kernel, level,
+        block_lines, column_kernel, ...); each job runs in one process of the
+        n_workers pool, in a scratch directory of its own under scratch_dir
+        (by default a temporary directory removed after the batch).
+        '''
+        self.logformat = logformat
+        self.outdir = outdir
+        self.n_workers = n_workers
+        self.chunk_lines = chunk_lines
+        self.scratch_dir = scratch_dir
+        self.mine_lines = mine_lines
+        self.mine_files = mine_files
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.zip_kwargs = dict(zip_kwargs, logformat=logformat)
+        self.results = []
+        self.total_time = 0
+
+        if not os.path.isdir(self.outdir):
+            os.makedirs(self.outdir)
+
+    def zip_files(self, sources, templates_filepath=None, pattern="*"):
+        '''
+        Compress every file of sources (see collect_files) into
+        outdir/{relpath}.logzip[.lzc|.tar.*]. Without templates_filepath, the
+        templates are mined from lines sampled across (up to mine_files of)
+        the files. A failed job does not stop the batch; its traceback is in
+        its result. Returns the batch report.
+        '''
+        files = collect_files(sources, pattern, exclude_dir=self.outdir)
+        if not files:
+            raise RuntimeError("No log files found in {}!".format(", ".join(sources)))
+        t1 = time.time()
+        with self.metrics.stage("templates"):
+            bundle = self.__load_bundle(files, templates_filepath)
+        scratch_root = tempfile.mkdtemp(prefix="logzip_batch_", dir=self.scratch_dir)
+        jobs = []
+        for filepath, relpath in files:
+            outdir = os.path.join(self.outdir, os.path.dirname(relpath))
+            if not os.path.isdir(outdir):
+                os.makedirs(outdir)
+            jobs.append((filepath, outdir, os.path.basename(relpath) + ".logzip", scratch_root, self.chunk_lines))
+        # largest first, so that one big file does not start last
+        jobs.sort(key=lambda job: -os.path.getsize(job[0]))
+        self.results = []
+        try:
+            with self.metrics.stage("compress_files"):
+                if self.n_workers > 1:
+                    with mp.Pool(processes=self.n_workers, initializer=_init_worker,
+                                 initargs=(bundle, self.zip_kwargs)) as pool:
+                        for result in pool.imap_unordered(_zip_job, jobs):
+                            self.__record(result, len(jobs))
+                else:
+                    _init_worker(bundle, self.zip_kwargs)
+                    for job in jobs:
+                        self.__record(_zip_job(job), len(jobs))
+        finally:
+            shutil.rmtree(scratch_root, ignore_errors=True)
+        self.total_time = time.time() - t1
+        return self.__write_report()
+
+    def __load_bundle(self, files, templates_filepath):
+        zipper = Ziplog(outdir=self.outdir, outname="batch", n_workers=self.n_workers, metrics=self.metrics,
+                        run_report=False, mine_lines=self.mine_lines, **self.zip_kwargs)
+        if templates_filepath is not None:
+            return zipper.load_templates(templates_filepath)
+        # the mined population is spread over files evenly spaced in the batch
+        step = max(len(files) // self.mine_files, 1)
+        sampled = files[::step][:self.mine_files]
+        loader = logloader.LogLoader(self.logformat, None, metrics=self.metrics)
+        contents = pd.concat([loader.sample_to_dataframe(filepath, max(self.mine_lines // len(sampled), 1))["Content"]
+                              for filepath, _ in sampled])
+        return zipper.mine_templates(contents)
+
+    def __record(self, result, n_jobs):
+        self.results.append(result)
+        self.metrics.count("files")
+        self.metrics.count("input_bytes", result["input_bytes"])
+        if "error" in result:
+            self.metrics.count("failed_files")
+            self.metrics.log("[{}/{}] {} failed:\n{}".format(len(self.results), n_jobs, result["file"],
+                                                              result["error"]))
+            return
+        self.metrics.count("lines", result["lines"])
+        self.metrics.count("archive_bytes", result["archive_bytes"])
+        self.metrics.log("[{}/{}] {} -> {} ({:.2f}s, {:.2f} MB/s)".format(
+                         len(self.results), n_jobs, result["file"], result["archive"], result["seconds"],
+                         result["input_bytes"] / 1e6 / max(result["seconds"], 1e-9)))
+
+    def __write_report(self):
+        '''
+        Aggregate throughput is the input bytes (lines) of all jobs over the
+        wall time of the batch, template loading included
+        '''
+        counters = self.metrics.counters
+        total_time = max(self.total_time, 1e-9)
+        self.metrics.gauge("mb_s", counters.get("input_bytes", 0) / 1e6 / total_time)
+        self.metrics.gauge("lines_s", counters.get("lines", 0) / total_time)
+        self.metrics.log("Compressed {} files ({} failed, {:.1f} MB, {} lines) in {:.2f}s with {} workers: "
+                         "{:.2f} MB/s, {:.0f} lines/s".format(
+                         counters.get("files", 0), counters.get("failed_files", 0),
+                         counters.get("input_bytes", 0) / 1e6, counters.get("lines", 0), self.total_time,
+                         self.n_workers, self.metrics.gauges["mb_s"], self.metrics.gauges["lines_s"]))
+        extra = {"total_time": self.total_time, "n_workers": self.n_workers, "results": self.results}
+        return self.metrics.write_report(os.path.join(self.outdir, "batch.report.json"), extra)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compress many log files with one process pool and match tree.")
+    parser.add_argument("outdir")
+    parser.add_argument("sources", nargs="+", help="directories or glob patterns")
+    parser.add_argument("--logformat", required=True)
+    parser.add_argument("--templates", help="templates file or bundle; mined from the files if omitted")
+    parser.add_argument("--pattern", default="*", help="file names to take from directories")
+    parser.add_argument("--n-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--kernel", default="gz")
+    parser.add_argument("--level", type=int, default=3)
+    parser.add_argument("--chunk-lines", type=int)
+    parser.add_argument("--block-lines", type=int)
+    parser.add_argument("--column-kernel", action="store_true")
+    parser.add_argument("--auto-tune", action="store_true", help="choose kernel and indexing per column")
+    parser.add_argument("--min-mb-s", type=float, help="with --auto-tune, the least MB/s per column")
+    parser.add_argument("--min-ratio", type=float, help="with --auto-tune, the compression ratio to reach")
+    parser.add_argument("--scratch-dir", help="where the per-job scratch directories are created")
+    args = parser.parse_args()
+
+    batch = ZipBatch(args.logformat, args.outdir, n_workers=args.n_workers, chunk_lines=args.chunk_lines,
+                     scratch_dir=args.scratch_dir, kernel=args.kernel, level=args.level,
+                     block_lines=args.block_lines, column_kernel=args.column_kernel, auto_tune=args.auto_tune,
+                     tune_min_mb_s=args.min_mb_s, tune_min_ratio=args.min_ratio)
+    report = batch.zip_files(args.sources, args.templates, args.pattern)
+    sys.exit(1 if report["counters"].get("failed_files") else 0)
+
+if __name__ == "__main__":
+    main()
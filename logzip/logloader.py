@@ -22,65 +22,238 @@
 """ This file implements the formating interface to load log file to dataframe
 """
 
-import sys
 import pandas as pd
 import re
 import multiprocessing as mp
-from itertools import groupby, count, chain
+from itertools import islice
 import numpy as np
 import json
 import os
-import io
+import mmap
 import time
+import queue
+import threading
+from .metrics import RunMetrics
 
 class LogLoader(object):
-    def __init__(self, logformat, tmp_dir, n_workers=1):
+    def __init__(self, logformat, tmp_dir, n_workers=1, metrics=None):
         if not logformat:
             raise RuntimeError('Logformat is required!')
         self.logformat = logformat.strip()
         self.headers, self.regex = self._generate_logformat_regex(self.logformat)
+        self.splitter = HeaderSplitter(self.logformat, self.headers, self.regex)
         self.n_workers = n_workers
         self.tmp_dir = tmp_dir
+        self.failed_messages = {}
+        self.failed_lock = threading.Lock()
+        self.total_lines = 0
+        self.metrics = metrics if metrics is not None else RunMetrics()
 
     def load_to_dataframe(self, log_filepath):
         """ Function to transform log file to dataframe 
         """
-        print('Loading log messages to dataframe...')
+        self.metrics.log('Loading log messages to dataframe...')
         t1 = time.time()
-        lines = []
-        with open(log_filepath, 'r', encoding="utf-8", errors="ignore") as fid:
-            lines = fid.readlines()
-        print("Total lines {}".format(len(lines)))
-        log_messages = []
-        failed_messages = {}
-        if self.n_workers == 1: 
-            log_messages, failed_messages = formalize_message(enumerate(lines), self.regex, self.headers)
-        else:
-            chunk_size = min(1000000, len(lines) // float(self.n_workers))
-            chunks = groupby(enumerate(lines), key=lambda k, line=count(): next(line)//chunk_size)
-            log_chunks = [list(chunk) for _, chunk in chunks]
-            print('Read %d log chunks in parallel'%len(log_chunks))
-            pool = mp.Pool(processes=self.n_workers)
-            result_chunks = []
-            for cidx, chunk in enumerate(log_chunks, 1):
-                result_chunks.append(pool.apply_async(formalize_message,
-                                     args=(chunk, self.regex, self.headers)))
-            pool.close()
-            pool.join()
-            for result in result_chunks:
-                result = result.get()
-                log_messages.extend(result[0])
-                failed_messages.update(result[1])
-        with open(os.path.join(self.tmp_dir, "failed_logs.json"), "w") as fw:
-            json.dump(failed_messages, fw)
-
-        log_dataframe = pd.DataFrame(log_messages, columns=['LineId'] + self.headers)
-        success_rate = len(log_messages) / float(len(lines))
-        print('Loading {} messages done, loading rate: {:.1%}, failed lines: {}'.format(len(log_messages), success_rate, len(failed_messages)))
+        with self.metrics.stage("load"):
+            if self.n_workers == 1: 
+                lines = []
+                # lines end at "\n" only, as in the byte ranges of _load_parallel
+                with open(log_filepath, 'r', encoding="utf-8", errors="ignore", newline="\n") as fid:
+                    lines = fid.readlines()
+                total_lines = len(lines)
+                self.metrics.log("Total lines {}".format(total_lines))
+                log_messages, failed_messages = formalize_message(enumerate(lines), self.splitter)
+                log_dataframe = pd.DataFrame(log_messages, columns=['LineId'] + self.headers)
+            else:
+                log_dataframe, failed_messages, total_lines = self._load_parallel(log_filepath)
+        self._dump_failed(failed_messages)
+
+        self.total_lines = total_lines
+        self._count_lines(total_lines, len(log_dataframe), len(failed_messages))
+        success_rate = len(log_dataframe) / float(max(total_lines, 1))
+        self.metrics.log('Loading {} messages done, loading rate: {:.1%}, failed lines: {}'.format(len(log_dataframe), success_rate, len(failed_messages)))
         t2 = time.time()
-        print('Time taken {:.2f}s'.format(t2-t1))
+        self.metrics.log('Time taken {:.2f}s'.format(t2-t1))
         return log_dataframe
 
+    def _count_lines(self, n_lines, n_messages, n_failed):
+        self.metrics.count("lines", n_lines)
+        self.metrics.count("messages", n_messages)
+        self.metrics.count("failed_lines", n_failed)
+
+    def iter_stream(self, line_source, flush_lines=100000, flush_bytes=1 << 26, flush_seconds=10.0):
+        """ Function to transform lines from an iterable that may block (a pipe, 
+            tail_lines) to dataframes, one per segment. A segment is yielded once 
+            it holds flush_lines lines or flush_bytes bytes, or flush_seconds 
+            after its first line. Lines are read by a thread into a bounded queue, 
+            so a quiet source does not hold back a due segment. total_lines 
+            covers the segments yielded so far, and failed_messages their failed 
+            lines except those removed by take_failed, so a consumer taking them 
+            keeps memory bounded over a long-running stream.
+        """
+        lines_queue = queue.Queue(maxsize=flush_lines)
+        errors = []
+        def read_lines():
+            try:
+                for line in line_source:
+                    lines_queue.put(line)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                lines_queue.put(None)
+        threading.Thread(target=read_lines, daemon=True).start()
+
+        self.failed_messages = {}
+        self.total_lines = 0
+        finished = False
+        while not finished:
+            lines = []
+            n_bytes = 0
+            deadline = None
+            while len(lines) < flush_lines and n_bytes < flush_bytes:
+                timeout = None if deadline is None else deadline - time.time()
+                if timeout is not None and timeout <= 0:
+                    break
+                try:
+                    line = lines_queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if line is None:
+                    finished = True
+                    break
+                if deadline is None:
+                    deadline = time.time() + flush_seconds
+                lines.append(line)
+                n_bytes += len(line)
+            if errors:
+                raise errors[0]
+            if not lines:
+                continue
+            with self.metrics.stage("load"):
+                log_messages, failed_chunk = formalize_message(enumerate(lines, self.total_lines),
+                                                               self.splitter)
+            self.total_lines += len(lines)
+            with self.failed_lock:
+                self.failed_messages.update(failed_chunk)
+            self._count_lines(len(lines), len(log_messages), len(failed_chunk))
+            self.metrics.log('Segment of {} lines ({} bytes), total lines {}'.format(len(lines), n_bytes, self.total_lines))
+            yield pd.DataFrame(log_messages, columns=['LineId'] + self.headers)
+
+    def take_failed(self):
+        """ Remove and return the failed lines collected so far, so that a 
+            consumer storing them with its own chunks does not keep them twice
+        """
+        with self.failed_lock:
+            failed_messages = self.failed_messages
+            self.failed_messages = {}
+        return failed_messages
+
+    def _dump_failed(self, failed_messages):
+        """ Failed lines are kept in self.failed_messages, and also written to 
+            tmp_dir/failed_logs.json if a tmp_dir is given
+        """
+        self.failed_messages = failed_messages
+        if self.tmp_dir:
+            with open(os.path.join(self.tmp_dir, "failed_logs.json"), "w") as fw:
+                json.dump(failed_messages, fw)
+
+    def _load_parallel(self, log_filepath):
+        """ Workers receive newline-aligned byte ranges of the file, read them 
+            through mmap and send back columnar results, so no line lists are 
+            pickled to the workers
+        """
+        byte_ranges = split_byte_ranges(log_filepath, self.n_workers * 4)
+        self.metrics.log('Read %d log chunks in parallel'%len(byte_ranges))
+        with mp.Pool(processes=self.n_workers) as pool:
+            results = pool.starmap(formalize_range, 
+                                   [(log_filepath, start, end, self.splitter) 
+                                    for start, end in byte_ranges])
+        line_ids = []
+        columns = [[] for _ in self.headers]
+        failed_messages = {}
+        total_lines = 0
+        for n_lines, chunk_ids, chunk_columns, chunk_failed in results:
+            line_ids.append(chunk_ids + total_lines + 1)
+            for column, chunk_column in zip(columns, chunk_columns):
+                column.extend(chunk_column.split("\n") if len(chunk_ids) else [])
+            failed_messages.update({line_count + total_lines: line for line_count, line in chunk_failed.items()})
+            total_lines += n_lines
+        self.metrics.log("Total lines {}".format(total_lines))
+        log_dataframe = pd.DataFrame(dict(zip(self.headers, columns)), columns=self.headers)
+        log_dataframe.insert(0, 'LineId', np.concatenate(line_ids) if line_ids else np.array([], dtype=np.int64))
+        return log_dataframe, failed_messages, total_lines
+
+    def iter_dataframes(self, log_filepath, chunk_lines=100000):
+        """ Function to lazily transform log file to dataframes of at most 
+            chunk_lines lines, so that no more than one window is held in memory. 
+            failed_messages holds the failed lines of the chunks read so far, 
+            except those removed by take_failed.
+        """
+        self.metrics.log('Streaming log messages in chunks of {} lines...'.format(chunk_lines))
+        t1 = time.time()
+        total_lines = 0
+        total_messages = 0
+        n_failed = 0
+        self.failed_messages = {}
+        with open(log_filepath, 'r', encoding="utf-8", errors="ignore", newline="\n") as fid:
+            while True:
+                with self.metrics.stage("load"):
+                    lines = list(islice(fid, chunk_lines))
+                    if lines:
+                        log_messages, failed_chunk = formalize_message(enumerate(lines, total_lines),
+                                                                       self.splitter)
+                        log_dataframe = pd.DataFrame(log_messages, columns=['LineId'] + self.headers)
+                if not lines:
+                    break
+                total_lines += len(lines)
+                total_messages += len(log_messages)
+                n_failed += len(failed_chunk)
+                with self.failed_lock:
+                    self.failed_messages.update(failed_chunk)
+                self._count_lines(len(lines), len(log_messages), len(failed_chunk))
+                del lines, log_messages
+                yield log_dataframe
+                del log_dataframe
+        self._dump_failed(self.failed_messages)
+
+        self.total_lines = total_lines
+        success_rate = total_messages / float(max(total_lines, 1))
+        self.metrics.log('Loading {} messages done, loading rate: {:.1%}, failed lines: {}'.format(total_messages, success_rate, n_failed))
+        t2 = time.time()
+        self.metrics.log('Time taken {:.2f}s'.format(t2-t1))
+
+    def sample_to_dataframe(self, log_filepath, n_lines, n_runs=64, seed=0):
+        """ Function to transform about n_lines lines of a log file to a
+            dataframe without reading the whole file: n_runs runs of
+            consecutive lines are read from random offsets. A run starting 
+            inside lines already read continues after them, so no line is read 
+            twice; a file of at most n_lines lines is read whole. LineIds are 
+            not meaningful, and failed lines are dropped.
+        """
+        file_size = os.path.getsize(log_filepath)
+        lines = []
+        with self.metrics.stage("load"):
+            with open(log_filepath, 'rb') as fid:
+                if count_lines(fid, n_lines + 1) <= n_lines:
+                    offsets = [0]
+                    run_lines = n_lines
+                else:
+                    rng = np.random.RandomState(seed)
+                    offsets = np.unique(rng.randint(0, file_size, size=n_runs))
+                    run_lines = -(-n_lines // len(offsets))
+                pos = 0
+                for offset in offsets:
+                    if offset <= pos:
+                        fid.seek(pos)
+                    else:
+                        fid.seek(offset)
+                        fid.readline() # skip the partial line
+                    lines.extend(line.decode("utf-8", errors="ignore") for line in islice(fid, run_lines))
+                    pos = fid.tell()
+            log_messages, _ = formalize_message(enumerate(lines), self.splitter)
+        self.metrics.log('Sampled {} lines from {} runs'.format(len(lines), len(offsets)))
+        return pd.DataFrame(log_messages, columns=['LineId'] + self.headers)
+
     def _generate_logformat_regex(self, logformat):
         """ Function to generate regular expression to split log messages
         """
@@ -89,7 +262,7 @@ class LogLoader(object):
         regex = ''
         for k in range(len(splitters)):
             if k % 2 == 0:
-                splitter = re.sub(' +', '\s+', splitters[k])
+                splitter = re.sub(' +', r'\\s+', splitters[k])
                 regex += splitter
             else:
                 header = splitters[k].strip('<').strip('>')
@@ -103,22 +276,166 @@ class LogLoader(object):
         return headers, regex
 
 
-def formalize_message(enumerated_lines, regex, headers):
-    print("Worker {} processing.".format(os.getpid()))
+nonascii_regex = re.compile(r'[^\x00-\x7F]+')
+regex_specials = set(".^$*+?{}[]\\|()")
+
+class HeaderSplitter(object):
+    """ Split a line into the headers of a logformat exactly as its regex 
+        (LogLoader._generate_logformat_regex) does, but with str.split, 
+        str.partition and str.find where the format allows it. The literal 
+        between two headers becomes one step: a run of spaces that follows 
+        whitespace (or starts the line) joins one bounded str.split with the 
+        runs around it, "lit" is a str.partition, "lit " a str.find, and any 
+        other literal a search of its own small regex. Each step takes the 
+        leftmost match, as the lazy groups do, so whenever the steps succeed 
+        they give the regex's result; a line they cannot split goes through the 
+        regex, which may still succeed by backtracking. Formats with text before 
+        the first or after the last header, or regex characters in a literal, 
+        always use the regex.
+    """
+    def __init__(self, logformat, headers, regex):
+        self.headers = headers
+        self.regex = regex
+        self.steps = self._compile_steps(logformat)
+
+    def _compile_steps(self, logformat):
+        literals = re.split(r'<[^<>]+>', logformat)
+        if len(literals) < 2 or literals[0] or literals[-1]:
+            return None
+        steps = []
+        after_space = True # lines are stripped, so the first header starts with non-whitespace
+        for literal in literals[1:-1]:
+            if not literal or regex_specials.intersection(literal):
+                return None
+            if after_space and not literal.strip(" "):
+                if steps and steps[-1][0] == "split":
+                    steps[-1] = ("split", steps[-1][1] + 1)
+                else:
+                    steps.append(("split", 1))
+            elif not any(char.isspace() for char in literal):
+                steps.append(("partition", literal))
+            elif literal.strip(" ") and literal.endswith(" ") and not any(char.isspace() for char in literal.rstrip(" ")):
+                steps.append(("find", literal.rstrip(" ")))
+            else:
+                steps.append(("search", re.compile(re.sub(' +', r'\\s+', literal))))
+            after_space = literal.endswith(" ")
+        return steps
+
+    def split(self, line):
+        """ Header values of line, or None if it does not match the logformat
+        """
+        if self.steps is not None and "\n" not in line:
+            fields = self._split_steps(line)
+            if fields is not None:
+                return fields
+        match = self.regex.search(line)
+        return list(match.groups()) if match else None
+
+    def _split_steps(self, rest):
+        fields = []
+        for kind, arg in self.steps:
+            if kind == "split":
+                parts = rest.split(None, arg)
+                if len(parts) <= arg:
+                    return None
+                rest = parts.pop()
+                fields.extend(parts)
+            elif kind == "partition":
+                field, sep, rest = rest.partition(arg)
+                if not sep:
+                    return None
+                fields.append(field)
+            elif kind == "find":
+                idx = rest.find(arg)
+                end = idx + len(arg)
+                while idx != -1 and not (end < len(rest) and rest[end].isspace()):
+                    idx = rest.find(arg, idx + 1)
+                    end = idx + len(arg)
+                if idx == -1:
+                    return None
+                fields.append(rest[:idx])
+                rest = rest[end:].lstrip()
+            else:
+                match = arg.search(rest)
+                if not match:
+                    return None
+                fields.append(rest[:match.start()])
+                rest = rest[match.end():]
+        fields.append(rest)
+        return fields
+
+
+def formalize_message(enumerated_lines, splitter):
     log_messages = []
     failed_messages = {}
+    split = splitter.split
     for line_count, line in enumerated_lines:
         line = line.strip()
         if not line:
             continue
-        line = re.sub(r'[^\x00-\x7F]+', '<NASCII>', line)
-        try:
-            match = regex.search(line)
-            message = [match.group(header) for header in headers]
-            message.insert(0, line_count + 1)
-            log_messages.append(message)
-        except Exception as e:
+        if not line.isascii():
+            line = nonascii_regex.sub('<NASCII>', line)
+        message = split(line)
+        if message is None:
             failed_messages[line_count] = line
-            pass
-    print("Worker {} finish.".format(os.getpid()))
-    return log_messages, failed_messages
\ No newline at end of file
+            continue
+        message.insert(0, line_count + 1)
+        log_messages.append(message)
+    return log_messages, failed_messages
+
+
+def count_lines(fid, max_lines, block_size=1 << 20):
+    """ Number of lines of a binary file, or some number above max_lines once 
+        more lines than that are found. The file is rewound afterwards.
+    """
+    n_lines = 0
+    last = b"\n"
+    while n_lines <= max_lines:
+        block = fid.read(block_size)
+        if not block:
+            break
+        n_lines += block.count(b"\n")
+        last = block[-1:]
+    fid.seek(0)
+    return n_lines + (last != b"\n")
+
+
+def split_byte_ranges(log_filepath, n_ranges, min_range_size=1 << 20):
+    """ Split a file into at most n_ranges (start, end) byte ranges whose 
+        boundaries fall right after a newline
+    """
+    file_size = os.path.getsize(log_filepath)
+    if file_size == 0:
+        return []
+    range_size = max(min_range_size, file_size // max(n_ranges, 1))
+    byte_ranges = []
+    with open(log_filepath, 'rb') as fid:
+        with mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while start < file_size:
+                end = mm.find(b"\n", min(start + range_size, file_size) - 1)
+                end = file_size if end == -1 else end + 1
+                byte_ranges.append((start, end))
+                start = end
+    return byte_ranges
+
+
+def formalize_range(log_filepath, byte_start, byte_end, splitter):
+    """ Parse the lines in [byte_start, byte_end) of a file through mmap. 
+        Returns the number of lines, the (0-based, range-local) line indices 
+        as an array, one newline-joined string per header and failed lines.
+    """
+    with open(log_filepath, 'rb') as fid:
+        with mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = mm[byte_start:byte_end].decode("utf-8", errors="ignore")
+    lines = text.split("\n")
+    if text.endswith("\n"):
+        lines.pop()
+    del text
+    log_messages, failed_messages = formalize_message(enumerate(lines), splitter)
+    n_lines = len(lines)
+    del lines
+    line_ids = np.fromiter((message[0] - 1 for message in log_messages), dtype=np.int64, count=len(log_messages))
+    columns = ["\n".join(column) for column in list(zip(*log_messages))[1:]] \
+              if log_messages else ["" for _ in splitter.headers]
+    return n_lines, line_ids, columns, failed_messages
@@ -0,0 +1,226 @@
+# Copyright 2018 The LogPAI Team (https://github.com/logpai).
+#
+# Licensed under the MIT License:
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# =============================================================================
+""" This file implements queries over logzip archives that decode only the
+    columns a predicate touches:
+
+    - event: the EventId_0 column of a segment gives the rows of an event;
+    - parameter: the value is split like at compression time and compared
+      with the {eid}_{para_idx}_{sub_idx} columns of the event (level 3
+      compares dictionary ids, and skips segments whose dictionary lacks
+      the value);
+    - time range: the time columns are compared as strings.
+
+    Blocks of block-segmented archives are skipped from their index entry
+    (event counts, min/max timestamp) before anything is inflated.
+
+    $ python3 -m logzip.logquery HDFS.logzip.lzc --event E5 --param 0=blk_123
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .logunzipper import Unziplog, concat_columns
+from .logzipper import split_item, TIME_HEADERS
+
+
+class LogQuery(object):
+    def __init__(self, archive_path, n_workers=1):
+        self.unzipper = Unziplog(archive_path, n_workers=n_workers)
+        self.n_workers = n_workers
+        self.time_columns = self.unzipper.meta.get("time_columns")
+        if self.time_columns is None:
+            self.time_columns = [header for header in self.unzipper.headers if header in TIME_HEADERS]
+        self.query_time = 0
+
+    def events(self):
+        '''
+        {EventId: (template, number of rows)}; row counts need a block index or
+        the EventId columns
+        '''
+        counts = {}
+        if self.unzipper.blocks is not None:
+            for block in self.unzipper.blocks:
+                for eid, count in block.get("events", {}).items():
+                    counts[eid] = counts.get(eid, 0) + count
+        else:
+            for segment in self.unzipper.segments:
+                eids, eid_counts = np.unique(self.__event_ids(segment), return_counts=True)
+                for eid, count in zip(eids, eid_counts):
+                    counts[eid] = counts.get(eid, 0) + int(count)
+        return {eid: (template, counts.get(eid, 0)) for eid, template in self.unzipper.template_mapping.items()}
+
+    def search(self, event_id=None, params=None, start_time=None, end_time=None, limit=None):
+        '''
+        Return [(0-based line number, raw line)] of the rows matching every
+        given predicate:
+            event_id: the EventId of the row
+            params: {para_idx: value} on the parameters of event_id
+            start_time, end_time: inclusive bounds on the time_columns of the
+                row joined by " " (e.g. "081109 203615" for HDFS)
+        '''
+        t1 = time.time()
+        params = params or {}
+        if (event_id is not None or params) and self.unzipper.level == 1:
+            raise RuntimeError("Level 1 archives have no EventId to query!")
+        if params and event_id is None:
+            raise RuntimeError("Parameter predicates need an event_id!")
+        if params and self.unzipper.lossy:
+            raise RuntimeError("Lossy archives keep no parameters to query!")
+        if (start_time is not None or end_time is not None) and not self.time_columns:
+            raise RuntimeError("The archive records no time_columns to query!")
+
+        segments = [segment for idx, segment in enumerate(self.unzipper.segments)
+                    if self.__may_match(idx, event_id, start_time, end_time)]
+        task = lambda segment: self.__search_segment(segment, event_id, params, start_time, end_time)
+        results = []
+        if self.n_workers > 1 and len(segments) > 1:
+            with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+                for pos in range(0, len(segments), self.n_workers):
+                    for result in executor.map(task, segments[pos:pos + self.n_workers]):
+                        results.extend(result)
+                    if limit is not None and len(results) >= limit:
+                        break
+        else:
+            for segment in segments:
+                results.extend(task(segment))
+                if limit is not None and len(results) >= limit:
+                    break
+        self.query_time = time.time() - t1
+        return results if limit is None else results[:limit]
+
+    def __may_match(self, idx, event_id, start_time, end_time):
+        if event_id is not None and event_id not in self.unzipper.template_mapping:
+            return False
+        if self.unzipper.blocks is None:
+            return True
+        block = self.unzipper.blocks[idx]
+        if event_id is not None and "events" in block and event_id not in block["events"]:
+            return False
+        if block.get("min_time") is None:
+            return True
+        if start_time is not None and block["max_time"] < start_time:
+            return False
+        if end_time is not None and block["min_time"] > end_time:
+            return False
+        return True
+
+    def __event_ids(self, segment):
+        return self.unzipper.load_column(segment, "EventId_0")
+
+    def __search_segment(self, segment, event_id, params, start_time, end_time):
+        if event_id is not None:
+            eids = self.__event_ids(segment)
+            if eids is None:
+                return []
+            rows = np.flatnonzero(eids == event_id)
+            if params:
+                rows = rows[self.__match_params(segment, event_id, params, len(rows))]
+        else:
+            rows = np.arange(segment.n_rows)
+        if len(rows) and (start_time is not None or end_time is not None):
+            stamps = self.__time_stamps(segment, int(rows[-1]) + 1)[rows]
+            keep = np.ones(len(rows), dtype=bool)
+            if start_time is not None:
+                keep &= stamps >= start_time
+            if end_time is not None:
+                keep &= stamps <= end_time
+            rows = rows[keep]
+        line_numbers, lines = self.unzipper.decode_rows(segment, rows)
+        return list(zip(line_numbers, lines))
+
+    def __match_params(self, segment, event_id, params, n_event_rows):
+        '''
+        Boolean mask over the rows of event_id whose parameters equal params
+        '''
+        mask = np.ones(n_event_rows, dtype=bool)
+        for para_idx, value in params.items():
+            tokens = split_item(value)
+            ids = tokens
+            if self.unzipper.level == 3:
+                ids = self.unzipper.parameter_ids(segment, tokens)
+            prefix = "{}_{}".format(event_id, para_idx)
+            columns = self.unzipper.load_sub_columns(segment, prefix)
+            if len(tokens) > len(columns) and any(tokens[len(columns):]):
+                return np.zeros(n_event_rows, dtype=bool)
+            for sub_idx, column in enumerate(columns):
+                expected = ""
+                if sub_idx < len(tokens):
+                    indexed = self.unzipper.is_indexed(segment, "{}_{}".format(prefix, sub_idx))
+                    expected = ids[sub_idx] if indexed else tokens[sub_idx]
+                if expected is None:
+                    # a value the dictionary of the segment never saw
+                    return np.zeros(n_event_rows, dtype=bool)
+                mask &= column[:n_event_rows] == expected
+        return mask
+
+    def __time_stamps(self, segment, n_rows):
+        stamps = []
+        for column in self.time_columns:
+            if self.unzipper.level == 1:
+                sub_columns = [self.unzipper.load_column(segment, column + "_0")]
+            else:
+                sub_columns = self.unzipper.load_sub_columns(segment, column)
+            if not sub_columns or sub_columns[0] is None:
+                sub_columns = [np.full(n_rows, "", dtype=object)]
+            stamps.append(concat_columns([values[:n_rows] for values in sub_columns]))
+            stamps.append(np.full(n_rows, " ", dtype=object))
+        return concat_columns(stamps[:-1])
+
+    def close(self):
+        self.unzipper.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search a logzip archive without decompressing it.")
+    parser.add_argument("archive")
+    parser.add_argument("--event", help="EventId of the lines")
+    parser.add_argument("--param", action="append", default=[], metavar="IDX=VALUE",
+                        help="parameter IDX (0-based) of --event equals VALUE; repeatable")
+    parser.add_argument("--start", help="lines at or after this time (time_columns joined by spaces)")
+    parser.add_argument("--end", help="lines at or before this time")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--count", action="store_true", help="print the number of matching lines only")
+    parser.add_argument("--events", action="store_true", help="list EventIds, row counts and templates")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    query = LogQuery(args.archive, n_workers=args.workers)
+    if args.events:
+        for eid, (template, count) in query.events().items():
+            print("{}\t{}\t{}".format(eid, count, template))
+    else:
+        params = {}
+        for param in args.param:
+            para_idx, value = param.split("=", 1)
+            params[int(para_idx)] = value
+        results = query.search(event_id=args.event, params=params, start_time=args.start,
+                               end_time=args.end, limit=args.limit)
+        if args.count:
+            print(len(results))
+        else:
+            for line_number, line in results:
+                print("{}:{}".format(line_number + 1, line))
+    query.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Copyright 2018 The LogPAI Team (https://github.com/logpai).
+#
+# Licensed under the MIT License:
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# =============================================================================
+""" This file implements live compression of a pipe or of a growing file into
+    a block-segmented archive (see Ziplog.zip_stream):
+
+    $ tail -F app.log | python3 -m logzip.logstream out/ app.log.logzip templates.txt --logformat "..."
+    $ python3 -m logzip.logstream out/ app.log.logzip templates.txt --logformat "..." --follow app.log
+"""
+
+import argparse
+import sys
+import time
+from .logzipper import Ziplog
+
+
+def tail_lines(filepath, poll_seconds=1.0):
+    """ Yield the complete lines of a growing file from its beginning, waiting
+        poll_seconds whenever the end is reached, like tail -f
+    """
+    with open(filepath, 'r', encoding="utf-8", errors="ignore", newline="\n") as fid:
+        pending = ""
+        while True:
+            line = fid.readline()
+            if not line:
+                time.sleep(poll_seconds)
+                continue
+            if not line.endswith("\n"):
+                # the writer is in the middle of this line
+                pending += line
+                continue
+            yield pending + line
+            pending = ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compress a pipe or a growing log file as it is written.")
+    parser.add_argument("outdir")
+    parser.add_argument("outname")
+    parser.add_argument("templates")
+    parser.add_argument("--logformat", required=True)
+    parser.add_argument("--follow", metavar="LOGFILE", help="tail this file instead of reading stdin")
+    parser.add_argument("--kernel", default="gz")
+    parser.add_argument("--level", type=int, default=3)
+    parser.add_argument("--flush-lines", type=int, default=100000)
+    parser.add_argument("--flush-bytes", type=int, default=1 << 26)
+    parser.add_argument("--flush-seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    line_source = tail_lines(args.follow) if args.follow else sys.stdin
+    zipper = Ziplog(logformat=args.logformat, outdir=args.outdir, outname=args.outname,
+                    kernel=args.kernel, level=args.level)
+    zipper.zip_stream(line_source, args.templates, flush_lines=args.flush_lines,
+                      flush_bytes=args.flush_bytes, flush_seconds=args.flush_seconds)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Decompress logzip archives (.tar.gz/.tar.bz2/.tar.xz, .lzc or block-segmented
+.lzc) back to raw log lines, at all three levels.
+"""
+
+import re
+import json
+import time
+import bz2
+import lzma
+import zlib
+import tarfile
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from . import columncodec
+from . import container
+from .logzipper import unbaseN, baseN, DECOMPRESS
+from .metrics import RunMetrics
+
+class StoredDecompressor(object):
+    def decompress(self, data):
+        return data
+
+
+DECOMPRESSOBJ = {"gz": lambda: zlib.decompressobj(wbits=31), "bz2": bz2.BZ2Decompressor,
+                 "xz": lzma.LZMADecompressor, "raw": StoredDecompressor}
+READ_SIZE = 1 << 16
+
+
+class ArchiveReader(object):
+    '''
+    Uniform access to the members of a single-stream tar archive or of a .lzc
+    container. Tar members are inflated once when opening, since the stream
+    cannot be seeked; container members are inflated on demand, and text
+    members can be inflated only as far as the requested rows.
+    '''
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        self.container = None
+        self.tar_members = None
+        if container.ContainerReader.is_container(archive_path):
+            self.container = container.ContainerReader(archive_path)
+            self.members = {}
+            for name in self.container.names():
+                basename, suffix = name.rsplit(".", 1)
+                self.members[basename] = (name, suffix)
+        else:
+            self.tar_members = {}
+            with tarfile.open(archive_path, "r:*") as tar:
+                for member in tar.getmembers():
+                    if member.isfile():
+                        self.tar_members[member.name] = tar.extractfile(member).read()
+            self.members = {name: (name, None) for name in self.tar_members}
+
+    def has(self, name):
+        return name in self.members
+
+    def read(self, name):
+        member_name, suffix = self.members[name]
+        if self.container is None:
+            return self.tar_members[member_name]
+        return DECOMPRESS[suffix](self.container.read(member_name))
+
+    def read_rows(self, name, n_rows):
+        '''
+        Inflate a text member until it holds at least n_rows rows
+        '''
+        member_name, suffix = self.members[name]
+        if self.container is None:
+            return self.tar_members[member_name]
+        raw = self.container.read(member_name)
+        decompressor = DECOMPRESSOBJ[suffix]()
+        chunks = []
+        n_newlines = 0
+        for pos in range(0, len(raw), READ_SIZE):
+            chunk = decompressor.decompress(raw[pos:pos + READ_SIZE])
+            chunks.append(chunk)
+            n_newlines += chunk.count(b"\n")
+            if n_newlines >= n_rows:
+                break
+        return b"".join(chunks)
+
+    def close(self):
+        if self.container is not None:
+            self.container.close()
+
+
+def parse_logformat(logformat):
+    '''
+    Split a logformat into its headers and the literal separators around them
+    '''
+    splitters = re.split(r'(<[^<>]+>)', logformat.strip())
+    headers = [splitter.strip('<').strip('>') for splitter in splitters[1::2]]
+    separators = splitters[0::2]
+    return headers, separators
+
+
+def concat_columns(columns):
+    result = columns[0]
+    for column in columns[1:]:
+        result = result + column
+    return result
+
+
+class ArchiveSegment(object):
+    '''
+    A run of consecutive lines [first_line, last_line] (1-based) decoded on its
+    own: the whole archive, or one block of a block-segmented archive whose
+    members live under the prefix "b{idx}/". line_gaps are the line numbers
+    of the run without a row. unindexed are the level-3 parameter columns an
+    auto-tuned archive keeps as text.
+    '''
+    def __init__(self, reader, prefix, first_line, last_line, n_rows, line_gaps, unindexed=()):
+        self.reader = reader
+        self.prefix = prefix
+        self.first_line = first_line
+        self.last_line = last_line
+        self.n_rows = n_rows
+        self.line_gaps = line_gaps
+        self.unindexed = set(unindexed)
+        self.para_values = None
+
+    def has(self, name):
+        return self.reader.has(self.prefix + name)
+
+    def read(self, name):
+        return self.reader.read(self.prefix + name)
+
+    def read_rows(self, name, n_rows):
+        return self.reader.read_rows(self.prefix + name, n_rows)
+
+    def line_ids(self):
+        '''
+        1-based line number of every row
+        '''
+        gaps = np.array(self.line_gaps, dtype=np.int64)
+        line_ids = np.arange(self.first_line, self.last_line + 1)
+        return np.setdiff1d(line_ids, gaps, assume_unique=True)[:self.n_rows]
+
+
+class Unziplog():
+    def __init__(self, archive_path, logformat=None, n_workers=1, metrics=None):
+        self.archive_path = archive_path
+        self.n_workers = n_workers
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.reader = ArchiveReader(archive_path)
+        self.meta = {}
+        if self.reader.has("meta.json"):
+            self.meta = json.loads(self.reader.read("meta.json"))
+        self.logformat = logformat or self.meta.get("logformat")
+        if not self.logformat:
+            raise RuntimeError('Logformat is required for archives without meta.json!')
+        self.headers, self.separators = parse_logformat(self.logformat)
+        if "level" in self.meta:
+            self.level = self.meta["level"]
+        elif self.reader.has("template_mapping.json"):
+            self.level = 3 if self.reader.has("parameter_mapping.json") else 2
+        else:
+            self.level = 1
+        self.lossy = self.meta.get("lossy", False)
+        # of block-segmented archives only the failed lines after the last block,
+        # the others are stored with their blocks
+        self.failed_messages = {}
+        if self.reader.has("failed_logs.json"):
+            self.failed_messages = json.loads(self.reader.read("failed_logs.json"))
+        self.failed_lines = np.array(sorted(int(line_count) for line_count in self.failed_messages), dtype=np.int64)
+        self.template_mapping = {}
+        if self.reader.has("template_mapping.json"):
+            self.template_mapping = json.loads(self.reader.read("template_mapping.json"))
+        self.blocks = None
+        if self.reader.has("block_index.json"):
+            block_index = json.loads(self.reader.read("block_index.json"))
+            self.blocks = [json.loads(self.reader.read("b{}/block.json".format(idx)))
+                           for idx in range(block_index["n_blocks"])]
+            self.segments = [ArchiveSegment(self.reader, "b{}/".format(idx), block["first_line"],
+                                            block["last_line"], block["n_rows"], block["line_gaps"],
+                                            block.get("auto_tune", {}).get("unindexed_columns", ()))
+                             for idx, block in enumerate(self.blocks)]
+            self.total_lines = self.meta["total_lines"]
+            # blocks are decoded in parallel, their columns one after another
+            self.column_workers = 1
+        else:
+            self.segments = [self.__whole_segment()]
+            self.total_lines = self.segments[0].last_line
+            self.column_workers = self.n_workers
+        self.decompress_time = 0
+
+    def __whole_segment(self):
+        segment = ArchiveSegment(self.reader, "", 1, 0, 0, [],
+                                 self.meta.get("auto_tune", {}).get("unindexed_columns", ()))
+        if "n_rows" in self.meta:
+            segment.n_rows = self.meta["n_rows"]
+        else:
+            name = self.__column_name(segment, "EventId_0" if self.level > 1 else self.headers[0] + "_0")
+            segment.n_rows = len(self.__load_column((segment, name, None)))
+        if "line_gaps" in self.meta:
+            segment.line_gaps = self.meta["line_gaps"]
+        else:
+            segment.line_gaps = [int(line_count) + 1 for line_count in self.failed_lines]
+        segment.last_line = max(self.meta.get("total_lines", 0), segment.n_rows + len(segment.line_gaps))
+        return segment
+
+    def __column_name(self, segment, name):
+        for suffix in [".csv", ".num"]:
+            if segment.has(name + suffix):
+                return name + suffix
+        return None
+
+    def __load_column(self, task):
+        '''
+        Load rows [0, n_rows) of a column (all rows if n_rows is None)
+        '''
+        segment, name, n_rows = task
+        if name.endswith(".num"):
+            values = columncodec.decode_column(segment.read(name))
+        else:
+            content = segment.read(name) if n_rows is None else segment.read_rows(name, n_rows)
+            values = np.array(content.decode("utf-8").split("\n"), dtype=object)
+        return values if n_rows is None else values[:n_rows]
+
+    def __load_columns(self, segment, tasks):
+        tasks = [(segment, name, n_rows) for name, n_rows in tasks]
+        if self.column_workers > 1:
+            # zlib, bz2 and lzma release the GIL while inflating
+            with ThreadPoolExecutor(max_workers=self.column_workers) as executor:
+                columns = list(executor.map(self.__load_column, tasks))
+        else:
+            columns = list(map(self.__load_column, tasks))
+        return dict(zip([name for _, name, _ in tasks], columns))
+
+    def __sub_columns(self, segment, prefix):
+        names = []
+        while True:
+            name = self.__column_name(segment, "{}_{}".format(prefix, len(names)))
+            if name is None:
+                return names
+            names.append(name)
+
+    def __para_values(self, segment):
+        if segment.para_values is None:
+            if segment.has("parameter_mapping.bin"):
+                values = columncodec.load_length_prefixed(segment.read("parameter_mapping.bin"))
+                # the trailing "" is what the rank -1 of empty ids points to
+                segment.para_values = np.array(values + [""], dtype=object)
+            else:
+                # archives before parameter_mapping.bin stored an id -> value dict
+                segment.para_values = json.loads(segment.read("parameter_mapping.json"))
+        return segment.para_values
+
+    def __unindex(self, segment, ids):
+        para_values = self.__para_values(segment)
+        codes, uniques = pd.factorize(ids)
+        if isinstance(para_values, dict):
+            mapped = np.array([para_values.get(uid, uid) for uid in uniques], dtype=object)
+        else:
+            ranks = np.array([unbaseN(uid, 64) if uid else -1 for uid in uniques], dtype=np.int64)
+            mapped = para_values[ranks]
+        return mapped[codes] if len(codes) else np.array([], dtype=object)
+
+    def __decode_rows(self, segment, rows):
+        '''
+        Rebuild the rows (sorted row numbers of a segment) as raw lines
+        '''
+        n_rows = len(rows)
+        n_load = int(rows[-1]) + 1 if n_rows else 0
+        header_values = {}
+        if self.level == 1:
+            tasks = [(self.__column_name(segment, header + "_0"), n_load) for header in self.headers]
+            columns = self.__load_columns(segment, tasks)
+            for header, (name, _) in zip(self.headers, tasks):
+                header_values[header] = columns[name][rows]
+        else:
+            sub_columns = {header: self.__sub_columns(segment, header) for header in self.headers if header != "Content"}
+            eid_name = self.__column_name(segment, "EventId_0")
+            tasks = [(name, n_load) for names in sub_columns.values() for name in names]
+            tasks.append((eid_name, n_load))
+            columns = self.__load_columns(segment, tasks)
+            for header, names in sub_columns.items():
+                if names:
+                    header_values[header] = concat_columns([columns[name][rows] for name in names])
+                else:
+                    header_values[header] = np.full(n_rows, "", dtype=object)
+            header_values["Content"] = self.__decode_contents(segment, columns[eid_name], rows)
+
+        pieces = [np.full(n_rows, self.separators[0], dtype=object)]
+        for header, separator in zip(self.headers, self.separators[1:]):
+            pieces.append(header_values[header])
+            pieces.append(np.full(n_rows, separator, dtype=object))
+        return concat_columns(pieces)
+
+    def __decode_contents(self, segment, eids_all, rows):
+        '''
+        Fill the template of every row with its parameters, one event at a time.
+        The parameter columns of an event hold its rows only, so a row is found 
+        there by its rank among the rows of the same event.
+        '''
+        eids = eids_all[rows]
+        contents = np.full(len(eids), "", dtype=object)
+        ranks = pd.Series(eids_all).groupby(eids_all, sort=False).cumcount().to_numpy()[rows]
+        codes, uniques = pd.factorize(eids)
+        event_tasks = []
+        for code, eid in enumerate(uniques):
+            template = self.template_mapping.get(eid, "")
+            row_index = np.flatnonzero(codes == code)
+            if "<*>" not in template or self.lossy:
+                contents[row_index] = template
+                continue
+            event_ranks = ranks[row_index]
+            para_names = [self.__sub_columns(segment, "{}_{}".format(eid, para_idx))
+                          for para_idx in range(template.count("<*>"))]
+            event_tasks.append((template, row_index, event_ranks, para_names))
+        columns = self.__load_columns(segment, [(name, int(event_ranks[-1]) + 1)
+                                                for _, _, event_ranks, para_names in event_tasks
+                                                for names in para_names for name in names])
+
+        for template, row_index, event_ranks, para_names in event_tasks:
+            parts = template.split("<*>")
+            pieces = [np.full(len(row_index), parts[0], dtype=object)]
+            for names, part in zip(para_names, parts[1:]):
+                if names:
+                    paras = concat_columns([self.__sub_column(segment, name, columns[name], event_ranks)
+                                            for name in names])
+                else:
+                    paras = np.full(len(row_index), "", dtype=object)
+                pieces.append(paras)
+                pieces.append(np.full(len(row_index), part, dtype=object))
+            contents[row_index] = concat_columns(pieces)
+        return contents
+
+    def __sub_column(self, segment, name, column, event_ranks):
+        column = column[event_ranks]
+        if self.is_indexed(segment, name.rsplit(".", 1)[0]):
+            column = self.__unindex(segment, column)
+        return column
+
+    def is_indexed(self, segment, name):
+        '''
+        Whether the parameter column name (without suffix) of a segment holds 
+        level-3 dictionary ids rather than the values
+        '''
+        return self.level == 3 and name not in segment.unindexed
+
+    def load_column(self, segment, name):
+        '''
+        All values of the column name (without suffix) of a segment, or None
+        '''
+        filename = self.__column_name(segment, name)
+        if filename is None:
+            return None
+        return self.__load_column((segment, filename, None))
+
+    def load_sub_columns(self, segment, prefix):
+        '''
+        All values of the sub-columns {prefix}_0, {prefix}_1, ... of a segment
+        '''
+        names = self.__sub_columns(segment, prefix)
+        columns = self.__load_columns(segment, [(name, None) for name in names])
+        return [columns[name] for name in names]
+
+    def parameter_ids(self, segment, values):
+        '''
+        Ids of level-3 parameter values in the dictionary of a segment ("" for 
+        "", None for values the segment never saw)
+        '''
+        para_values = self.__para_values(segment)
+        if isinstance(para_values, dict):
+            reverse = {value: uid for uid, value in para_values.items()}
+            return [reverse.get(value, value) if value else "" for value in values]
+        ranks = pd.Index(para_values[:-1]).get_indexer(values)
+        return ["" if not value else (baseN(int(rank), 64) if rank >= 0 else None)
+                for value, rank in zip(values, ranks)]
+
+    def decode_rows(self, segment, rows):
+        '''
+        Return (0-based line numbers, raw lines) of sorted rows of a segment
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        line_numbers = segment.line_ids()[rows] - 1
+        if not len(rows):
+            return line_numbers.tolist(), []
+        return line_numbers.tolist(), self.__decode_rows(segment, rows).tolist()
+
+    def __plan(self, start, end):
+        '''
+        Cover the lines [start, end) with (segment, lo, hi) pieces; lines outside 
+        every segment (trailing failed or blank lines) get a None segment
+        '''
+        pieces = []
+        pos = start
+        for segment in self.segments:
+            lo, hi = max(pos, segment.first_line - 1), min(end, segment.last_line)
+            if hi <= lo:
+                continue
+            if lo > pos:
+                pieces.append((None, pos, lo))
+            pieces.append((segment, lo, hi))
+            pos = hi
+        if pos < end:
+            pieces.append((None, pos, end))
+        return pieces
+
+    def __block_failed(self, segment):
+        '''
+        {0-based line number: raw line} of the failed lines stored with a block
+        '''
+        if segment is None or not segment.prefix or not segment.has("failed_logs.json"):
+            return {}
+        return json.loads(segment.read("failed_logs.json"))
+
+    def __decode_piece(self, piece):
+        segment, start, end = piece
+        lines = np.full(end - start, "", dtype=object)
+        failed_lo, failed_hi = np.searchsorted(self.failed_lines, [start, end])
+        for line_count in self.failed_lines[failed_lo:failed_hi]:
+            lines[line_count - start] = self.failed_messages[str(line_count)]
+        for line_count, line in self.__block_failed(segment).items():
+            if start <= int(line_count) < end:
+                lines[int(line_count) - start] = line
+        if segment is not None:
+            line_ids = segment.line_ids()
+            row_start = int(np.searchsorted(line_ids, start + 1, side="left"))
+            row_end = int(np.searchsorted(line_ids, end, side="right"))
+            if row_end > row_start:
+                lines[line_ids[row_start:row_end] - 1 - start] = self.__decode_rows(segment, np.arange(row_start, row_end))
+            if self.blocks is not None:
+                # keep only one block's dictionary alive at a time
+                segment.para_values = None
+        return lines.tolist()
+
+    def iter_lines(self, start=0, end=None):
+        '''
+        Yield the raw lines [start, end) (0-based line numbers, end exclusive) as
+        lists, one segment at a time. Only the blocks overlapping the range are 
+        inflated, n_workers blocks at a time, so memory is bounded by the block 
+        size rather than by the archive.
+        '''
+        end = self.total_lines if end is None else min(end, self.total_lines)
+        start = max(0, min(start, end))
+        pieces = self.__plan(start, end)
+        if self.n_workers > 1 and len(pieces) > 1:
+            with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+                for pos in range(0, len(pieces), self.n_workers):
+                    yield from executor.map(self.__decode_piece, pieces[pos:pos + self.n_workers])
+        else:
+            yield from map(self.__decode_piece, pieces)
+
+    def read_lines(self, start=0, end=None):
+        '''
+        Return the raw lines [start, end) (0-based line numbers, end exclusive)
+        '''
+        t1 = time.time()
+        lines = list(chain.from_iterable(self.iter_lines(start, end)))
+        self.decompress_time = time.time() - t1
+        return lines
+
+    def unzip_file(self, out_filepath, start=0, end=None):
+        t1 = time.time()
+        n_lines = 0
+        with open(out_filepath, "w", encoding="utf-8") as fw:
+            for lines in self.iter_lines(start, end):
+                for line in lines:
+                    fw.write(line)
+                    fw.write("\n")
+                n_lines += len(lines)
+        self.decompress_time = time.time() - t1
+        self.metrics.log("Restored {} lines to {} [Time taken: {:.2f}s]".format(n_lines, out_filepath, self.decompress_time))
+
+    def close(self):
+        self.reader.close()
+
+
+def main():
+    archive_path = "../zip_out/HDFS_2k.log.logzip.tar.gz"
+    out_filepath = "../zip_out/HDFS_2k.log"
+
+    unzipper = Unziplog(archive_path)
+    unzipper.unzip_file(out_filepath)
+    unzipper.close()
+
+if __name__ == "__main__":
+    main()
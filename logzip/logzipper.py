@@ -7,15 +7,91 @@ Created on Sat May  4 12:25:18 2019
 """
 
 import os
+import io
 import tarfile
+import gzip
+import zlib
+import bz2
+import lzma
+import multiprocessing as mp
 import glob
 import re
 import json
 import time
 import gc
-from itertools import zip_longest
+from contextlib import contextmanager
+from itertools import chain, islice
+import numpy as np
+import pandas as pd
 from . import treematch
 from . import logloader
+from . import columncodec
+from . import container
+from . import pipeline
+from . import templateminer
+from . import autotune
+from .structuredlog import StructuredLog
+from .metrics import RunMetrics
+
+KERNEL_SUFFIX = {"gz": "gz", "bz2": "bz2", "lzma": "xz"}
+DECOMPRESS = {"gz": gzip.decompress, "bz2": bz2.decompress, "xz": lzma.decompress, "raw": bytes}
+COMPRESSOBJ = {"gz": lambda level: zlib.compressobj(9 if level is None else level, zlib.DEFLATED, 31),
+               "bz2": lambda level: bz2.BZ2Compressor(9 if level is None else level),
+               "lzma": lambda level: lzma.LZMACompressor(preset=level)}
+READ_SIZE = 1 << 20
+CODEC_CHUNK_ROWS = 1 << 16
+TOP_LEVEL_MEMBERS = ["meta.json", "failed_logs.json", "template_mapping.json", "block_index.json"]
+TIME_HEADERS = ["Timestamp", "Date", "Day", "Time"]
+
+def compress_member(task):
+    arcname, content, kernel, level = task
+    if kernel == "store":
+        # members of auto-tuned archives that do not compress
+        return "{}.raw".format(arcname), content
+    if kernel == "gz":
+        content = gzip.compress(content, compresslevel=9 if level is None else level, mtime=0)
+    elif kernel == "bz2":
+        content = bz2.compress(content, compresslevel=9 if level is None else level)
+    elif kernel == "lzma":
+        content = lzma.compress(content, preset=level)
+    return "{}.{}".format(arcname, KERNEL_SUFFIX[kernel]), content
+
+def dump_failed(failed_messages):
+    return json.dumps({str(line_count): line for line_count, line in failed_messages.items()}).encode("utf-8")
+
+def add_tar_member(tar, arcname, content):
+    tarinfo = tarfile.TarInfo(arcname)
+    tarinfo.size = len(content)
+    tarinfo.mtime = time.time()
+    tar.addfile(tarinfo, io.BytesIO(content))
+
+def compress_file(task):
+    '''
+    File counterpart of compress_member: compress filepath in READ_SIZE reads 
+    to a file next to it, returns (arcname with suffix, compressed filepath)
+    '''
+    arcname, filepath, kernel, level = task
+    if kernel == "store":
+        return "{}.raw".format(arcname), filepath
+    suffix = KERNEL_SUFFIX[kernel]
+    compressor = COMPRESSOBJ[kernel](level)
+    with open(filepath, "rb") as fr, open("{}.{}".format(filepath, suffix), "wb") as fw:
+        for chunk in iter(lambda: fr.read(READ_SIZE), b""):
+            fw.write(compressor.compress(chunk))
+        fw.write(compressor.flush())
+    return "{}.{}".format(arcname, suffix), "{}.{}".format(filepath, suffix)
+
+def iter_rows(fr):
+    '''
+    Rows of a column file written by Ziplog.__write_rows ("\\n"-joined, no 
+    trailing newline), read line by line
+    '''
+    ended = True
+    for line in fr:
+        ended = line.endswith("\n")
+        yield line[:-1] if ended else line
+    if ended:
+        yield ""
 
 def boolean_string(s):
     if s not in {'False', 'True'}:
@@ -37,6 +113,29 @@ def split_normal(dataframe):
     return [dataframe[col].map(split_item).tolist() \
             for col in dataframe.columns]
 
+def split_factorized(values):
+    '''
+    Split an array (or Categorical) of strings into tokens, padded with "" to 
+    an (n_rows, width) object array. Each distinct value is split once, and 
+    rows are gathered from the table of distinct values through their 
+    factorized codes. A None value gets no tokens.
+    '''
+    if isinstance(values, pd.Categorical):
+        codes, uniques = values.codes, values.categories
+    else:
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    tokens = [split_item(value) for value in uniques]
+    lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+    width = lengths.max() if len(tokens) else 0
+    # the last row stays empty, for the code -1 of None
+    table = np.full((len(tokens) + 1, width), "", dtype=object)
+    table[:-1][np.arange(width) < lengths[:, None]] = list(chain.from_iterable(tokens))
+    return table[codes]
+
+def unbaseN(astr, b):
+    return sum("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz+="\
+               .index(char) * b ** idx for idx, char in enumerate(reversed(astr)))
+
 def baseN(num, b):
     if isinstance(num, str):
         num = int(num)
@@ -47,7 +146,12 @@ def baseN(num, b):
 
 class Ziplog():
     def __init__(self, logformat, outdir, outname, kernel="gz",
-                 tmp_dir="", level=3, lossy=False):
+                 tmp_dir="", level=3, lossy=False, n_workers=1,
+                 match_cache=None, match_cache_size=1000000, column_codec=False,
+                 use_tmp_dir=False, column_kernel=False, kernel_level=None,
+                 block_lines=None, time_columns=None, pipeline_depth=0, metrics=None, run_report=True,
+                 mine_sample_size=10000, mine_lines=200000, auto_tune=False, tune_min_mb_s=None,
+                 tune_min_ratio=None, tune_sample_bytes=1 << 15):
         self.logformat = logformat
         self.outdir = outdir
         self.outname = outname
@@ -56,98 +160,395 @@ class Ziplog():
         self.level = level
         self.lossy = lossy
         self.tmp_dir = tmp_dir
+        self.n_workers = n_workers
+        self.match_cache = match_cache
+        self.match_cache_size = match_cache_size
+        self.meta = {}
+        self.column_codec = column_codec
+        self.column_report = {}
+        self.use_tmp_dir = use_tmp_dir
+        # auto-tuned kernels are chosen per member, so only in a .lzc container
+        self.column_kernel = column_kernel or auto_tune
+        self.kernel_level = kernel_level
+        self.column_files = []
+        self.loader = None
+        self.block_lines = block_lines
+        if time_columns is None:
+            headers = re.findall(r'<([^<>]+)>', logformat)
+            time_columns = [header for header in headers if header in TIME_HEADERS]
+        self.time_columns = time_columns
+        self.n_blocks = 0
+        self.line_offset = 0
+        self.pending_failed = {}
+        # the stages are threads: only the work they hand to the n_workers
+        # processes runs next to the main thread, the rest holds the GIL
+        self.pipeline_depth = pipeline_depth if n_workers > 1 else 0
+        self.total_time = 0
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.run_report = run_report
+        self.mine_sample_size = mine_sample_size
+        self.mine_lines = mine_lines
+        self.mined_templates = None
+        self.tuner = None
+        if auto_tune:
+            self.tuner = autotune.ColumnTuner(compress_member, lambda rank: baseN(rank, 64), min_mb_s=tune_min_mb_s,
+                                              min_ratio=tune_min_ratio, sample_bytes=tune_sample_bytes,
+                                              default_kernel=(kernel, kernel_level))
         
         self.splitting_time = 0
         self.packing_time = 0
+        self.stage_times = {}
 
 
         if not os.path.isdir(self.outdir):
             os.makedirs(self.outdir)
-        if not os.path.isdir(self.tmp_dir):
+        if self.tmp_dir and not os.path.isdir(self.tmp_dir):
             os.makedirs(self.tmp_dir)
 
     def compress_all(self):
         self.file_all_column_dict = {}
-        ignore_columns = ["LineId", "EventTemplate", "ParameterList", "EventId"]
-        focus_columns = [col for col in self.log_dataframe.columns if col not in ignore_columns]
-        for column in focus_columns:
+        columns = dict(self.structured_log.headers)
+        if "Content" not in columns:
+            columns["Content"] = self.structured_log.contents()
+        for column, values in columns.items():
             filename = column+"_0"
-            self.file_all_column_dict[filename] = self.log_dataframe[column]
-        del self.log_dataframe
+            self.file_all_column_dict[filename] = np.asarray(values, dtype=object)
+        del self.structured_log
 
     def compress_normal(self):
-        ignore_columns = ["LineId", "EventTemplate", "ParameterList", "EventId", "Content"]
-        focus_columns = [col for col in self.log_dataframe.columns if col not in ignore_columns]
-        
-        splited_columns = split_normal(self.log_dataframe[focus_columns])
-
-        self.log_dataframe.drop(focus_columns, axis=1,inplace=True)
+        headers = self.structured_log.headers
+        focus_columns = [col for col in headers if col != "Content"]
         
         self.file_normal_column_dict = {}
-        for idx, colname in enumerate(focus_columns):
-            columns_t = list(zip_longest(*splited_columns[idx], fillvalue=""))  # transpose
-            for sub_idx, col in enumerate(columns_t):
+        for colname in focus_columns:
+            packed = split_factorized(headers.pop(colname))
+            for sub_idx in range(packed.shape[1]):
                 filename = f"{colname}_{sub_idx}"
-                self.file_normal_column_dict[filename] = col
-        self.file_normal_column_dict["EventId_0"] = self.log_dataframe["EventId"]
+                self.file_normal_column_dict[filename] = packed[:, sub_idx]
+        self.file_normal_column_dict["EventId_0"] = self.structured_log.row_event_ids()
 
-    def __pack_params(self, dataframe):
+    def __pack_params(self, structured_log, rows):
         '''
-        Input: dataframe with tow columns [EventId, ParameterList]
+        Input: a StructuredLog and the rows whose parameters are to be stored
+        Rows are grouped by event in one pass (factorize + stable argsort), and 
+        each parameter position, gathered from the flat parameter buffer, is 
+        split (split_factorized) into a padded 2-D object array whose columns 
+        become the {eid}_{para_idx}_{sub_idx} files.
         '''
         self.file_para_dict = {}
-        for eid in dataframe["EventId"].unique():
-            paras = dataframe.loc[dataframe["EventId"]==eid, "ParameterList"]
-            paracolumns = list(zip_longest(*paras, fillvalue=""))
-            for para_idx, subparas in enumerate(paracolumns):
-                subparas_columns = list(zip_longest(*subparas, fillvalue=""))
-                for sub_para_idx, sub_subparas in enumerate(subparas_columns):
+        codes, event_codes = pd.factorize(structured_log.event_codes[rows])
+        order = np.argsort(codes, kind="stable")
+        boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+        offsets = structured_log.param_offsets
+        for event_code, event_rows in zip(event_codes, np.split(rows[order], boundaries)):
+            eid = structured_log.event_ids[event_code]
+            starts = offsets[event_rows]
+            lengths = offsets[event_rows + 1] - starts
+            for para_idx in range(lengths.max()):
+                present = lengths > para_idx
+                values = np.full(len(event_rows), None, dtype=object)
+                values[present] = structured_log.param_values[starts[present] + para_idx]
+                packed = split_factorized(values)
+                for sub_para_idx in range(packed.shape[1]):
                     filename = f"{eid}_{para_idx}_{sub_para_idx}"
-                    self.file_para_dict[filename] = sub_subparas
+                    self.file_para_dict[filename] = packed[:, sub_para_idx]
+
 
+    def __reset_para_index(self):
+        self.para_values = []
+        self.para_index = pd.Index([], dtype=object)
+        self.column_indexed = {}
+
+    def __choose_indexed(self):
+        '''
+        With auto_tune, decide once per parameter column whether it is indexed 
+        in the parameter dictionary or kept as text (the choice sticks for the 
+        later chunks of the column). Values held by other columns, or already 
+        in the dictionary, are shared: their entries cost the column nothing.
+        '''
+        filenames = [filename for filename in self.file_para_dict if filename not in self.column_indexed]
+        if not filenames:
+            return
+        columns = [np.asarray(self.file_para_dict[filename], dtype=object) for filename in filenames]
+        codes, uniques = pd.factorize(np.concatenate(columns))
+        column_ids = np.repeat(np.arange(len(columns)), [len(column) for column in columns])
+        pairs = pd.DataFrame({"code": codes, "column": column_ids}).drop_duplicates()
+        n_columns = np.bincount(pairs["code"].to_numpy(), minlength=len(uniques))
+        shared_codes = (n_columns > 1) | (self.para_index.get_indexer(uniques) >= 0)
+        offsets = np.cumsum([len(column) for column in columns])[:-1]
+        for filename, column, column_codes in zip(filenames, columns, np.split(codes, offsets)):
+            shared = shared_codes[column_codes]
+            self.column_indexed[filename] = self.tuner.choose_indexed(column, shared, self.kernel, self.kernel_level)
+
+    def __unindexed_columns(self):
+        return sorted(filename for filename, indexed in self.column_indexed.items() if not indexed)
 
     def __build_para_index(self):
-        index = 0
-        para_index_dict = {}
-        for filename, paras in self.file_para_dict.items():
-            para_set = set(paras)
-            for upara in para_set:
-                index += 1
-                index_64 = baseN(index, 64)
-                para_index_dict[upara] = index_64
-            paras_mapped = [para_index_dict[para] for para in paras]
+        '''
+        Dictionary-encode all parameter columns at once. New values get ranks in 
+        decreasing frequency, so frequent values get the shortest baseN ids, and 
+        "" stays "". self.para_values holds the values in rank order.
+        '''
+        filenames = [filename for filename in self.file_para_dict if self.column_indexed.get(filename, True)]
+        if not filenames:
+            return
+        columns = [np.asarray(self.file_para_dict[filename], dtype=object) for filename in filenames]
+        codes, uniques = pd.factorize(np.concatenate(columns))
+        uniques = np.asarray(uniques, dtype=object)
+        counts = np.bincount(codes, minlength=len(uniques))
+        ranks = self.para_index.get_indexer(uniques)
+        new_idx = np.flatnonzero((ranks == -1) & (uniques != ""))
+        new_idx = new_idx[np.argsort(-counts[new_idx], kind="stable")]
+        ranks[new_idx] = np.arange(len(self.para_values), len(self.para_values) + len(new_idx))
+        self.metrics.count("parameter_values", len(new_idx))
+        self.para_values.extend(uniques[new_idx])
+        self.para_index = self.para_index.append(pd.Index(uniques[new_idx], dtype=object))
+        
+        ids = np.array([baseN(rank, 64) if rank >= 0 else "" for rank in ranks], dtype=object)
+        encoded = ids[codes]
+        offsets = np.cumsum([len(column) for column in columns])[:-1]
+        for filename, paras_mapped in zip(filenames, np.split(encoded, offsets)):
             self.file_para_dict[filename] = paras_mapped
-        self.index_para_dict = {v:k for k,v in para_index_dict.items()}
         
                 
         
     def compress_content(self):
-        self.template_mapping = dict(zip(self.log_dataframe["EventId"],\
-                                    self.log_dataframe["EventTemplate"]))
+        structured_log = self.structured_log
+        templates = structured_log.templates.copy()
+        nomatch_codes = np.flatnonzero(templates == "NoMatch")
+        if len(nomatch_codes):
+            # unmatched contents are kept whole, as the only parameter of "<*>"
+            self.meta["nomatch_event"] = structured_log.event_ids[nomatch_codes[0]]
+            templates[nomatch_codes] = "<*>"
+        self.template_mapping = dict(zip(structured_log.event_ids, templates))
             
-        eids = [eid for eid in self.template_mapping \
-                    if "<*>" in self.template_mapping[eid]]
-        print("{} events to be split.".format(len(eids)))
-        
-        focus_index = self.log_dataframe["EventId"].isin(eids)
-        focus_df = self.log_dataframe.loc[focus_index,\
-                                    ["EventId","ParameterList"]]
-        del self.log_dataframe
-        
-        splitted_para = split_para(focus_df["ParameterList"])
-
+        focus_codes = [code for code, template in enumerate(templates) if "<*>" in template]
+        self.metrics.log("{} events to be split.".format(len(focus_codes)))
         
-        focus_df["ParameterList"] = splitted_para
+        focus_rows = np.flatnonzero(np.isin(structured_log.event_codes, focus_codes))
+        del self.structured_log
         
-        self.__pack_params(focus_df)
+        self.__pack_params(structured_log, focus_rows)
+        del structured_log
         
         if self.level == 3:
+            if self.tuner is not None:
+                self.__choose_indexed()
             self.__build_para_index()
         
         gc.collect()
 
 
-    def __kernel_compress(self):
+    def __append_columns(self, adict, group_of):
+        '''
+        Append the columns of one chunk to tmp_dir. Columns that first show up in 
+        a later chunk are front-padded with "" so rows stay aligned within their 
+        group (header columns, or the rows of one event for parameter columns).
+        '''
+        for filename, content_list in adict.items():
+            group = group_of(filename)
+            offset = self.group_rows.get(group, 0)
+            written = self.column_rows.get(filename, 0)
+            rows = [""] * (offset - written) + list(content_list)
+            self.__write_rows(filename, rows, written)
+            self.column_rows[filename] = written + len(rows)
+            self.column_group[filename] = group
+
+    def __write_rows(self, filename, rows, written):
+        if not rows:
+            return
+        with open(os.path.join(self.tmp_dir, filename+".csv"), "a", newline="\n") as fw:
+            if written:
+                fw.write("\n")
+            fw.write("\n".join(rows))
+
+    def __encode_column(self, filename, content_list):
+        '''
+        Encode a numeric column through columncodec when that is smaller than 
+        the text. Returns the payload to store as {filename}.num, or None.
+        '''
+        t1 = time.time()
+        encoded = columncodec.encode_column(content_list)
+        if encoded is None:
+            return None
+        codec, payload = encoded
+        text_size = sum(len(value) for value in content_list) + len(content_list) - 1
+        self.column_report[filename] = {"codec": codec, "rows": len(content_list),
+                                        "text_bytes": text_size, "encoded_bytes": len(payload),
+                                        "seconds": time.time() - t1}
+        return payload
+
+    def __encode_column_file(self, filename, filepath):
+        '''
+        Encode the column file filename.csv of zip_chunks as frames of 
+        CODEC_CHUNK_ROWS rows in filename.num, read a chunk at a time. Returns 
+        the filepath to store: the .csv one if a chunk is not numeric or not 
+        smaller encoded, or with auto_tune if the tuner, given the first chunk 
+        in both forms, picks the text.
+        '''
+        num_path = os.path.join(self.tmp_dir, filename+".num")
+        report = {"codec": None, "rows": 0, "text_bytes": -1, "encoded_bytes": 1, "seconds": 0}
+        first_chunk = None
+        encoded = True
+        with open(filepath, newline="\n") as fr, open(num_path, "wb") as fw:
+            fw.write(bytes([columncodec.CODEC_FRAMES]))
+            rows = iter_rows(fr)
+            chunk = list(islice(rows, CODEC_CHUNK_ROWS))
+            while chunk and encoded:
+                payload = self.__encode_column(filename, chunk)
+                encoded = payload is not None
+                if encoded:
+                    if first_chunk is None:
+                        first_chunk = ("\n".join(chunk).encode("utf-8"), payload,
+                                       self.column_report[filename]["seconds"])
+                    frame = columncodec.dump_frame(payload)
+                    fw.write(frame)
+                    chunk_report = self.column_report[filename]
+                    report["codec"] = chunk_report["codec"]
+                    report["rows"] += chunk_report["rows"]
+                    # with the newline before the chunk
+                    report["text_bytes"] += chunk_report["text_bytes"] + 1
+                    report["encoded_bytes"] += len(frame)
+                    report["seconds"] += chunk_report["seconds"]
+                    chunk = list(islice(rows, CODEC_CHUNK_ROWS))
+        if encoded and self.tuner is not None:
+            encoded = self.tuner.choose_codec(filename, *first_chunk)
+        if not encoded:
+            self.column_report.pop(filename, None)
+            os.remove(num_path)
+            return filepath
+        self.column_report[filename] = report
+        os.remove(filepath)
+        return num_path
+
+    def __column_payload(self, name, content_list):
+        '''
+        (suffix, bytes) of the column name (an arcname without suffix): ".num" 
+        and its numeric codec payload with column_codec, or with auto_tune if 
+        the tuner picks it over the text, else ".csv" and the text
+        '''
+        if self.column_codec or self.tuner is not None:
+            payload = self.__encode_column(name, content_list)
+            if payload is not None:
+                if self.tuner is None:
+                    return ".num", payload
+                text = "\n".join(list(content_list)).encode("utf-8")
+                if self.tuner.choose_codec(name, text, payload, self.column_report[name]["seconds"]):
+                    return ".num", payload
+                del self.column_report[name]
+                return ".csv", text
+        return ".csv", "\n".join(list(content_list)).encode("utf-8")
+
+    def __tuning_decisions(self):
+        '''
+        The auto_tune decisions of the columns written since the last reset
+        '''
+        return {"columns": self.tuner.decisions, "numeric_columns": sorted(self.tuner.numeric),
+                "unindexed_columns": self.__unindexed_columns()}
+
+    def __report_columns(self):
+        by_codec = {}
+        for report in self.column_report.values():
+            total = by_codec.setdefault(report["codec"], [0, 0, 0, 0])
+            total[0] += 1
+            total[1] += report["text_bytes"]
+            total[2] += report["encoded_bytes"]
+            total[3] += report["seconds"]
+        for codec, (n_columns, text_size, encoded_size, seconds) in by_codec.items():
+            self.metrics.log("Codec {}: {} columns, {} -> {} bytes ({:.1f}x), {:.1f} MB/s".format(
+                  codec, n_columns, text_size, encoded_size, text_size / float(max(encoded_size, 1)),
+                  text_size / 1e6 / max(seconds, 1e-9)))
+
+    def __global_members(self, failed_messages=None):
+        '''
+        Yield (arcname, content bytes) of the members describing the whole 
+        archive, with failed_messages ({0-based line number: line}) if given
+        '''
+        if self.tuner is not None:
+            self.meta["auto_tune"] = self.tuner.budget()
+            if not self.block_lines:
+                self.meta["auto_tune"].update(self.__tuning_decisions())
+        if self.meta:
+            yield "meta.json", json.dumps(self.meta).encode("utf-8")
+        if failed_messages is not None:
+            yield "failed_logs.json", dump_failed(failed_messages)
+        if self.level > 1:
+            yield "template_mapping.json", json.dumps(self.template_mapping).encode("utf-8")
+
+    def __column_members(self, output_columns=True, prefix=""):
+        '''
+        Yield (arcname, content bytes) of the parameter dictionary and of every
+        in-memory column, with arcnames under prefix
+        '''
+        def output_dict(adict):
+            for filename, content_list in adict.items():
+                suffix, content = self.__column_payload(prefix+filename, content_list)
+                yield prefix+filename+suffix, content
+
+        if self.level==3 and not self.lossy:
+            yield prefix+"parameter_mapping.bin", columncodec.dump_length_prefixed(self.para_values)
+        
+        if not output_columns:
+            pass
+        elif self.level == 1:
+            yield from output_dict(self.file_all_column_dict)
+        else:
+            if not self.lossy:
+                yield from output_dict(self.file_para_dict)
+            yield from output_dict(self.file_normal_column_dict)
+
+    def __measure(self, members, replace=False):
+        '''
+        Record the raw size of every (arcname, content) member passing through
+        '''
+        for arcname, content in members:
+            self.metrics.column(arcname, raw_bytes=len(content), replace=replace)
+            yield arcname, content
+
+    def __write_container(self, writer, members, pool=None, replace=False):
+        '''
+        Compress every member on its own (in pool if given) and add it to writer
+        '''
+        tasks = ((arcname, content) + self.__member_kernel(arcname, content)
+                 for arcname, content in self.__measure(members, replace))
+        for arcname, content in (pool.imap(compress_member, tasks) if pool else map(compress_member, tasks)):
+            self.metrics.column(arcname, compressed_bytes=len(content), replace=replace)
+            writer.add(arcname, content)
+
+    def __write_files(self, writer, filepaths, pool=None):
+        '''
+        Compress every column file to a file of its own (in pool if given) and 
+        copy it into writer, so no member is held in memory as a whole
+        '''
+        tasks = []
+        for filepath in filepaths:
+            arcname = os.path.basename(filepath)
+            self.metrics.column(arcname, raw_bytes=os.path.getsize(filepath))
+            if self.tuner is None:
+                kernel = (self.kernel, self.kernel_level)
+            else:
+                kernel = self.tuner.choose_kernel(arcname, autotune.sample_file(filepath, self.tuner.sample_bytes))
+            tasks.append((arcname, filepath) + kernel)
+        for (arcname, compressed_path), (_, filepath, _, _) in zip(
+                pool.imap(compress_file, tasks) if pool else map(compress_file, tasks), tasks):
+            self.metrics.column(arcname, compressed_bytes=os.path.getsize(compressed_path))
+            writer.add_file(arcname, compressed_path)
+            if compressed_path != filepath:
+                os.remove(compressed_path)
+
+    def __spill(self, members):
+        '''
+        Write (arcname, content) members to tmp_dir, returns their filepaths
+        '''
+        filepaths = []
+        for arcname, content in members:
+            filepath = os.path.join(self.tmp_dir, arcname)
+            with open(filepath, "wb") as fw:
+                fw.write(content)
+            filepaths.append(filepath)
+        return filepaths
+
+    def __kernel_compress(self, output_columns=True):
         '''
         level1 : only normal
         [self.file_all_column_dict]
@@ -157,92 +558,629 @@ class Ziplog():
         ---
         leve3: parse and index 
         [self.file_para_dict, self.file_normal_column_dict]
+        ---
+        Members are added to the tar straight from memory; with use_tmp_dir the 
+        column members are written to tmp_dir first. Column files in tmp_dir 
+        (self.column_files, from zip_chunks, or written with use_tmp_dir) are 
+        streamed into the archive in fixed-size reads, never read whole.
+        With column_kernel, each member is compressed on its own (in n_workers 
+        processes) and the results are indexed in one .lzc container.
         '''
+        if self.level not in [1, 2, 3]:
+            raise RuntimeError(f"The level {self.level} is illegal!")
         
-        def output_dict(adict):
-            for filename, content_list in adict.items():
-                with open(os.path.join(self.tmp_dir, filename+".csv"), "w") as fw:
-                    fw.writelines("\n".join(list(content_list)))
-        
-        def files_to_tar(filepaths):
-            worker_id = os.getpid()
-            print("Worker {} start taring {} files.".format(worker_id, len(filepaths)))
-            for idx, filepath in enumerate(filepaths, 1):
-                if len(filepaths) > 10 and idx % (len(filepaths)// 10) == 0:
-                    print("Worker {}, {}/{}".format(worker_id, idx, len(filepaths)))
-                if self.kernel == "gz" or self.kernel == "bz2":
-                    tar = tarfile.open(filepath + ".tar.{}".format(self.kernel ),\
-                                       "w:{}".format(self.kernel ))
-                    tar.add(filepath, arcname=os.path.basename(filepath))
-                    tar.close()
-                elif self.kernel  == "lzma":
-                    os.system('lzma -k {}'.format(filepath)) 
-            
-            
         ## output begin
-        if self.level==3 and not self.lossy:
-            with open(os.path.join(self.tmp_dir, "parameter_mapping.json"), "w") as fw:
-                    json.dump(self.index_para_dict, fw)
-        if self.level > 1:
-            with open(os.path.join(self.tmp_dir, "template_mapping.json"), "w") as fw:
-                json.dump(self.template_mapping, fw)
-        
-        if self.level == 1:
-            output_dict(self.file_all_column_dict)
-        elif self.level == 2 or self.level == 3:
-            if not self.lossy:
-                output_dict(self.file_para_dict)
-            output_dict(self.file_normal_column_dict)
-        else:
-            raise RuntimeError(f"The level {self.level} is illegal!")
+        failed_messages = self.loader.failed_messages if self.loader is not None else None
+        members = self.__column_members(output_columns)
+        filepaths = list(self.column_files)
+        if self.use_tmp_dir:
+            filepaths += self.__spill(members)
+            members = []
+        global_members = self.__global_members(failed_messages)
         ## output end
         
         
         ## compress begin 
-        if self.kernel in set(["gz", "bz2"]):
-            raw_files = glob.glob(os.path.join(self.tmp_dir, "*.csv"))\
-                        + glob.glob(os.path.join(self.tmp_dir, "*.json"))
-            tarall = tarfile.open(os.path.join(self.outdir, \
-                                    "{}.tar.{}".format(self.outname, self.kernel)),\
-                                    "w:{}".format(self.kernel))
-            for idx, filepath in enumerate(raw_files, 1):
-                tarall.add(filepath, arcname=os.path.basename(filepath))
-            tarall.close()
+        if self.kernel not in KERNEL_SUFFIX:
+            raise RuntimeError(f"The kernel {self.kernel} is illegal!")
+        if self.column_kernel:
+            # every member compressed on its own, then indexed in one container
+            with container.ContainerWriter(os.path.join(self.outdir, "{}.lzc".format(self.outname))) as writer:
+                pool = mp.Pool(processes=self.n_workers) if self.n_workers > 1 else None
+                try:
+                    if self.tuner is None:
+                        self.__write_container(writer, global_members)
+                    self.__write_container(writer, members, pool)
+                    self.__write_files(writer, filepaths, pool)
+                    if self.tuner is not None:
+                        # meta.json, holding the tuning decisions, after the columns
+                        self.__write_container(writer, global_members)
+                finally:
+                    if pool is not None:
+                        pool.close()
+                        pool.join()
+        else:
+            level_kwargs = {}
+            if self.kernel_level is not None:
+                level_kwargs = {"preset": self.kernel_level} if self.kernel == "lzma" \
+                               else {"compresslevel": self.kernel_level}
+            with tarfile.open(os.path.join(self.outdir, \
+                              "{}.tar.{}".format(self.outname, self.kernel)),\
+                              "w:{}".format(KERNEL_SUFFIX[self.kernel]), **level_kwargs) as tarall:
+                for arcname, content in self.__measure(chain(global_members, members)):
+                    add_tar_member(tarall, arcname, content)
+                for filepath in filepaths:
+                    self.metrics.column(os.path.basename(filepath), raw_bytes=os.path.getsize(filepath))
+                    # streamed by tarfile in fixed-size reads
+                    tarall.add(filepath, arcname=os.path.basename(filepath))
         ## compress end
+        if self.column_codec or self.tuner is not None:
+            self.__report_columns()
+        if self.tuner is not None:
+            self.__count_tuning(self.__tuning_decisions())
+            self.__report_tuning()
         
         
+    def __reset_lines(self):
+        self.n_rows = 0
+        self.last_line_id = 0
+        self.line_gaps = []
+
+    def __record_lines(self, line_ids):
+        '''
+        Remember which line numbers have no row (failed or blank lines), so that 
+        decompression can put every row back on its original line
+        '''
+        line_ids = np.asarray(line_ids, dtype=np.int64)
+        if not len(line_ids):
+            return
+        previous = np.concatenate([[self.last_line_id], line_ids[:-1]])
+        gap_index = line_ids - previous > 1
+        for prev_id, line_id in zip(previous[gap_index], line_ids[gap_index]):
+            self.line_gaps.extend(range(int(prev_id) + 1, int(line_id)))
+        self.last_line_id = int(line_ids[-1])
+        self.n_rows += len(line_ids)
+
+    def __finish_meta(self, line_gaps=True):
+        '''
+        Block-segmented archives keep their line gaps per block (line_gaps=False)
+        '''
+        total_lines = self.last_line_id
+        if self.loader is not None:
+            total_lines = max(total_lines, self.loader.total_lines + self.line_offset)
+        self.meta.update({"logformat": self.logformat, "level": self.level, "lossy": self.lossy,
+                          "n_rows": self.n_rows, "total_lines": total_lines, "time_columns": self.time_columns})
+        if line_gaps:
+            self.meta["line_gaps"] = self.line_gaps
+        else:
+            self.meta.pop("line_gaps", None)
+
     def zip_dataframe(self, log_dataframe):
-        self.log_dataframe = log_dataframe.fillna("")
+        '''
+        Compress a matched log, given as a StructuredLog or as the DataFrame of 
+        PatternMatch.match
+        '''
+        self.structured_log = self.__structured(log_dataframe)
+        self.column_files = []
+        self.__reset_para_index()
+        self.__reset_lines()
+        self.__record_lines(self.structured_log.line_ids)
+        self.__finish_meta()
+        self.stage_times = {}
         
         t1 = time.time()
-        if self.level == 1:
-            self.compress_all()
-        elif self.level == 2 or self.level==3:
-            self.compress_normal()
-            self.compress_content()
+        self.__split_columns()
         t2 = time.time()
-        self.__kernel_compress()
+        with self.__stage("kernel_compress"):
+            self.__kernel_compress()
         t3 = time.time()
         
         self.splitting_time = t2 - t1
         self.packing_time = t3 - t2
     
+    def zip_chunks(self, structured_chunks):
+        '''
+        Chunked counterpart of zip_dataframe: each structured chunk is split and 
+        appended to the column files in tmp_dir, so memory is bounded by the 
+        chunk size plus the template and parameter dictionaries.
+        '''
+        if self.level not in [1, 2, 3]:
+            raise RuntimeError(f"The level {self.level} is illegal!")
+        if not self.tmp_dir:
+            raise RuntimeError("A tmp_dir is required to compress in chunks!")
+        for filepath in glob.glob(os.path.join(self.tmp_dir, "*.csv"))\
+                        + glob.glob(os.path.join(self.tmp_dir, "*.num")):
+            os.remove(filepath)
+        self.column_files = []
+        self.stage_times = {}
+        self.__reset_para_index()
+        self.column_rows = {}
+        self.column_group = {}
+        self.group_rows = {}
+        template_mapping = {}
+        
+        self.__reset_lines()
+        for chunk in structured_chunks:
+            self.structured_log = self.__structured(chunk)
+            n_rows = len(self.structured_log)
+            self.__record_lines(self.structured_log.line_ids)
+            t1 = time.time()
+            if self.level == 1:
+                group_counts = {"": n_rows}
+                self.__split_columns()
+                t2 = time.time()
+                self.__append_columns(self.file_all_column_dict, lambda x: "")
+            else:
+                group_counts = self.structured_log.event_counts()
+                group_counts[""] = n_rows
+                self.__split_columns()
+                template_mapping.update(self.template_mapping)
+                t2 = time.time()
+                self.__append_columns(self.file_normal_column_dict, lambda x: "")
+                if not self.lossy:
+                    self.__append_columns(self.file_para_dict, lambda x: x.split("_")[0])
+            for group, count in group_counts.items():
+                self.group_rows[group] = self.group_rows.get(group, 0) + count
+            t3 = time.time()
+            self.splitting_time += t2 - t1
+            self.packing_time += t3 - t2
+        
+        t2 = time.time()
+        for filename, group in self.column_group.items():
+            written = self.column_rows[filename]
+            self.__write_rows(filename, [""] * (self.group_rows[group] - written), written)
+        for filename in self.column_group:
+            filepath = os.path.join(self.tmp_dir, filename+".csv")
+            if not os.path.isfile(filepath):
+                continue
+            if self.column_codec or self.tuner is not None:
+                filepath = self.__encode_column_file(filename, filepath)
+            self.column_files.append(filepath)
+        self.template_mapping = template_mapping
+        self.__finish_meta()
+        self.__kernel_compress(output_columns=False)
+        self.packing_time += time.time() - t2
+
+    def __structured(self, chunk):
+        if isinstance(chunk, StructuredLog):
+            return chunk
+        return StructuredLog.from_dataframe(chunk)
+
+    def __split_columns(self):
+        if self.level == 1:
+            with self.__stage("compress_all"):
+                self.compress_all()
+        else:
+            with self.__stage("compress_normal"):
+                self.compress_normal()
+            with self.__stage("compress_content"):
+                self.compress_content()
+
+    @contextmanager
+    def __stage(self, stage):
+        '''
+        Time stage in self.stage_times and in the run metrics (which may also 
+        profile it)
+        '''
+        t1 = time.time()
+        with self.metrics.stage(stage):
+            yield
+        self.stage_times[stage] = self.stage_times.get(stage, 0) + time.time() - t1
+
+    def __time_range(self, structured_log):
+        '''
+        (min, max) of the time_columns joined by " ", compared as strings
+        '''
+        columns = [column for column in self.time_columns if column in structured_log.headers]
+        if not columns or not len(structured_log):
+            return None, None
+        stamps = pd.Series(structured_log.column(columns[0])).astype(str)
+        for column in columns[1:]:
+            stamps = stamps + " " + pd.Series(structured_log.column(column)).astype(str)
+        return stamps.min(), stamps.max()
+
+    def __read_previous(self):
+        '''
+        Return the top-level members (meta, mappings, block index and the failed 
+        lines after the last block) of the block-segmented archive to append 
+        to, or None if there is none yet. Their size does not grow with the 
+        number of blocks or lines, except for the template mapping.
+        '''
+        path = os.path.join(self.outdir, "{}.lzc".format(self.outname))
+        if not os.path.isfile(path):
+            return None
+        previous = {}
+        with container.ContainerReader(path) as reader:
+            for name in reader.names():
+                if "/" not in name:
+                    basename, suffix = name.rsplit(".", 1)
+                    previous[basename] = json.loads(DECOMPRESS[suffix](reader.read(name)))
+        if "block_index.json" not in previous:
+            raise RuntimeError(f"{path} is not a block-segmented archive!")
+        meta = previous["meta.json"]
+        if (meta["level"], meta["lossy"], meta["logformat"]) != (self.level, self.lossy, self.logformat):
+            raise RuntimeError(f"{path} was compressed with another level, lossy or logformat!")
+        return previous
+
+    def __previous_id_map(self, previous):
+        '''
+        {matched template: EventId} of the archive to append to, so that its 
+        templates keep their EventIds
+        '''
+        if previous is None:
+            return None
+        nomatch_event = previous["meta.json"].get("nomatch_event")
+        id_map = {template: eid for eid, template in previous.get("template_mapping.json", {}).items()
+                  if eid != nomatch_event}
+        if nomatch_event is not None:
+            id_map["NoMatch"] = nomatch_event
+        return id_map
+
+    def __write_top_level(self, writer, template_mapping):
+        '''
+        Write the top-level members of a block-segmented archive. Failed lines 
+        not stored with a block yet (those after the last block) go to 
+        failed_logs.json; block_index.json only holds the number of blocks and 
+        the last line of the last one, the entries are stored with the blocks.
+        '''
+        self.template_mapping = template_mapping
+        self.__finish_meta(line_gaps=False)
+        self.meta["block_lines"] = self.block_lines
+        block_index = json.dumps({"n_blocks": self.n_blocks, "last_line": self.last_line_id}).encode("utf-8")
+        # rewritten after every block of a durable run, so sizes are replaced, not added
+        self.__write_container(writer, chain(self.__global_members(self.__pending_failed()),
+                                             [("block_index.json", block_index)]), replace=True)
+
+    def __pending_failed(self):
+        '''
+        {0-based line number: line} of the failed lines not stored with a block 
+        yet, moved over from the loader
+        '''
+        if self.loader is not None:
+            for line_count, line in self.loader.take_failed().items():
+                self.pending_failed[int(line_count) + self.line_offset] = line
+        return self.pending_failed
+
+    def __take_failed(self, last_line):
+        '''
+        Remove and return the pending failed lines up to the 1-based last_line
+        '''
+        pending = self.__pending_failed()
+        return {line_count: pending.pop(line_count) for line_count in sorted(pending) if line_count < last_line}
+
+    def zip_blocks(self, structured_chunks, previous=None, durable=False):
+        '''
+        Block-segmented counterpart of zip_chunks: each structured chunk becomes 
+        an independent block of a .lzc container, with its own header columns, 
+        parameter columns, parameter dictionary and failed lines under the 
+        prefix "b{idx}/". Only the template mapping (and meta) is shared. The 
+        last member of a block, b{idx}/block.json, records its byte range in the 
+        container, its line range, row count, line gaps, min/max timestamp and 
+        row count per EventId, so blocks can be read (or skipped) without each 
+        other. The top-level block_index.json only holds the number of blocks.
+        With previous (from __read_previous), the blocks are appended to that 
+        archive: line numbers continue after its lines, the failed lines after 
+        its last block go to the first new one, and only the small top-level 
+        members are rewritten, so the cost is proportional to the new lines.
+        With durable, the top-level members are rewritten and committed after 
+        every block, so the archive on disk is complete after each of them and 
+        a block interrupted while being written leaves it as after the previous 
+        one.
+        '''
+        if self.level not in [1, 2, 3]:
+            raise RuntimeError(f"The level {self.level} is illegal!")
+        if self.kernel not in KERNEL_SUFFIX:
+            raise RuntimeError(f"The kernel {self.kernel} is illegal!")
+        self.column_files = []
+        self.stage_times = {}
+        self.n_blocks = 0
+        template_mapping = {}
+        self.__reset_lines()
+        self.line_offset = 0
+        self.pending_failed = {}
+        if previous is not None:
+            meta = previous["meta.json"]
+            block_index = previous["block_index.json"]
+            template_mapping = previous.get("template_mapping.json", {})
+            self.pending_failed = {int(line_count): line
+                                   for line_count, line in previous.get("failed_logs.json", {}).items()}
+            self.line_offset = meta["total_lines"]
+            # lines after the last block (failed or blank) belong to the first new block
+            self.last_line_id = block_index["last_line"]
+            self.n_rows = meta["n_rows"]
+            self.n_blocks = block_index["n_blocks"]
+            if "nomatch_event" in meta:
+                self.meta["nomatch_event"] = meta["nomatch_event"]
+        path = os.path.join(self.outdir, "{}.lzc".format(self.outname))
+        append = previous is not None
+        replace = [name + "." + suffix for name in TOP_LEVEL_MEMBERS for suffix in DECOMPRESS]
+        
+        pool = mp.Pool(processes=self.n_workers) if self.n_workers > 1 else None
+        writer = None
+        stage = None
+        self.write_time = 0
+        n_blocks = first_block = self.n_blocks
+        try:
+            if self.pipeline_depth and not durable:
+                # block k is compressed (pool) and written (thread) while block k+1 is split
+                writer = container.ContainerWriter(path, append=append, replace=replace)
+                stage = pipeline.Stage(lambda item: self.__add_block(writer, *item), self.pipeline_depth)
+            for chunk in structured_chunks:
+                if not len(chunk):
+                    continue
+                t1 = time.time()
+                self.structured_log = self.__structured(chunk)
+                first_line = self.last_line_id + 1
+                n_rows = self.n_rows
+                self.line_gaps = []
+                self.__record_lines(self.structured_log.line_ids + self.line_offset)
+                min_time, max_time = self.__time_range(self.structured_log)
+                events = {}
+                if self.level > 1:
+                    events = self.structured_log.event_counts()
+                self.__reset_para_index()
+                self.__split_columns()
+                if self.level > 1:
+                    template_mapping.update(self.template_mapping)
+                t2 = time.time()
+                prefix = "b{}/".format(n_blocks)
+                members = self.__column_members(prefix=prefix)
+                failed_messages = self.__take_failed(self.last_line_id)
+                if failed_messages:
+                    members = chain(members, [(prefix + "failed_logs.json", dump_failed(failed_messages))])
+                members = list(self.__measure(members))
+                n_blocks += 1
+                block = {"first_line": first_line, "last_line": self.last_line_id,
+                         "n_rows": self.n_rows - n_rows, "line_gaps": self.line_gaps,
+                         "min_time": min_time, "max_time": max_time, "events": events}
+                compressed = self.__compress_members(members, pool)
+                if self.tuner is not None:
+                    block["auto_tune"] = self.__tuning_decisions()
+                    self.tuner.reset()
+                    self.__count_tuning(block["auto_tune"])
+                if stage is not None:
+                    stage.put((block, compressed))
+                else:
+                    if writer is None:
+                        writer = container.ContainerWriter(path, append=append, replace=replace)
+                    self.__add_block(writer, block, compressed)
+                if durable:
+                    self.__write_top_level(writer, template_mapping)
+                    writer.commit()
+                t3 = time.time()
+                self.splitting_time += t2 - t1
+                self.packing_time += t3 - t2
+            
+            t2 = time.time()
+            if stage is not None:
+                stage.close()
+                stage = None
+            if writer is None:
+                writer = container.ContainerWriter(path, append=append, replace=replace)
+            self.__write_top_level(writer, template_mapping)
+            self.packing_time += time.time() - t2
+        finally:
+            if stage is not None:
+                stage.close()
+            if writer is not None:
+                writer.close()
+            if pool is not None:
+                pool.close()
+                pool.join()
+        if self.column_codec or self.tuner is not None:
+            self.__report_columns()
+        if self.tuner is not None:
+            self.__report_tuning()
+        self.metrics.log("Wrote {} blocks of up to {} lines.".format(self.n_blocks - first_block, self.block_lines))
+
+    def __compress_members(self, members, pool=None):
+        '''
+        Start compressing members (in pool if given); returns an iterator over 
+        the compressed (arcname, content)
+        '''
+        tasks = [(arcname, content) + self.__member_kernel(arcname, content) for arcname, content in members]
+        return pool.imap(compress_member, tasks) if pool else map(compress_member, tasks)
+
+    def __member_kernel(self, arcname, content):
+        '''
+        (kernel, level) of a member: self.kernel and self.kernel_level, or with 
+        auto_tune the ones the tuner picks for a column member
+        '''
+        if self.tuner is None or arcname.rsplit("/", 1)[-1] in TOP_LEVEL_MEMBERS:
+            return self.kernel, self.kernel_level
+        return self.tuner.choose_kernel(arcname, content)
+
+    def __count_tuning(self, decisions):
+        for kernel, level in decisions["columns"].values():
+            self.metrics.count("tuned_{}{}".format(kernel, "" if level is None else "-{}".format(level)))
+        self.metrics.count("numeric_columns", len(decisions["numeric_columns"]))
+        self.metrics.count("unindexed_columns", len(decisions["unindexed_columns"]))
+
+    def __report_tuning(self):
+        self.metrics.gauge("tuning_seconds", self.tuner.seconds)
+        names = ["{}{}".format(kernel, "" if level is None else "-{}".format(level)) for kernel, level in self.tuner.kernels]
+        kernels = ["{} {}".format(self.metrics.counters["tuned_" + name], name)
+                   for name in names if "tuned_" + name in self.metrics.counters]
+        self.metrics.log("Auto-tuned columns: {}, {} numeric-coded, {} parameter columns not indexed "
+              "[{:.2f}s sampling]".format(", ".join(kernels), self.metrics.counters.get("numeric_columns", 0),
+                                          self.metrics.counters.get("unindexed_columns", 0), self.tuner.seconds))
+
+    def __add_block(self, writer, block, compressed):
+        '''
+        Write the compressed members of a block, then its index entry
+        '''
+        t1 = time.time()
+        offset = writer.offset
+        for arcname, content in compressed:
+            self.metrics.column(arcname, compressed_bytes=len(content))
+            writer.add(arcname, content)
+        block.update({"offset": offset, "size": writer.offset - offset})
+        arcname = "b{}/block.json".format(self.n_blocks)
+        content = json.dumps(block).encode("utf-8")
+        self.metrics.column(arcname, raw_bytes=len(content))
+        arcname, content = compress_member((arcname, content, self.kernel, self.kernel_level))
+        self.metrics.column(arcname, compressed_bytes=len(content))
+        writer.add(arcname, content)
+        self.n_blocks += 1
+        self.metrics.count("blocks")
+        self.metrics.add_time("write_block", time.time() - t1)
+        self.write_time += time.time() - t1
+
+    def zip_stream(self, line_source, templates_filepath, flush_lines=100000, flush_bytes=1 << 26,
+                   flush_seconds=10.0):
+        '''
+        Compress the lines of an iterable that may block, e.g. sys.stdin or 
+        logstream.tail_lines, into the block-segmented archive outdir/outname.lzc 
+        (appended to if it exists). A segment is flushed as one block once it 
+        holds flush_lines lines or flush_bytes bytes, or flush_seconds after its 
+        first line, and the archive is complete after every flush (a crash 
+        during a flush loses only the lines of that flush). The match 
+        tree and EventIds live for the whole stream; line gaps and failed lines 
+        are stored with their block, so a flush only rewrites the small 
+        top-level members and memory does not grow with the stream.
+        '''
+        self.block_lines = flush_lines
+        t1 = time.time()
+        previous = self.__read_previous()
+        self.loader = logloader.LogLoader(self.logformat, None, metrics=self.metrics)
+        segments = self.loader.iter_stream(line_source, flush_lines, flush_bytes, flush_seconds)
+        self.zip_blocks(self.match_log_chunks(segments, templates_filepath, self.__previous_id_map(previous)),
+                        previous, durable=True)
+        self.total_time = time.time() - t1
+        self.__write_report()
+
     def load_file(self, filepath):
-        loader = logloader.LogLoader(self.logformat, self.tmp_dir)
-        log_dataframe = loader.load_to_dataframe(filepath)
+        self.loader = logloader.LogLoader(self.logformat, None, n_workers=self.n_workers, metrics=self.metrics)
+        log_dataframe = self.loader.load_to_dataframe(filepath)
         return log_dataframe
     
+    def load_templates(self, templates_filepath):
+        '''
+        Accept either a raw templates file (one template per line), a bundle 
+        saved by PatternMatch.compile_templates, or a TemplateBundle.
+        '''
+        if isinstance(templates_filepath, treematch.TemplateBundle):
+            bundle = templates_filepath
+        elif treematch.TemplateBundle.is_bundle(templates_filepath):
+            bundle = treematch.TemplateBundle.load(templates_filepath)
+        else:
+            with open(templates_filepath) as fr:
+                templates = [item.strip() for item in fr.readlines()]
+            bundle = self.__new_matcher().compile_templates(templates)
+        self.meta["templates_hash"] = bundle.templates_hash
+        return bundle
+
+    def mine_templates(self, log_contents):
+        '''
+        Mine templates from (a sample of) log contents, see templateminer. 
+        Returns their TemplateBundle; the templates are kept in 
+        self.mined_templates.
+        '''
+        miner = templateminer.TemplateMiner(n_workers=self.n_workers, sample_size=self.mine_sample_size,
+                                            max_lines=self.mine_lines, outdir=self.outdir, metrics=self.metrics)
+        bundle = miner.mine(log_contents)
+        self.mined_templates = miner.templates
+        return bundle
+
+    def __sampled_templates(self, filepath, templates_filepath):
+        if templates_filepath is not None:
+            return templates_filepath
+        loader = logloader.LogLoader(self.logformat, None, metrics=self.metrics)
+        return self.mine_templates(loader.sample_to_dataframe(filepath, self.mine_lines)["Content"])
+
+    def __new_matcher(self):
+        return treematch.PatternMatch(tmp_dir=self.tmp_dir, outdir=self.outdir, logformat=self.logformat,
+                                      n_workers=self.n_workers, cache_path=self.match_cache,
+                                      cache_size=self.match_cache_size, metrics=self.metrics,
+                                      structured=True, keep_content=self.level == 1)
+
     def match_logs(self, log_dataframe, templates_filepath):
-        with open(templates_filepath) as fr:
-            templates = [item.strip() for item in fr.readlines()]
-        matcher = treematch.PatternMatch(tmp_dir=self.tmp_dir, outdir=self.outdir, logformat=self.logformat)
-        structured_log = matcher.match(templates, log_dataframe=log_dataframe)
+        bundle = self.load_templates(templates_filepath)
+        structured_log = self.__new_matcher().match(bundle, log_dataframe=log_dataframe)
         return structured_log
         
-    def zip_file(self, filepath, templates_filepath):
-        log_dataframe = self.load_file(filepath)
-        structured_log = self.match_logs(log_dataframe, templates_filepath)
-        self.zip_dataframe(structured_log)
+    def match_log_chunks(self, log_chunks, templates_filepath, id_map=None):
+        bundle = self.load_templates(templates_filepath)
+        return self.__new_matcher().match_chunks(bundle, log_chunks, id_map=id_map)
+        
+    def zip_file(self, filepath, templates_filepath=None, chunk_lines=None, append=False):
+        '''
+        With append, the lines of filepath are added as new blocks to the 
+        block-segmented archive outdir/outname.lzc (created if missing); its 
+        templates keep their EventIds.
+        Without templates_filepath, templates are mined from the log first: 
+        from the loaded contents, or with chunk_lines/block_lines from 
+        mine_lines lines sampled across the file.
+        '''
+        if append and not self.block_lines:
+            raise RuntimeError("Appending needs a block-segmented archive (block_lines)!")
+        t1 = time.time()
+        if self.block_lines:
+            previous = self.__read_previous() if append else None
+            templates_filepath = self.__sampled_templates(filepath, templates_filepath)
+            self.loader = logloader.LogLoader(self.logformat, None, n_workers=self.n_workers, metrics=self.metrics)
+            log_chunks = self.loader.iter_dataframes(filepath, self.block_lines)
+            self.zip_blocks(self.__match_stages(log_chunks, templates_filepath, self.__previous_id_map(previous)),
+                            previous)
+        elif chunk_lines:
+            templates_filepath = self.__sampled_templates(filepath, templates_filepath)
+            self.loader = logloader.LogLoader(self.logformat, None, n_workers=self.n_workers, metrics=self.metrics)
+            log_chunks = self.loader.iter_dataframes(filepath, chunk_lines)
+            self.zip_chunks(self.__match_stages(log_chunks, templates_filepath))
+        else:
+            log_dataframe = self.load_file(filepath)
+            if templates_filepath is None:
+                templates_filepath = self.mine_templates(log_dataframe["Content"])
+            structured_log = self.match_logs(log_dataframe, templates_filepath)
+            del log_dataframe
+            self.zip_dataframe(structured_log)
+        self.total_time = time.time() - t1
+        self.io_time = self.metrics.timers.get("load", 0)
+        self.__report_throughput(os.path.getsize(filepath))
+        self.__write_report(os.path.getsize(filepath))
+
+    def __match_stages(self, log_chunks, templates_filepath, id_map=None):
+        '''
+        With pipeline_depth, chunks are loaded and matched on their own threads 
+        (matching itself runs in the n_workers pool), up to pipeline_depth 
+        chunks ahead of splitting and packing. match_log_chunks creates the 
+        match pool here, before the threads start, so no pool is forked from 
+        a process running them.
+        '''
+        if self.pipeline_depth:
+            log_chunks = pipeline.prefetch(log_chunks, self.pipeline_depth)
+        structured_chunks = self.match_log_chunks(log_chunks, templates_filepath, id_map)
+        if self.pipeline_depth:
+            structured_chunks = pipeline.prefetch(structured_chunks, self.pipeline_depth)
+        return structured_chunks
+
+    def __report_throughput(self, input_bytes):
+        n_lines = self.loader.total_lines if self.loader is not None else self.n_rows
+        total_time = max(self.total_time, 1e-9)
+        self.metrics.gauge("mb_s", input_bytes / 1e6 / total_time)
+        self.metrics.gauge("lines_s", n_lines / total_time)
+        self.metrics.log("Compressed {} lines ({:.1f} MB) in {:.2f}s: {:.2f} MB/s, {:.0f} lines/s "
+              "[splitting {:.2f}s, packing {:.2f}s]".format(n_lines, input_bytes / 1e6, self.total_time,
+              input_bytes / 1e6 / total_time, n_lines / total_time, self.splitting_time, self.packing_time))
+
+    def archive_path(self):
+        if self.block_lines or self.column_kernel:
+            return os.path.join(self.outdir, "{}.lzc".format(self.outname))
+        return os.path.join(self.outdir, "{}.tar.{}".format(self.outname, self.kernel))
+
+    def __write_report(self, input_bytes=None):
+        '''
+        Write the run metrics, with the archive and stage totals, to 
+        outdir/outname.report.json
+        '''
+        if not self.run_report:
+            return
+        archive_path = self.archive_path()
+        extra = {"archive": archive_path, "archive_bytes": os.path.getsize(archive_path),
+                 "input_bytes": input_bytes, "total_time": self.total_time, "io_time": self.io_time,
+                 "splitting_time": self.splitting_time, "packing_time": self.packing_time,
+                 "stage_times": self.stage_times, "column_report": self.column_report}
+        self.metrics.write_report(os.path.join(self.outdir, "{}.report.json".format(self.outname)), extra)
         
     
 def main():
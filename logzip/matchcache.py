@@ -0,0 +1,123 @@
+# Copyright 2018 The LogPAI Team (https://github.com/logpai).
+#
+# Licensed under the MIT License:
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# =============================================================================
+""" This file implements a persistent content-to-template match cache, shared
+    by runs, files and processes through a sqlite database
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+MATCHER_VERSION = "treematch-1"
+SQLITE_MAX_VARS = 500
+
+
+def template_set_hash(templates):
+    """ Hash of an ordered template set. Order matters since it breaks ties
+        between equally good templates.
+    """
+    sha1 = hashlib.sha1(MATCHER_VERSION.encode("utf-8"))
+    for template in templates:
+        sha1.update(template.encode("utf-8", errors="ignore"))
+        sha1.update(b"\n")
+    return sha1.hexdigest()
+
+
+class MatchCache(object):
+    def __init__(self, cache_path, template_hash, max_entries=1000000):
+        self.cache_path = cache_path
+        self.template_hash = template_hash
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        cache_dir = os.path.dirname(os.path.abspath(cache_path))
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.conn = sqlite3.connect(cache_path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS match_cache "
+                          "(key BLOB PRIMARY KEY, template TEXT, parameters TEXT, used REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS match_cache_used ON match_cache (used)")
+        # the number of entries, kept by triggers so that every process sees it
+        self.conn.execute("CREATE TABLE IF NOT EXISTS match_cache_size (n INTEGER)")
+        self.conn.execute("CREATE TRIGGER IF NOT EXISTS match_cache_insert AFTER INSERT ON match_cache "
+                          "BEGIN UPDATE match_cache_size SET n = n + 1; END")
+        self.conn.execute("CREATE TRIGGER IF NOT EXISTS match_cache_delete AFTER DELETE ON match_cache "
+                          "BEGIN UPDATE match_cache_size SET n = n - 1; END")
+        # counted once for a cache written before match_cache_size existed
+        self.conn.execute("INSERT INTO match_cache_size SELECT COUNT(*) FROM match_cache "
+                          "WHERE NOT EXISTS (SELECT 1 FROM match_cache_size)")
+        self.conn.commit()
+
+    def _key(self, log_content):
+        return hashlib.blake2b((self.template_hash + log_content).encode("utf-8", errors="ignore"),
+                               digest_size=16).digest()
+
+    def get_many(self, log_list):
+        """ Return {content: (template, parameters)} for the cached contents
+        """
+        key_content = {self._key(log_content): log_content for log_content in log_list}
+        keys = list(key_content)
+        found = {}
+        for i in range(0, len(keys), SQLITE_MAX_VARS):
+            chunk = keys[i:i + SQLITE_MAX_VARS]
+            rows = self.conn.execute("SELECT key, template, parameters FROM match_cache WHERE key IN ({})"\
+                                     .format(",".join("?" * len(chunk))), chunk)
+            for key, template, parameters in rows:
+                parameters = json.loads(parameters)
+                found[key_content[key]] = (template, tuple(parameters) if parameters else parameters)
+        now = time.time()
+        found_keys = [(now, key) for key, log_content in key_content.items() if log_content in found]
+        self.conn.executemany("UPDATE match_cache SET used=? WHERE key=?", found_keys)
+        self.conn.commit()
+        self.hits += len(found)
+        self.misses += len(key_content) - len(found)
+        return found
+
+    def put_many(self, log_template_dict):
+        now = time.time()
+        # an upsert, not INSERT OR REPLACE: the rows REPLACE deletes do not fire match_cache_delete
+        self.conn.executemany("INSERT INTO match_cache VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                              "template=excluded.template, parameters=excluded.parameters, used=excluded.used",
+                              [(self._key(log_content), template, json.dumps(parameters), now)
+                               for log_content, (template, parameters) in log_template_dict.items()])
+        n_entries = self.conn.execute("SELECT n FROM match_cache_size").fetchone()[0]
+        if n_entries > self.max_entries:
+            # least recently used entries go first
+            n_evict = n_entries - self.max_entries
+            self.conn.execute("DELETE FROM match_cache WHERE key IN "
+                              "(SELECT key FROM match_cache ORDER BY used LIMIT ?)", (n_evict,))
+            self.evictions += n_evict
+        self.conn.commit()
+
+    def hit_rate(self):
+        return self.hits / float(max(self.hits + self.misses, 1))
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hit_rate()}
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,159 @@
+# Copyright 2018 The LogPAI Team (https://github.com/logpai).
+#
+# Licensed under the MIT License:
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# =============================================================================
+""" This file implements the metrics shared by LogLoader, PatternMatch and
+    Ziplog during one run: stage timers, counters, gauges and per-column
+    byte counts, optional cProfile/tracemalloc of chosen stages, and the JSON
+    run report.
+
+    Every update is also passed to the registered callbacks as
+    callback(kind, name, value), where kind is "timer" (seconds of one run of
+    a stage), "counter" (an increment), "gauge" (a new value) or "log" (a
+    progress message, which is printed too unless quiet).
+"""
+
+import cProfile
+import json
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+N_PROFILE_FUNCTIONS = 20
+
+
+def column_key(arcname):
+    """ Column of an archive member, without block prefix and kernel suffix
+    """
+    arcname = re.sub(r"^b\d+/", "", arcname)
+    for suffix in [".gz", ".bz2", ".xz", ".raw"]:
+        if arcname.endswith(suffix):
+            return arcname[:-len(suffix)]
+    return arcname
+
+
+class RunMetrics(object):
+    def __init__(self, callbacks=None, profile=(), trace_memory=(), quiet=False):
+        self.callbacks = list(callbacks or [])
+        self.profile_stages = set(profile)
+        self.trace_memory_stages = set(trace_memory)
+        self.quiet = quiet
+        self.timers = {}
+        self.calls = {}
+        self.counters = {}
+        self.gauges = {}
+        self.columns = {}
+        self.memory_peaks = {}
+        self.profilers = {}
+        self.started_tracing = False
+        self.lock = threading.Lock()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def _emit(self, kind, name, value):
+        for callback in self.callbacks:
+            callback(kind, name, value)
+
+    def log(self, message):
+        if not self.quiet:
+            print(message)
+        self._emit("log", None, message)
+
+    @contextmanager
+    def stage(self, name):
+        """ Time a run of the stage name, profiling it if asked for
+        """
+        profiler = None
+        if name in self.profile_stages:
+            profiler = self.profilers.setdefault(name, cProfile.Profile())
+            profiler.enable()
+        tracing = name in self.trace_memory_stages
+        if tracing:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            tracemalloc.reset_peak()
+        t1 = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - t1
+            if profiler is not None:
+                profiler.disable()
+            if tracing:
+                peak = tracemalloc.get_traced_memory()[1]
+                self.memory_peaks[name] = max(self.memory_peaks.get(name, 0), peak)
+            self.add_time(name, seconds)
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            self.timers[name] = self.timers.get(name, 0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+        self._emit("timer", name, seconds)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        self._emit("counter", name, value)
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+        self._emit("gauge", name, value)
+
+    def column(self, arcname, raw_bytes=None, compressed_bytes=None, replace=False):
+        """ Add (or with replace, set) the sizes of a member to its column
+        """
+        with self.lock:
+            sizes = self.columns.setdefault(column_key(arcname), {"raw_bytes": 0, "compressed_bytes": 0})
+            for key, value in [("raw_bytes", raw_bytes), ("compressed_bytes", compressed_bytes)]:
+                if value is not None:
+                    sizes[key] = value if replace else sizes[key] + value
+
+    def report(self):
+        return {"timers": {name: {"seconds": seconds, "calls": self.calls[name]}
+                           for name, seconds in self.timers.items()},
+                "counters": dict(self.counters), "gauges": dict(self.gauges),
+                "columns": dict(self.columns), "memory_peaks": dict(self.memory_peaks)}
+
+    def write_report(self, path, extra=None):
+        """ Write the JSON run report to path, and the profile of every profiled
+            stage next to it as {path without .json}.{stage}.prof
+        """
+        report = self.report()
+        report.update(extra or {})
+        report["profiles"] = {}
+        for name, profiler in self.profilers.items():
+            prof_path = "{}.{}.prof".format(re.sub(r"\.json$", "", path), name)
+            profiler.dump_stats(prof_path)
+            stats = pstats.Stats(profiler).stats
+            top = sorted(stats.items(), key=lambda item: -item[1][3])[:N_PROFILE_FUNCTIONS]
+            report["profiles"][name] = {"path": prof_path, "top": [
+                {"function": "{}:{}({})".format(*func), "calls": ncalls, "tottime": tottime, "cumtime": cumtime}
+                for func, (_, ncalls, tottime, cumtime, _) in top]}
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        with open(path, "w") as fw:
+            json.dump(report, fw, indent=2)
+        return report
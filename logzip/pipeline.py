@@ -0,0 +1,100 @@
+# Copyright 2018 The LogPAI Team (https://github.com/logpai).
+#
+# Licensed under the MIT License:
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# =============================================================================
+""" This file implements the thread stages that let Ziplog overlap loading,
+    matching, splitting and packing of consecutive chunks. Stages are linked
+    by queues of at most depth items, so a fast stage blocks instead of
+    running ahead of a slow one (backpressure). The CPU-heavy work inside a
+    stage (matching, compression) runs in process pools: the threads hold the
+    GIL otherwise, so stages only overlap with n_workers > 1. Pools are
+    created before the stages start, never from a stage thread.
+"""
+
+import queue
+import threading
+
+_DONE = object()
+
+
+class _Failure(object):
+    def __init__(self, error):
+        self.error = error
+
+
+def prefetch(iterable, depth=2):
+    """ Iterate iterable on a thread, at most depth items ahead of the consumer.
+        The thread has ended when the iteration does.
+    """
+    items = queue.Queue(maxsize=depth)
+    def produce():
+        try:
+            for item in iterable:
+                items.put(item)
+        except BaseException as error:
+            items.put(_Failure(error))
+        else:
+            items.put(_DONE)
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    while True:
+        item = items.get()
+        if item is _DONE:
+            thread.join()
+            return
+        if isinstance(item, _Failure):
+            thread.join()
+            raise item.error
+        yield item
+
+
+class Stage(object):
+    """ Call consume(item) on a thread for every item put, at most depth items
+        behind the producer. close() waits for the last item and re-raises
+        the first error of consume.
+    """
+    def __init__(self, consume, depth=2):
+        self.consume = consume
+        self.items = queue.Queue(maxsize=depth)
+        self.error = None
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def __run(self):
+        while True:
+            item = self.items.get()
+            if item is _DONE:
+                return
+            if self.error is None:
+                try:
+                    self.consume(item)
+                except BaseException as error:
+                    self.error = error
+
+    def put(self, item):
+        if self.error is not None:
+            raise self.error
+        self.items.put(item)
+
+    def close(self):
+        self.items.put(_DONE)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
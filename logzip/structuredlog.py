@@ -0,0 +1,170 @@
+# Copyright 2018 The LogPAI Team (https://github.com/logpai).
+#
+# Licensed under the MIT License:
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# =============================================================================
+""" This file implements the compact form of a matched log that
+    PatternMatch(structured=True) hands to Ziplog, in place of a DataFrame
+    with a template string, an EventId and a parameter tuple per row:
+
+    - templates and EventIds are stored once, rows refer to them by an
+      integer event code;
+    - header columns with few distinct values are pandas Categoricals;
+    - the parameters of all rows are one flat array, those of row i being
+      param_values[param_offsets[i]:param_offsets[i + 1]]. An unmatched row
+      ("NoMatch") has its whole content as its only parameter;
+    - the raw Content is only kept if asked for (level 1 stores it).
+
+    to_dataframe gives back the DataFrame that PatternMatch.match returns
+    (with Content last among the headers when it is rebuilt).
+"""
+
+from itertools import chain
+import numpy as np
+import pandas as pd
+
+MAX_CATEGORY_RATIO = 0.5
+
+
+def compact_column(values):
+    """ A Categorical if values has at most MAX_CATEGORY_RATIO distinct values
+        per row, else an object array
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    if len(uniques) <= MAX_CATEGORY_RATIO * len(codes):
+        return pd.Categorical.from_codes(codes, uniques)
+    return np.asarray(values, dtype=object)
+
+
+def flatten_params(params, row_index=None):
+    """ (offsets, values) of a list of parameter tuples, optionally gathered
+        through row_index (the tuple of every row) without copying tuples
+    """
+    lengths = np.fromiter(map(len, params), dtype=np.int64, count=len(params))
+    values = np.empty(lengths.sum(), dtype=object)
+    values[:] = list(chain.from_iterable(params))
+    if row_index is None:
+        return np.concatenate([[0], np.cumsum(lengths)]), values
+    starts = np.concatenate([[0], np.cumsum(lengths)])[:-1]
+    row_lengths = lengths[row_index]
+    offsets = np.concatenate([[0], np.cumsum(row_lengths)])
+    gather = np.repeat(starts[row_index] - offsets[:-1], row_lengths) + np.arange(offsets[-1])
+    return offsets, values[gather]
+
+
+class StructuredLog(object):
+    def __init__(self, line_ids, headers, event_codes, templates, event_ids, param_offsets, param_values):
+        self.line_ids = line_ids # int64 array
+        self.headers = headers # {header: Categorical or object array}, in logformat order
+        self.event_codes = event_codes # int64 array of indices into templates and event_ids
+        self.templates = templates
+        self.event_ids = event_ids
+        self.param_offsets = param_offsets
+        self.param_values = param_values
+
+    def __len__(self):
+        return len(self.line_ids)
+
+    @classmethod
+    def from_match(cls, log_dataframe, match_dict, keep_content=False):
+        """ Build from a loaded chunk and {content: (template, parameters)};
+            event_ids are left to the caller, which gives EventIds in the order
+            of self.templates (the order of first appearance)
+        """
+        content_codes, contents = pd.factorize(log_dataframe["Content"].to_numpy(dtype=object))
+        results = [match_dict[content] for content in contents]
+        event_codes, templates = pd.factorize(np.array([result[0] for result in results], dtype=object))
+        params = [(content,) if result[0] == "NoMatch" else tuple(result[1])
+                  for content, result in zip(contents, results)]
+        param_offsets, param_values = flatten_params(params, content_codes)
+        skip = {"LineId", "Content"} if not keep_content else {"LineId"}
+        headers = {column: compact_column(log_dataframe[column]) for column in log_dataframe.columns
+                   if column not in skip}
+        return cls(log_dataframe["LineId"].to_numpy(dtype=np.int64), headers, event_codes[content_codes],
+                   np.asarray(templates, dtype=object), None, param_offsets, param_values)
+
+    @classmethod
+    def from_dataframe(cls, log_dataframe):
+        """ Build from the DataFrame of PatternMatch.match (structured=False)
+        """
+        log_dataframe = log_dataframe.fillna("")
+        event_codes, event_ids = pd.factorize(log_dataframe["EventId"].to_numpy(dtype=object))
+        first_rows = np.unique(event_codes, return_index=True)[1]
+        templates = log_dataframe["EventTemplate"].to_numpy(dtype=object)[first_rows]
+        nomatch = log_dataframe["EventTemplate"].to_numpy(dtype=object) == "NoMatch"
+        params = log_dataframe["ParameterList"].to_numpy(dtype=object).copy()
+        params[nomatch] = [(content,) for content in log_dataframe["Content"].to_numpy(dtype=object)[nomatch]]
+        param_offsets, param_values = flatten_params(params)
+        ignore_columns = {"LineId", "EventTemplate", "ParameterList", "EventId"}
+        headers = {column: compact_column(log_dataframe[column]) for column in log_dataframe.columns
+                   if column not in ignore_columns}
+        return cls(log_dataframe["LineId"].to_numpy(dtype=np.int64), headers, event_codes,
+                   templates, np.asarray(event_ids, dtype=object), param_offsets, param_values)
+
+    def column(self, header):
+        return np.asarray(self.headers[header], dtype=object)
+
+    def row_event_ids(self):
+        return self.event_ids[self.event_codes]
+
+    def event_counts(self):
+        """ {EventId: number of rows}, most frequent first (as value_counts)
+        """
+        counts = np.bincount(self.event_codes, minlength=len(self.event_ids))
+        order = np.argsort(-counts, kind="stable")
+        return {self.event_ids[code]: int(counts[code]) for code in order if counts[code]}
+
+    def n_nomatch(self):
+        codes = np.flatnonzero(self.templates == "NoMatch")
+        return int(np.isin(self.event_codes, codes).sum()) if len(codes) else 0
+
+    def params(self):
+        return [tuple(self.param_values[start:end])
+                for start, end in zip(self.param_offsets[:-1], self.param_offsets[1:])]
+
+    def contents(self):
+        """ Content of every row, rebuilt from its template and parameters
+            (as decompression does) if it was not kept
+        """
+        if "Content" in self.headers:
+            return self.column("Content")
+        parts = [["", ""] if template == "NoMatch" else template.split("<*>") for template in self.templates]
+        contents = []
+        for code, param in zip(self.event_codes, self.params()):
+            template_parts = parts[code]
+            pieces = [template_parts[0]]
+            for value, part in zip(param, template_parts[1:]):
+                pieces.append(value)
+                pieces.append(part)
+            contents.append("".join(pieces))
+        return np.array(contents, dtype=object)
+
+    def to_dataframe(self):
+        dataframe = pd.DataFrame({"LineId": self.line_ids})
+        for header, values in self.headers.items():
+            dataframe[header] = np.asarray(values, dtype=object)
+        if "Content" not in self.headers:
+            dataframe["Content"] = self.contents()
+        templates = self.templates[self.event_codes]
+        params = self.params()
+        nomatch = templates == "NoMatch"
+        dataframe["EventTemplate"] = templates
+        dataframe["ParameterList"] = [None if unmatched else param for param, unmatched in zip(params, nomatch)]
+        dataframe["EventId"] = self.row_event_ids()
+        return dataframe
@@ -0,0 +1,146 @@
+# Copyright 2018 The LogPAI Team (https://github.com/logpai).
+#
+# Licensed under the MIT License:
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# =============================================================================
+""" This file implements the iterative template mining used when no templates
+    file is given, after the iterative structure extraction of logzip [1]:
+    a sample of the log contents is clustered into templates, all contents
+    are matched against them with the match tree, and the next sample is
+    drawn from the contents that are still NoMatch, until (almost) every
+    content matches.
+
+    Clustering is a simplified Drain: contents are split on whitespace,
+    tokens holding a digit are masked as <*>, and contents with the same token
+    count and first token form a group. Within a group a content joins the
+    first cluster sharing at least `similarity` of its tokens, and the tokens
+    where a cluster's members differ become <*>. Groups are independent, so
+    they are clustered in n_workers processes.
+
+[1] Jinyang Liu, Jieming Zhu, Shilin He, Pinjia He, Zibin Zheng, Michael R. Lyu.
+    "Logzip: Extracting Hidden Structures via Iterative Clustering for Log
+    Compression", ASE 2019.
+"""
+
+import random
+import re
+import multiprocessing as mp
+from . import treematch
+from .metrics import RunMetrics
+
+whitespace_regex = re.compile(r"(\s+)")
+digit_regex = re.compile(r"\d")
+
+
+def tokenize(content):
+    """ Whitespace-separated tokens (digit tokens masked) and the separators
+    """
+    parts = whitespace_regex.split(content.strip())
+    tokens = ["<*>" if digit_regex.search(token) else token for token in parts[0::2]]
+    return tokens, parts[1::2]
+
+
+def cluster_group(contents, similarity=0.5):
+    """ Templates of contents that share their token count and first token
+    """
+    clusters = []
+    for content in contents:
+        tokens, separators = tokenize(content)
+        for cluster in clusters:
+            template = cluster[0]
+            n_same = sum(1 for a, b in zip(template, tokens) if a == b)
+            if n_same >= similarity * len(tokens):
+                cluster[0] = [a if a == b else "<*>" for a, b in zip(template, tokens)]
+                break
+        else:
+            clusters.append([tokens, separators])
+    templates = []
+    for tokens, separators in clusters:
+        template = tokens[0]
+        for separator, token in zip(separators, tokens[1:]):
+            template += separator + token
+        templates.append(template)
+    return templates
+
+
+def _cluster_worker(task):
+    groups, similarity = task
+    return [template for group in groups for template in cluster_group(group, similarity)]
+
+
+class TemplateMiner(object):
+    def __init__(self, n_workers=1, sample_size=10000, max_lines=200000, max_iterations=5,
+                 min_match_rate=0.99, similarity=0.5, seed=0, outdir='./result/', metrics=None):
+        self.n_workers = n_workers
+        self.sample_size = sample_size
+        self.max_lines = max_lines
+        self.max_iterations = max_iterations
+        self.min_match_rate = min_match_rate
+        self.similarity = similarity
+        self.seed = seed
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.matcher = treematch.PatternMatch(tmp_dir="", outdir=outdir, n_workers=n_workers, metrics=self.metrics)
+        self.templates = []
+
+    def mine(self, contents):
+        """ Mine templates from contents (at most max_lines distinct ones are
+            used). Returns the TemplateBundle of the mined templates, ready for
+            PatternMatch.match / match_chunks.
+        """
+        rng = random.Random(self.seed)
+        contents = [content for content in dict.fromkeys(contents) if content]
+        if len(contents) > self.max_lines:
+            contents = rng.sample(contents, self.max_lines)
+        self.templates = []
+        known = set()
+        remaining = contents
+        bundle = None
+        with self.metrics.stage("mine"):
+            for iteration in range(self.max_iterations):
+                if len(remaining) <= (1 - self.min_match_rate) * len(contents):
+                    break
+                sample = remaining if len(remaining) <= self.sample_size else rng.sample(remaining, self.sample_size)
+                new_templates = [template for template in self.cluster(sample) if template not in known]
+                if not new_templates:
+                    break
+                known.update(new_templates)
+                self.templates.extend(new_templates)
+                bundle = self.matcher.compile_templates(self.templates)
+                match_dict = self.matcher.match_event(bundle.compiled_tree, remaining)
+                remaining = [content for content in remaining if match_dict[content][0] == "NoMatch"]
+                self.metrics.log("Mining iteration {}: {} templates, {} of {} sampled contents unmatched".format(
+                                 iteration + 1, len(self.templates), len(remaining), len(contents)))
+        if bundle is None:
+            bundle = self.matcher.compile_templates(self.templates)
+        self.metrics.gauge("mined_templates", len(self.templates))
+        self.metrics.gauge("mined_match_rate", 1 - len(remaining) / float(max(len(contents), 1)))
+        return bundle
+
+    def cluster(self, contents):
+        groups = {}
+        for content in contents:
+            tokens = tokenize(content)[0]
+            groups.setdefault((len(tokens), tokens[0]), []).append(content)
+        groups = [groups[key] for key in sorted(groups)]
+        if self.n_workers == 1 or len(groups) < 2:
+            return _cluster_worker((groups, self.similarity))
+        n_batches = min(len(groups), self.n_workers * 4)
+        tasks = [(groups[idx::n_batches], self.similarity) for idx in range(n_batches)]
+        with mp.Pool(processes=self.n_workers) as pool:
+            return [template for templates in pool.map(_cluster_worker, tasks) for template in templates]
@@ -27,22 +27,31 @@ template matching. The algorithm is described in the following paper:
 """
 
 from . import logloader
+from . import matchcache
+from .structuredlog import StructuredLog
+from .metrics import RunMetrics
 from collections import defaultdict, Counter, OrderedDict
 import re
 import pandas as pd
 import os
 import sys
-sys.setrecursionlimit(1000000)
 from datetime import datetime
 import multiprocessing as mp
 import itertools
 import hashlib
 import string
 import numpy as np
+from bisect import bisect_left
+import pickle
+import struct
+
+BUNDLE_MAGIC = b"LOGZIPTB"
+BUNDLE_VERSION = 1
 
 
 class PatternMatch(object):
-    def __init__(self, tmp_dir, outdir='./result/', n_workers=1, optimized=False, logformat=None):
+    def __init__(self, tmp_dir, outdir='./result/', n_workers=1, optimized=False, logformat=None, compiled=True,
+                 cache_path=None, cache_size=1000000, metrics=None, structured=False, keep_content=True):
         self.outdir = outdir
         if not os.path.exists(outdir):
             os.makedirs(outdir) # Make the result directory
@@ -50,52 +59,191 @@ class PatternMatch(object):
         self.logformat = logformat
         self.n_workers = n_workers
         self.optimized = optimized
+        self.compiled = compiled
+        self.pool = None
+        self.cache_path = cache_path
+        self.cache_size = cache_size
+        self.cache = None
+        self.cache_stats = None
+        self.templates_hash = None
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.structured = structured
+        self.keep_content = keep_content
 
-    def match(self, templates, log_filepath=None, log_dataframe=None):
-        print('Processing log file: {}...'.format(log_filepath))
+    def match(self, templates, log_filepath=None, log_dataframe=None, id_map=None):
+        self.metrics.log('Processing log file: {}...'.format(log_filepath))
         start_time = datetime.now()
         
         if log_dataframe is None:
-            loader = logloader.LogLoader(self.logformat, self.tmp_dir)
+            loader = logloader.LogLoader(self.logformat, self.tmp_dir, metrics=self.metrics)
             log_dataframe = loader.load_to_dataframe(log_filepath)
         # log_dataframe = log_dataframe.head(1)
 
-        templates = self._read_templates(templates)
-
-        print('Building match tree...')
-        match_tree = self._build_match_tree(templates)
+        match_tree = self._prepare_match_tree(templates)
 
-        print('Matching event templates...')
-        if self.optimized:
-            match_dict = self.match_event(match_tree, log_dataframe['Content'].drop_duplicates().tolist())
-        else:
-            match_dict = self.match_event(match_tree, log_dataframe['Content'].tolist())
-
-        log_dataframe['EventTemplate'] = log_dataframe['Content'].map(lambda x: match_dict[x][0])
-        log_dataframe['ParameterList'] = log_dataframe['Content'].map(lambda x: match_dict[x][1])
-        self.id_map = {tmp:"E"+str(idx) for idx, tmp in enumerate(log_dataframe['EventTemplate'].unique(), 1)} 
-        log_dataframe['EventId'] = log_dataframe['EventTemplate'].map(lambda x: self.id_map[x])
+        self._reset_id_map(id_map)
+        log_dataframe = self._match_dataframe(match_tree, log_dataframe)
 #        self._dump_match_result(os.path.basename(log_filepath), log_dataframe)
-        match_rate = sum(log_dataframe['EventTemplate'] != 'NoMatch') / float(len(log_dataframe))
+        match_rate = 1 - self._n_nomatch(log_dataframe) / float(len(log_dataframe))
+        self._close_cache()
         
-        print('Matching done, matching rate: {:.1%} [Time taken: {!s}]'.format(match_rate, datetime.now() - start_time))
+        self.metrics.log('Matching done, matching rate: {:.1%} [Time taken: {!s}]'.format(match_rate, datetime.now() - start_time))
         return log_dataframe
 
+    def match_chunks(self, templates, log_chunks, id_map=None):
+        """ Generator version of match which consumes an iterable of dataframes 
+            (e.g., LogLoader.iter_dataframes) and yields each one matched. The 
+            match tree is built once and EventIds stay consistent across chunks.
+            The tree and the worker pool are set up on the calling thread, 
+            before the first chunk is asked for.
+        """
+        start_time = datetime.now()
+        match_tree = self._prepare_match_tree(templates)
+
+        self._reset_id_map(id_map)
+        if self.n_workers > 1:
+            self.pool = self._create_pool(match_tree)
+        return self._iter_matched(match_tree, log_chunks, start_time)
+
+    def _iter_matched(self, match_tree, log_chunks, start_time):
+        total_lines = 0
+        matched_lines = 0
+        try:
+            for log_dataframe in log_chunks:
+                if log_dataframe.empty:
+                    continue
+                log_dataframe = self._match_dataframe(match_tree, log_dataframe)
+                total_lines += len(log_dataframe)
+                matched_lines += len(log_dataframe) - self._n_nomatch(log_dataframe)
+                yield log_dataframe
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+            self._close_cache()
+        match_rate = matched_lines / float(max(total_lines, 1))
+        self.metrics.log('Matching done, matching rate: {:.1%} [Time taken: {!s}]'.format(match_rate, datetime.now() - start_time))
+
+    def _match_dataframe(self, match_tree, log_dataframe):
+        self.metrics.log('Matching event templates...')
+        with self.metrics.stage("match"):
+            if self.optimized:
+                match_dict = self.match_event(match_tree, log_dataframe['Content'].drop_duplicates().tolist())
+            else:
+                match_dict = self.match_event(match_tree, log_dataframe['Content'].tolist())
+
+            if self.structured:
+                result = StructuredLog.from_match(log_dataframe, match_dict, self.keep_content)
+                self._assign_event_ids(result.templates)
+                result.event_ids = np.array([self.id_map[tmp] for tmp in result.templates], dtype=object)
+            else:
+                log_dataframe['EventTemplate'] = log_dataframe['Content'].map(lambda x: match_dict[x][0])
+                log_dataframe['ParameterList'] = log_dataframe['Content'].map(lambda x: match_dict[x][1])
+                self._assign_event_ids(log_dataframe['EventTemplate'].unique())
+                log_dataframe['EventId'] = log_dataframe['EventTemplate'].map(lambda x: self.id_map[x])
+                result = log_dataframe
+        self._count_matches(result, len(match_dict))
+        return result
+
+    def _assign_event_ids(self, templates):
+        for tmp in templates:
+            if tmp not in self.id_map:
+                self.n_events += 1
+                self.id_map[tmp] = "E" + str(self.n_events)
+
+    def _n_nomatch(self, result):
+        if isinstance(result, StructuredLog):
+            return result.n_nomatch()
+        return int((result['EventTemplate'] == 'NoMatch').sum())
+
+    def _count_matches(self, log_dataframe, n_unique):
+        n_nomatch = self._n_nomatch(log_dataframe)
+        self.metrics.count("unique_contents", n_unique)
+        self.metrics.count("matched_lines", len(log_dataframe) - n_nomatch)
+        self.metrics.count("nomatch_lines", n_nomatch)
+        counters = self.metrics.counters
+        self.metrics.gauge("match_rate", counters["matched_lines"] / float(max(counters["matched_lines"] + counters["nomatch_lines"], 1)))
+        self.metrics.gauge("events", len(self.id_map))
+
+    def _reset_id_map(self, id_map=None):
+        """ EventIds are given in order of appearance, after those of id_map
+            ({template: EventId}, e.g. of an archive being appended to)
+        """
+        self.id_map = dict(id_map or {})
+        self.n_events = max([int(eid[1:]) for eid in self.id_map.values() if eid[1:].isdigit()] + [0])
+
 
     def match_event(self, match_tree, log_list):
-        if self.n_workers == 1:
+        cached_dict = {}
+        if self.cache is not None:
+            cached_dict = self.cache.get_many(log_list)
+            log_list = [log_content for log_content in log_list if log_content not in cached_dict]
+        if not log_list:
+            log_template_dict = {}
+        elif self.n_workers == 1:
             log_template_dict = tree_match(match_tree, log_list)
         else:
+            log_list = list(dict.fromkeys(log_list)) # dedup before shipping to workers
+            n_chunks = self.n_workers * 4
+            chunk_size = max(1, -(-len(log_list) // n_chunks))
+            log_chunks = [log_list[i:i + chunk_size] for i in range(0, len(log_list), chunk_size)]
             log_template_dict = {}
-            pool = mp.Pool(processes=self.n_workers)
-            chunk_size = len(log_list) / self.n_workers + 1
-            result_chunks = [pool.apply_async(tree_match, args=(match_tree, log_list[i:i + chunk_size]))\
-                             for i in range(0, len(log_list), chunk_size)]
-            pool.close()
-            pool.join()
-            map(lambda x: log_template_dict.update(x), [result.get() for result in result_chunks])
+            pool = self.pool if self.pool is not None else self._create_pool(match_tree)
+            for result in pool.imap_unordered(_tree_match_worker, log_chunks):
+                log_template_dict.update(result)
+            if pool is not self.pool:
+                pool.close()
+                pool.join()
+        if self.cache is not None:
+            self.cache.put_many(log_template_dict)
+            log_template_dict.update(cached_dict)
         return log_template_dict
 
+    def compile_templates(self, templates, bundle_path=None):
+        """ Build the match trees of a template set once. The returned 
+            TemplateBundle can be passed to match/match_chunks in place of the 
+            template list, and is saved to bundle_path if given.
+        """
+        self.metrics.log('Building match tree...')
+        with self.metrics.stage("build_match_tree"):
+            match_tree = self._build_match_tree(self._read_templates(templates))
+            bundle = TemplateBundle(list(templates), matchcache.template_set_hash(templates),
+                                    match_tree, CompiledMatchTree(match_tree))
+        self.metrics.gauge("templates", len(bundle.templates))
+        if bundle_path:
+            bundle.save(bundle_path)
+        return bundle
+
+    def _prepare_match_tree(self, templates):
+        if isinstance(templates, TemplateBundle):
+            bundle = templates
+        else:
+            bundle = self.compile_templates(templates)
+        self.templates_hash = bundle.templates_hash
+        self._open_cache(bundle.templates_hash)
+        return bundle.compiled_tree if self.compiled else bundle.match_tree
+
+    def _open_cache(self, templates_hash):
+        if self.cache_path:
+            self.cache = matchcache.MatchCache(self.cache_path, templates_hash, max_entries=self.cache_size)
+
+    def _close_cache(self):
+        if self.cache is not None:
+            self.cache_stats = self.cache.stats()
+            self.metrics.gauge("match_cache", self.cache_stats)
+            self.metrics.log('Match cache hit rate: {:.1%} ({} hits, {} misses, {} evicted)'.format(
+                  self.cache_stats["hit_rate"], self.cache_stats["hits"], 
+                  self.cache_stats["misses"], self.cache_stats["evictions"]))
+            self.cache.close()
+            self.cache = None
+
+    def _create_pool(self, match_tree):
+        """ The match tree is sent once to every worker by the pool initializer 
+            instead of being pickled with every task
+        """
+        return mp.Pool(processes=self.n_workers, initializer=_init_match_worker, initargs=(match_tree,))
+
     def _build_match_tree(self, templates):
         match_tree = {}
         match_tree["$NO_STAR$"] = {}
@@ -132,8 +280,8 @@ class PatternMatch(object):
         return templates_save
 
     def _dump_match_result(self, log_filename, log_dataframe):
-        print("Saving {}".format(os.path.join(self.outdir, log_filename + '_structured.csv')))
-        print("Saving {}".format(os.path.join(self.outdir, log_filename + '_templates.csv')))
+        self.metrics.log("Saving {}".format(os.path.join(self.outdir, log_filename + '_structured.csv')))
+        self.metrics.log("Saving {}".format(os.path.join(self.outdir, log_filename + '_templates.csv')))
         log_dataframe.to_csv(os.path.join(self.outdir, log_filename + '_structured.csv'), index=False)
         occ_dict = dict(log_dataframe['EventTemplate'].value_counts())
         template_df = pd.DataFrame()
@@ -150,9 +298,10 @@ class PatternMatch(object):
         return template
 
 
+splitter_regex = re.compile('(<\*>|[^A-Za-z])')
+
 def message_split(message):
-    splitter_regex = re.compile('(<\*>|[^A-Za-z])')
-    tokens = re.split(splitter_regex, message)
+    tokens = splitter_regex.split(message)
     tokens = list(filter(lambda x: x!='', tokens))
     tokens = [token for idx, token in enumerate(tokens) if token != '' and not (token == "<*>" and idx > 0 and tokens[idx-1]=="<*>")]
     # print(tokens)
@@ -160,21 +309,173 @@ def message_split(message):
 
 
 def tree_match(match_tree, log_list):
-    print("Worker {} start matching {} lines.".format(os.getpid(), len(log_list)))
+    if isinstance(match_tree, CompiledMatchTree):
+        no_star_dict = match_tree.no_star
+        match_func = match_tree.match_template
+    else:
+        # the recursive find_template goes one call deeper per token
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), 1000000))
+        no_star_dict = match_tree["$NO_STAR$"]
+        match_func = lambda log_tokens: match_template(match_tree, log_tokens)
     log_template_dict = {}
     for log_content in log_list:
         # if not "is false" in log_content: continue
         # Full match
-        if log_content in match_tree["$NO_STAR$"]:
+        if log_content in no_star_dict:
             log_template_dict[log_content] = (log_content, [])
             continue
 
         log_tokens = message_split(log_content)
-        template, parameter_str = match_template(match_tree, log_tokens)
+        template, parameter_str = match_func(log_tokens)
         log_template_dict[log_content] = (template if template else "NoMatch", parameter_str)
     # sys.exit()
     return log_template_dict
 
+class CompiledMatchTree(object):
+    """ Flat, index-based form of the nested dict built by 
+        PatternMatch._build_match_tree. Node i keeps its token transitions in 
+        children[i], its <*> transition in star[i] (-1 if none), the best 
+        template ending at it in leaf[i], and the tokens that may end a <*> 
+        leading into it in continue_keys[i]. match_template walks it with an 
+        explicit stack and token offsets, visiting candidates in the same order 
+        as find_template, so both return the same (template, parameters).
+    """
+    def __init__(self, match_tree):
+        self.no_star = match_tree["$NO_STAR$"]
+        self.children = []
+        self.star = []
+        self.leaf = []
+        self.continue_keys = []
+        root = {k: v for k, v in match_tree.items() if k != "$NO_STAR$"}
+        nodes = [root]
+        node_idx = 0
+        while node_idx < len(nodes):
+            move_tree = nodes[node_idx]
+            children = {}
+            leaf = None
+            for key, value in move_tree.items():
+                if isinstance(value, tuple):
+                    # keep the first of the best leaves, as the stable sort does
+                    if leaf is None or (-value[0], value[1]) < leaf[0]:
+                        leaf = ((-value[0], value[1]), key)
+                else:
+                    children[key] = len(nodes)
+                    nodes.append(value)
+            self.children.append(children)
+            self.star.append(children.get("<*>", -1))
+            self.leaf.append(leaf)
+            self.continue_keys.append(frozenset(children))
+            node_idx += 1
+        # best leaf reachable below each node, used to prune hopeless branches
+        self.bound = [leaf[0] if leaf else None for leaf in self.leaf]
+        for node in range(len(nodes) - 1, -1, -1):
+            for child in self.children[node].values():
+                child_bound = self.bound[child]
+                if child_bound is not None and (self.bound[node] is None or child_bound < self.bound[node]):
+                    self.bound[node] = child_bound
+
+    def match_template(self, log_tokens):
+        children, star, leaf, bound = self.children, self.star, self.leaf, self.bound
+        continue_keys = self.continue_keys
+        n_tokens = len(log_tokens)
+        token_positions = None
+        best = None
+        # stack items are (node, pos, parameters), where parameters is a linked 
+        # chain (start, end, previous) of token spans, so branches share prefixes
+        stack = [(0, 0, None)]
+        while stack:
+            node, pos, parameters = stack.pop()
+            node_bound = bound[node]
+            if node_bound is None or (best is not None and node_bound >= best[0]):
+                continue
+            if pos == n_tokens:
+                candidates = [(leaf[node], parameters)]
+                if star[node] != -1:
+                    candidates.append((leaf[star[node]], (pos, pos, parameters)))
+                for candidate, spans in candidates:
+                    if candidate is not None and (best is None or candidate[0] < best[0]):
+                        best = (candidate[0], candidate[1], spans)
+                continue
+            star_node = star[node]
+            if star_node != -1:
+                # pushed in reverse so that they are popped in find_template's order
+                stack.append((star_node, n_tokens, (pos, n_tokens, parameters)))
+                keys = continue_keys[star_node]
+                if len(keys) < n_tokens - pos:
+                    if token_positions is None:
+                        token_positions = defaultdict(list)
+                        for idx, token in enumerate(log_tokens):
+                            token_positions[token].append(idx)
+                    positions = []
+                    for key in keys:
+                        if key in token_positions:
+                            key_positions = token_positions[key]
+                            positions.extend(key_positions[bisect_left(key_positions, pos):])
+                    positions.sort(reverse=True)
+                else:
+                    positions = [idx for idx in range(n_tokens - 1, pos - 1, -1) if log_tokens[idx] in keys]
+                for idx in positions:
+                    stack.append((star_node, idx, (pos, idx, parameters)))
+            child = children[node].get(log_tokens[pos], -1)
+            if child != -1:
+                stack.append((child, pos + 1, parameters))
+        if best is None:
+            return None, None
+        parameter_list = []
+        spans = best[2]
+        while spans is not None:
+            parameter_list.append("".join(log_tokens[spans[0]:spans[1]]))
+            spans = spans[2]
+        return best[1], tuple(reversed(parameter_list))
+
+
+class TemplateBundle(object):
+    """ A template set compiled once by PatternMatch.compile_templates. Saved 
+        as BUNDLE_MAGIC, a 2-byte format version and a pickle payload, so only 
+        load bundles from trusted locations.
+    """
+    def __init__(self, templates, templates_hash, match_tree, compiled_tree):
+        self.templates = templates
+        self.templates_hash = templates_hash
+        self.match_tree = match_tree
+        self.compiled_tree = compiled_tree
+
+    def save(self, bundle_path):
+        payload = {"templates": self.templates, "templates_hash": self.templates_hash,
+                   "match_tree": self.match_tree, "compiled_tree": self.compiled_tree}
+        with open(bundle_path, "wb") as fw:
+            fw.write(BUNDLE_MAGIC + struct.pack(">H", BUNDLE_VERSION))
+            pickle.dump(payload, fw, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, bundle_path):
+        with open(bundle_path, "rb") as fr:
+            header = fr.read(len(BUNDLE_MAGIC) + 2)
+            if not header.startswith(BUNDLE_MAGIC):
+                raise RuntimeError(f"{bundle_path} is not a template bundle!")
+            version = struct.unpack(">H", header[len(BUNDLE_MAGIC):])[0]
+            if version != BUNDLE_VERSION:
+                raise RuntimeError(f"Template bundle version {version} is not supported, expect {BUNDLE_VERSION}!")
+            payload = pickle.load(fr)
+        return cls(payload["templates"], payload["templates_hash"], 
+                   payload["match_tree"], payload["compiled_tree"])
+
+    @staticmethod
+    def is_bundle(filepath):
+        with open(filepath, "rb") as fr:
+            return fr.read(len(BUNDLE_MAGIC)) == BUNDLE_MAGIC
+
+
+_worker_match_tree = None
+
+def _init_match_worker(match_tree):
+    global _worker_match_tree
+    _worker_match_tree = match_tree
+
+def _tree_match_worker(log_list):
+    return tree_match(_worker_match_tree, log_list)
+
+
 def match_template(match_tree, log_tokens):
     result = []
     find_template(match_tree, log_tokens, result, [])
@@ -194,6 +495,7 @@ def find_template(move_tree, log_tokens, result, parameter_list):
             for key, value in move_tree.items():
                 if isinstance(value, tuple):
                     result.append((key, value, tuple(parameter_list)))
+            parameter_list.pop()
         return
     token = log_tokens[0]
 
@@ -0,0 +1,80 @@
+import time
+import pytest
+from logzip import autotune, logzipper
+from logzip.autotune import ColumnTuner
+
+# 10 MB of raw bytes: ((kernel, level), compressed bytes, seconds)
+RAW_BYTES = 10e6
+CANDIDATES = [(("store", None), 10e6, 0.001), (("gz", 1), 4e6, 0.1), (("gz", 9), 3e6, 1.0),
+              (("lzma", 6), 2e6, 5.0)]
+
+
+def pick(candidates=CANDIDATES, tuning_seconds=0, **budget):
+    tuner = ColumnTuner(logzipper.compress_member, str, **budget)
+    return tuner._ColumnTuner__pick(candidates, RAW_BYTES, tuning_seconds)
+
+
+def test_pick_smallest():
+    assert pick() == ("lzma", 6)
+
+
+@pytest.mark.parametrize("min_mb_s, kernel", [(5, ("gz", 9)), (20, ("gz", 1)), (1000, ("store", None))])
+def test_pick_min_mb_s(min_mb_s, kernel):
+    # the smallest output among the fast enough kernels, else the fastest
+    assert pick(min_mb_s=min_mb_s) == kernel
+
+
+def test_pick_counts_tuning_seconds():
+    # gz 1 compresses at 100 MB/s, but not at 20 MB/s once the 0.5 s of tuning are counted
+    assert pick(min_mb_s=20, tuning_seconds=0.5) == ("store", None)
+
+
+@pytest.mark.parametrize("min_ratio, kernel", [(2, ("gz", 1)), (3, ("gz", 9)), (10, ("lzma", 6))])
+def test_pick_min_ratio(min_ratio, kernel):
+    # the fastest kernel reaching the ratio, else the smallest output
+    assert pick(min_ratio=min_ratio) == kernel
+
+
+def test_pick_tie_prefers_faster():
+    near = [(("gz", 9), 3e6, 1.0), (("bz2", 9), 3e6 * (1 - autotune.TIE_RATIO / 2), 2.0)]
+    assert pick(near) == ("gz", 9)
+    smaller = [(("gz", 9), 3e6, 1.0), (("bz2", 9), 3e6 * (1 - 2 * autotune.TIE_RATIO), 2.0)]
+    assert pick(smaller) == ("bz2", 9)
+
+
+def test_small_member_default_kernel():
+    def compress(task):
+        raise AssertionError("small members are not sampled")
+
+    tuner = ColumnTuner(compress, str, default_kernel=("bz2", 9))
+    assert tuner.choose_kernel("b0/Date_0.csv", b"2018-01-01\n" * 100) == ("bz2", 9)
+    assert tuner.reset() == {"Date_0.csv": ["bz2", 9]}
+
+
+def test_budget_stops_sampling():
+    # under min_mb_s, the kernels after the first too slow one are not sampled
+    sampled = []
+
+    def compress(task):
+        sampled.append(task[2:])
+        if task[2:] == ("gz", 9):
+            time.sleep(0.05)
+        return logzipper.compress_member(task)
+
+    content = bytes(range(256)) * 1024
+    tuner = ColumnTuner(compress, str, min_mb_s=1)
+    assert tuner.choose_kernel("Content_0.csv", content) == ("gz", 1)
+    assert sampled == [("store", None), ("gz", 1), ("gz", 9)]
+
+
+def test_large_member_sampled():
+    sizes = []
+
+    def compress(task):
+        sizes.append(len(task[1]))
+        return logzipper.compress_member(task)
+
+    tuner = ColumnTuner(compress, str, sample_bytes=1 << 20)
+    content = bytes(range(256)) * 1024
+    tuner.choose_kernel("Content_0.csv", content)
+    assert max(sizes) <= len(content) // autotune.SAMPLE_FRACTION
@@ -0,0 +1,79 @@
+import random
+import numpy as np
+import pytest
+from logzip import columncodec
+from logzip.columncodec import decode_column, encode_column
+
+
+def roundtrip(values):
+    encoded = encode_column(values)
+    assert encoded is not None
+    assert list(decode_column(encoded[1])) == values
+    return encoded[0]
+
+
+def test_varints():
+    values = [0, 1, 127, 128, 16383, 16384, 2**63, 2**64 - 1]
+    encoded = columncodec.encode_varints(np.array(values, dtype=np.uint64))
+    assert encoded == b"".join(columncodec.encode_varint(value) for value in values)
+    assert list(columncodec.decode_varints(encoded)) == values
+    assert columncodec.decode_varint(encoded, 0) == (0, 1)
+
+
+def test_zigzag():
+    values = np.array([0, -1, 1, -2, 2**63 - 1, -2**63], dtype=np.int64)
+    encoded = columncodec.zigzag_encode(values)
+    assert list(encoded[:4]) == [0, 1, 2, 3]
+    assert list(columncodec.zigzag_decode(encoded)) == list(values)
+
+
+def test_delta():
+    # a counter: small successive differences
+    assert roundtrip([str(1000000 + 3 * idx) for idx in range(1000)]) == "delta"
+
+
+def test_for():
+    # values in a narrow range, in random order
+    rng = random.Random(0)
+    assert roundtrip([str(rng.randrange(10**12, 10**12 + 200)) for _ in range(1000)]) == "for"
+
+
+@pytest.mark.parametrize("values", [
+    ["-5", "0", "17", "-999999999999999999", "999999999999999999"] * 20,  # the widest decimals, negatives
+    ["00017", "03616", "99999", "00000"] * 20,                               # fixed width, leading zeros
+    ["0a5d2f34", "ffffffff", "00000000"] * 20,                               # lower-case hex
+    ["0A5D2F34", "FFFFFFFF", "00000000"] * 20,                               # upper-case hex
+    ["fffffffffffffff", "000000000000000"] * 20,                             # the widest hex
+    ["12", "", "15", "", ""] * 20,                                           # empty rows
+])
+def test_edges(values):
+    roundtrip(values)
+
+
+@pytest.mark.parametrize("values", [
+    [""] * 10,                     # no value
+    ["12", "abc"] * 10,            # not numbers
+    ["017", "5"] * 10,             # leading zeros of varying width
+    ["0a", "b"] * 10,              # hex of varying width
+    ["1234567890123456789"] * 10,  # beyond 18 digits
+    ["1.5", "2"] * 10,
+    ["1 ", "2"] * 10,
+    ["1\n2", "3"] * 10,            # a newline inside a value
+    ["7"],                         # not smaller than the text
+])
+def test_not_encoded(values):
+    assert encode_column(values) is None
+
+
+def test_frames():
+    chunks = [[str(idx) for idx in range(start, start + 300)] for start in range(0, 900, 300)]
+    chunks.append(["", "0a"] * 50)
+    payload = bytes([columncodec.CODEC_FRAMES])
+    payload += b"".join(columncodec.dump_frame(encode_column(chunk)[1]) for chunk in chunks)
+    assert list(decode_column(payload)) == [value for chunk in chunks for value in chunk]
+    assert len(decode_column(bytes([columncodec.CODEC_FRAMES]))) == 0
+
+
+def test_length_prefixed():
+    values = ["", "blk_1", "é", "a\nb"]
+    assert columncodec.load_length_prefixed(columncodec.dump_length_prefixed(values)) == values
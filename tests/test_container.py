@@ -0,0 +1,102 @@
+import os
+import struct
+import pytest
+from logzip import container
+from logzip.container import ContainerWriter, ContainerReader, MAGIC
+
+
+def read_members(path):
+    with ContainerReader(path) as reader:
+        return {name: bytes(reader.read(name)) for name in reader.names()}
+
+
+def test_members(tmp_path):
+    path = str(tmp_path / "a.lzc")
+    members = {"meta.json.gz": b"{}", "b0/Date_0.csv.raw": b"", "b0/é.bin.xz": os.urandom(1000)}
+    with ContainerWriter(path) as writer:
+        for name, content in members.items():
+            writer.add(name, content)
+    assert read_members(path) == members
+    with ContainerReader(path) as reader:
+        assert reader.names() == list(members)
+    assert ContainerReader.is_container(path)
+
+
+def test_layout(tmp_path):
+    path = str(tmp_path / "a.lzc")
+    with ContainerWriter(path) as writer:
+        writer.add("x", b"abc")
+    with open(path, "rb") as fr:
+        data = fr.read()
+    assert data[:len(MAGIC)] == MAGIC and data[-len(MAGIC):] == MAGIC
+    index_offset, previous_end = struct.unpack(">QQ", data[-container.FOOTER_SIZE:-len(MAGIC)])
+    assert (index_offset, previous_end) == (len(MAGIC) + 3, 0)
+    # no member replaced, one added: "x" at offset 8, 3 bytes
+    assert data[index_offset:-container.FOOTER_SIZE] == bytes([0, 1, 1]) + b"x" + bytes([8, 3])
+
+
+def test_append_and_replace(tmp_path):
+    path = str(tmp_path / "a.lzc")
+    with ContainerWriter(path) as writer:
+        writer.add("b0/x", b"block 0")
+        writer.add("meta.json.gz", b"meta 0")
+    with ContainerWriter(path, append=True, replace=["meta.json.gz", "meta.json.xz"]) as writer:
+        writer.add("b1/x", b"block 1")
+        writer.commit()
+        writer.add("meta.json.xz", b"meta 1")
+    assert read_members(path) == {"b0/x": b"block 0", "b1/x": b"block 1", "meta.json.xz": b"meta 1"}
+    with ContainerWriter(path, append=True) as writer:
+        # adding a name again replaces it
+        writer.add("meta.json.xz", b"meta 2")
+    assert read_members(path) == {"b0/x": b"block 0", "b1/x": b"block 1", "meta.json.xz": b"meta 2"}
+
+
+def test_add_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(container, "READ_SIZE", 7)
+    path = str(tmp_path / "a.lzc")
+    content = os.urandom(100)
+    (tmp_path / "column").write_bytes(content)
+    with ContainerWriter(path) as writer:
+        writer.add("a", b"before")
+        writer.add_file("column.raw", str(tmp_path / "column"))
+        writer.add("b", b"after")
+    assert read_members(path) == {"a": b"before", "column.raw": content, "b": b"after"}
+
+
+def test_torn_tail(tmp_path):
+    path = str(tmp_path / "a.lzc")
+    with ContainerWriter(path) as writer:
+        writer.add("a", b"kept")
+    size = os.path.getsize(path)
+    with open(path, "ab") as fw:
+        fw.write(b"half a member" + MAGIC + b"and a footer that is not one" + MAGIC)
+    assert read_members(path) == {"a": b"kept"}
+    with ContainerWriter(path, append=True) as writer:
+        assert writer.offset == size
+        writer.add("b", b"new")
+    assert read_members(path) == {"a": b"kept", "b": b"new"}
+
+
+def test_not_a_container(tmp_path):
+    path = tmp_path / "a.lzc"
+    path.write_bytes(b"x" * 100)
+    assert not ContainerReader.is_container(str(path))
+    with pytest.raises(RuntimeError):
+        ContainerReader(str(path))
+    path.write_bytes(MAGIC + b"members without a footer")
+    with pytest.raises(RuntimeError):
+        ContainerReader(str(path))
+
+
+def test_compaction(tmp_path):
+    path = str(tmp_path / "a.lzc")
+    with ContainerWriter(path) as writer:
+        writer.add("block", b"b" * 100)
+    for idx in range(20):
+        with ContainerWriter(path, append=True) as writer:
+            writer.add("meta", bytes([idx]) * 100)
+        # dead space never outgrows the rest of the container
+        live = len(MAGIC) + 200
+        assert os.path.getsize(path) < 3 * live + 20 * container.FOOTER_SIZE
+    assert read_members(path) == {"block": b"b" * 100, "meta": bytes([19]) * 100}
+    assert not os.path.exists(path + ".tmp")
@@ -0,0 +1,60 @@
+import json
+import os
+import pytest
+from logzip.logbatch import ZipBatch, collect_files
+from logzip.logunzipper import Unziplog
+from logzip.metrics import RunMetrics
+from test_roundtrip import LOGFORMAT, write_log
+
+
+def write_tree(tmp_path):
+    """ {relpath: lines} of three logs under tmp_path/logs, one of them nested
+    """
+    log_path, templates_path, _ = write_log(tmp_path)
+    logs = {}
+    for seed, relpath in enumerate(["a.log", "b.log", os.path.join("node2", "c.log")]):
+        _, _, lines = write_log(tmp_path, n_lines=500 * (seed + 1), seed=seed)
+        filepath = tmp_path / "logs" / relpath
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(log_path, str(filepath))
+        logs[relpath] = lines
+    (tmp_path / "logs" / "notes.txt").write_text("not a log\n")
+    return logs, templates_path
+
+
+def test_collect_files(tmp_path):
+    logs, _ = write_tree(tmp_path)
+    root = str(tmp_path / "logs")
+    assert [relpath for _, relpath in collect_files([root], "*.log")] == sorted(logs)
+    # relpaths are relative to the deepest directory holding all the files
+    assert collect_files([os.path.join(root, "node2", "*.log")]) \
+           == [(os.path.join(root, "node2", "c.log"), "c.log")]
+    assert [relpath for _, relpath in collect_files([root], "*.log", exclude_dir=os.path.join(root, "node2"))] \
+           == ["a.log", "b.log"]
+    assert collect_files([os.path.join(root, "*.gz")]) == []
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+@pytest.mark.parametrize("mined", [False, True], ids=["templates", "mined"])
+def test_zip_files(tmp_path, n_workers, mined):
+    logs, templates_path = write_tree(tmp_path)
+    outdir = tmp_path / "out"
+    batch = ZipBatch(LOGFORMAT, str(outdir), n_workers=n_workers, metrics=RunMetrics(quiet=True),
+                     column_kernel=True)
+    report = batch.zip_files([str(tmp_path / "logs")], None if mined else templates_path, pattern="*.log")
+    assert report["counters"]["files"] == 3 and "failed_files" not in report["counters"]
+    for relpath, lines in logs.items():
+        archive_path = str(outdir / (relpath + ".logzip.lzc"))
+        assert Unziplog(archive_path).read_lines() == lines
+    with open(str(outdir / "batch.report.json")) as fr:
+        assert sorted(result["file"] for result in json.load(fr)["results"]) \
+               == sorted(str(tmp_path / "logs" / relpath) for relpath in logs)
+
+
+def test_failed_job(tmp_path):
+    # a job that fails is reported and does not stop the others
+    logs, templates_path = write_tree(tmp_path)
+    batch = ZipBatch(LOGFORMAT, str(tmp_path / "out"), metrics=RunMetrics(quiet=True), level=4)
+    report = batch.zip_files([str(tmp_path / "logs")], templates_path, pattern="*.log")
+    assert report["counters"]["failed_files"] == 3
+    assert all("illegal" in result["error"] for result in batch.results)
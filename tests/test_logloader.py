@@ -0,0 +1,46 @@
+import pytest
+from logzip.logloader import LogLoader, HeaderSplitter
+
+FORMATS = {
+    "<Date> <Time> <Pid> <Level> <Component>: <Content>": [
+        "081109 203615 148 INFO dfs.DataNode$PacketResponder: PacketResponder 1 for block blk_38865049064139660 terminating",
+        "081109  203615   148 INFO dfs.DataNode: a: b: c",
+        "081109 203615 148 INFO dfs.DataNode:",
+        "081109 203615 148 INFO dfs.DataNode:x",
+        "081109 203615 148 INFO",
+        "081109\t203615\t148 INFO dfs.DataNode: tab separated",
+    ],
+    "<Label> <Timestamp> <Date> <Node> <Time> <NodeRepeat> <Type> <Component> <Level> <Content>": [
+        "- 1117838570 2005.06.03 R02-M1-N0-C:J12-U11 2005-06-03-15.42.50.675872 R02-M1-N0-C:J12-U11 RAS KERNEL INFO instruction cache parity error corrected",
+        "KERNDTLB 1118536327 2005.06.11 R30-M0-N9-C:J16-U01 2005-06-11-17.32.07.581048 R30-M0-N9-C:J16-U01 RAS KERNEL FATAL",
+        "- 1117838570 2005.06.03",
+    ],
+    "<Date> <Time> <Level> <Component>: <Content>": [
+        "17/06/09 20:10:40 INFO executor.CoarseGrainedExecutorBackend: Registered signal handlers for [TERM, HUP, INT]",
+        "17/06/09 20:10:40 INFO storage.MemoryStore:Block broadcast_0 stored",
+        "17/06/09 20:10:40 INFO",
+    ],
+    "[<Time>] <Level> - <Content>": [
+        "[2018-01-01 10:00:00] INFO - started",
+        "[2018-01-01] WARN -",
+    ],
+    "<Time> <Level> <Component> -- <Content>": [
+        "10:00:00 INFO server -- started -- twice",
+        "10:00:00 INFO server   --   padded",
+        "10:00:00 INFO server--started",
+        "10:00:00 INFO server - started",
+    ],
+    "<Date>,<Time> <Level>: <Content>": [
+        "2018-01-01,10:00:00 INFO: a,b: c",
+        "2018-01-01 10:00:00 INFO: missing comma",
+    ],
+}
+
+
+@pytest.mark.parametrize("logformat", sorted(FORMATS))
+def test_splitter_matches_regex(logformat):
+    loader = LogLoader(logformat, None)
+    splitter = HeaderSplitter(logformat, loader.headers, loader.regex)
+    for line in FORMATS[logformat]:
+        match = loader.regex.search(line.strip())
+        assert splitter.split(line.strip()) == (list(match.groups()) if match else None), line
@@ -0,0 +1,76 @@
+import pytest
+from logzip.logquery import LogQuery
+from logzip.treematch import PatternMatch
+from logzip.metrics import RunMetrics
+from test_roundtrip import LOGFORMAT, TEMPLATES, write_log, zip_file
+
+
+@pytest.fixture(params=[(2, {}), (3, {}), (3, {"column_kernel": True}), (3, {"block_lines": 700})],
+                ids=["level2", "level3", "level3 lzc", "level3 blocks"], scope="module")
+def archive(request, tmp_path_factory):
+    level, kwargs = request.param
+    tmp_path = tmp_path_factory.mktemp("logquery")
+    log_path, templates_path, lines = write_log(tmp_path)
+    archive_path = zip_file(tmp_path, log_path, templates_path, level=level, **kwargs)
+    matcher = PatternMatch(tmp_dir="", outdir=str(tmp_path), logformat=LOGFORMAT, metrics=RunMetrics(quiet=True))
+    matched = matcher.match(TEMPLATES, log_path)
+    # archives keep the unmatched lines as the event "<*>"
+    matched.loc[matched["EventTemplate"] == "NoMatch", "EventTemplate"] = "<*>"
+    query = LogQuery(archive_path)
+    yield query, matched, lines
+    query.close()
+
+
+def scan(matched, lines, template=None, params=None, start_time=None, end_time=None):
+    """ The (0-based line number, line) of the matched rows, checked one by one
+    """
+    results = []
+    for row in matched.itertuples():
+        if template is not None and row.EventTemplate != template:
+            continue
+        if params and any(row.ParameterList[idx] != value for idx, value in params.items()):
+            continue
+        stamp = "{} {}".format(row.Date, row.Time)
+        if (start_time is not None and stamp < start_time) or (end_time is not None and stamp > end_time):
+            continue
+        results.append((row.LineId - 1, lines[row.LineId - 1]))
+    return results
+
+
+def event_ids(query):
+    return {template: eid for eid, template in query.unzipper.template_mapping.items()}
+
+
+def test_events(archive):
+    query, matched, lines = archive
+    counts = matched["EventTemplate"].value_counts()
+    assert {template: count for template, count in query.events().values()} == counts.to_dict()
+
+
+def test_event(archive):
+    query, matched, lines = archive
+    for template, eid in event_ids(query).items():
+        assert query.search(event_id=eid) == scan(matched, lines, template)
+
+
+def test_params(archive):
+    query, matched, lines = archive
+    ids = event_ids(query)
+    for template in TEMPLATES:
+        parameters = matched.loc[matched["EventTemplate"] == template, "ParameterList"]
+        for para_idx in range(template.count("<*>")):
+            for value in parameters.str[para_idx].iloc[:3]:
+                assert query.search(event_id=ids[template], params={para_idx: value}) \
+                       == scan(matched, lines, template, {para_idx: value})
+        assert query.search(event_id=ids[template], params={0: "never seen"}) == []
+
+
+def test_time_range(archive):
+    query, matched, lines = archive
+    ids = event_ids(query)
+    assert query.search(start_time="081109 000500", end_time="081109 001500") \
+           == scan(matched, lines, start_time="081109 000500", end_time="081109 001500")
+    template = TEMPLATES[0]
+    expected = scan(matched, lines, template, start_time="081109 001000")
+    assert query.search(event_id=ids[template], start_time="081109 001000") == expected
+    assert query.search(event_id=ids[template], start_time="081109 001000", limit=5) == expected[:5]
@@ -0,0 +1,65 @@
+import sqlite3
+from logzip.matchcache import MatchCache, template_set_hash
+
+TEMPLATES_HASH = template_set_hash(["Verification succeeded for <*>"])
+
+
+def match(idx):
+    return "Verification succeeded for blk_{}".format(idx), ("Verification succeeded for <*>", ("blk_{}".format(idx),))
+
+
+def n_rows(cache_path):
+    with sqlite3.connect(cache_path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM match_cache").fetchone()[0]
+
+
+def test_hits(tmp_path):
+    cache_path = str(tmp_path / "cache.db")
+    cache = MatchCache(cache_path, TEMPLATES_HASH)
+    cache.put_many(dict(match(idx) for idx in range(10)))
+    cache.close()
+
+    cache = MatchCache(cache_path, TEMPLATES_HASH)
+    contents = [match(idx)[0] for idx in range(5, 15)]
+    assert cache.get_many(contents) == dict(match(idx) for idx in range(5, 10))
+    assert cache.stats() == {"hits": 5, "misses": 5, "evictions": 0, "hit_rate": 0.5}
+    # another template set does not see the entries
+    assert MatchCache(cache_path, template_set_hash(["<*>"])).get_many(contents) == {}
+
+
+def test_lru_eviction(tmp_path):
+    cache_path = str(tmp_path / "cache.db")
+    cache = MatchCache(cache_path, TEMPLATES_HASH, max_entries=10)
+    cache.put_many(dict(match(idx) for idx in range(10)))
+    # 0-4 are used again, so 5-9 are the least recently used
+    cache.get_many([match(idx)[0] for idx in range(5)])
+    cache.put_many(dict(match(idx) for idx in range(10, 15)))
+    assert cache.evictions == 5
+    assert n_rows(cache_path) == 10
+    found = cache.get_many([match(idx)[0] for idx in range(15)])
+    assert sorted(found) == sorted(match(idx)[0] for idx in list(range(5)) + list(range(10, 15)))
+
+
+def test_size_shared(tmp_path):
+    # entries put again or by another connection are counted once
+    cache_path = str(tmp_path / "cache.db")
+    first = MatchCache(cache_path, TEMPLATES_HASH, max_entries=8)
+    second = MatchCache(cache_path, TEMPLATES_HASH, max_entries=8)
+    first.put_many(dict(match(idx) for idx in range(5)))
+    second.put_many(dict(match(idx) for idx in range(5)))
+    assert first.evictions == second.evictions == 0
+    second.put_many(dict(match(idx) for idx in range(5, 10)))
+    assert second.evictions == 2
+    assert n_rows(cache_path) == 8
+
+
+def test_size_of_older_cache(tmp_path):
+    # a cache without the match_cache_size table is counted when opened
+    cache_path = str(tmp_path / "cache.db")
+    MatchCache(cache_path, TEMPLATES_HASH).put_many(dict(match(idx) for idx in range(6)))
+    with sqlite3.connect(cache_path) as conn:
+        conn.execute("DROP TABLE match_cache_size")
+    cache = MatchCache(cache_path, TEMPLATES_HASH, max_entries=6)
+    cache.put_many(dict([match(6)]))
+    assert cache.evictions == 1
+    assert n_rows(cache_path) == 6
@@ -0,0 +1,48 @@
+import threading
+import pytest
+from logzip import pipeline
+from logzip.logzipper import Ziplog
+from logzip.logunzipper import Unziplog
+from logzip.metrics import RunMetrics
+from test_roundtrip import LOGFORMAT, write_log
+
+
+def test_prefetch():
+    assert list(pipeline.prefetch(range(10), depth=2)) == list(range(10))
+    # the producer thread is joined once the iteration ends
+    assert threading.active_count() == 1
+
+
+def test_prefetch_error():
+    def items():
+        yield 1
+        raise ValueError("bad chunk")
+
+    with pytest.raises(ValueError):
+        list(pipeline.prefetch(items()))
+
+
+def test_stage_error():
+    def consume(item):
+        raise ValueError("bad block")
+
+    stage = pipeline.Stage(consume)
+    stage.put(1)
+    with pytest.raises(ValueError):
+        stage.close()
+
+
+@pytest.mark.parametrize("kwargs, chunk_lines", [({}, 500), ({"block_lines": 500}, None)], ids=["chunks", "blocks"])
+def test_pipelined_roundtrip(tmp_path, kwargs, chunk_lines):
+    log_path, templates_path, lines = write_log(tmp_path)
+    zipper = Ziplog(logformat=LOGFORMAT, outdir=str(tmp_path / "out"), outname="HDFS", n_workers=2,
+                    pipeline_depth=2, tmp_dir=str(tmp_path / "tmp"), metrics=RunMetrics(quiet=True),
+                    run_report=False, **kwargs)
+    zipper.zip_file(log_path, templates_path, chunk_lines=chunk_lines)
+    assert Unziplog(zipper.archive_path()).read_lines() == lines
+
+
+def test_single_worker_not_pipelined(tmp_path):
+    # the stages would only share the GIL
+    zipper = Ziplog(logformat=LOGFORMAT, outdir=str(tmp_path), outname="HDFS", pipeline_depth=2)
+    assert zipper.pipeline_depth == 0
@@ -0,0 +1,177 @@
+import multiprocessing as mp
+import os
+import random
+import pytest
+from logzip import container, logzipper
+from logzip.logzipper import Ziplog
+from logzip.logunzipper import Unziplog
+from logzip.treematch import PatternMatch
+from logzip.metrics import RunMetrics
+
+LOGFORMAT = "<Date> <Time> <Pid> <Level> <Component>: <Content>"
+TEMPLATES = [
+    "Receiving block <*> src: <*> dest: <*>",
+    "Received block <*> of size <*> from <*>",
+    "PacketResponder <*> for block <*> terminating",
+    "BLOCK* NameSystem.allocateBlock: <*> <*>",
+    "Verification succeeded for <*>",
+    "<*> Served block <*> to <*>",
+]
+
+
+def write_log(tmp_path, n_lines=3000, seed=0):
+    rng = random.Random(seed)
+    lines = ["not a log line"]
+    for idx in range(n_lines):
+        message = rng.choice(TEMPLATES + ["Unmatched message {}".format(idx % 7)])
+        while "<*>" in message:
+            parameters = ["blk_{}".format(rng.randint(-2**63, 2**63)), str(rng.randrange(10**6)),
+                          "/10.250.{}.{}:50010".format(rng.randrange(256), rng.randrange(256))]
+            # the space after the Component header is not kept, so only empty parameters inside the content
+            if not message.startswith("<*>"):
+                parameters.append("")
+            message = message.replace("<*>", rng.choice(parameters), 1)
+        lines.append("081109 {:06d} {} {} dfs.DataNode: {}".format(idx, rng.randrange(1, 30000),
+                                                                   rng.choice(["INFO", "WARN"]), message).strip())
+        if idx == n_lines // 2:
+            lines.append("081109 trailing junk")
+    log_path = tmp_path / "HDFS.log"
+    log_path.write_text("\n".join(lines) + "\n")
+    templates_path = tmp_path / "HDFS_templates.txt"
+    templates_path.write_text("\n".join(TEMPLATES) + "\n")
+    return str(log_path), str(templates_path), lines
+
+
+def zip_file(tmp_path, log_path, templates_path, **kwargs):
+    zipper = Ziplog(logformat=LOGFORMAT, outdir=str(tmp_path / "out"), outname="HDFS",
+                    metrics=RunMetrics(quiet=True), run_report=False, **kwargs)
+    zipper.zip_file(log_path, templates_path)
+    return zipper.archive_path()
+
+
+@pytest.mark.parametrize("level", [1, 2, 3])
+@pytest.mark.parametrize("kwargs", [{}, {"column_kernel": True}, {"block_lines": 1000}],
+                         ids=["tar", "lzc", "blocks"])
+def test_roundtrip(tmp_path, level, kwargs):
+    log_path, templates_path, lines = write_log(tmp_path)
+    archive_path = zip_file(tmp_path, log_path, templates_path, level=level, **kwargs)
+    assert Unziplog(archive_path).read_lines() == lines
+
+
+@pytest.mark.parametrize("level", [1, 3])
+@pytest.mark.parametrize("kwargs", [{"column_kernel": True}, {"block_lines": 700}], ids=["lzc", "blocks"])
+def test_line_ranges(tmp_path, level, kwargs):
+    log_path, templates_path, lines = write_log(tmp_path)
+    archive_path = zip_file(tmp_path, log_path, templates_path, level=level, **kwargs)
+    unzipper = Unziplog(archive_path, n_workers=2)
+    for start, end in [(0, 1), (1499, 1502), (2990, None), (10, 10), (2000, 10**6)]:
+        assert unzipper.read_lines(start, end) == lines[start:end]
+    unzipper.unzip_file(str(tmp_path / "restored.log"))
+    assert (tmp_path / "restored.log").read_text().split("\n")[:-1] == lines
+
+
+@pytest.mark.parametrize("level", [1, 2, 3])
+def test_normalized_lines(tmp_path, level):
+    # lines come back stripped, with the separators of the logformat between 
+    # headers and non-ASCII runs as <NASCII>; whitespace inside the content, 
+    # empty lines and lines that do not match the logformat are kept
+    original = ["081109 000001 1 INFO dfs.DataNode: Verification succeeded for  blk_1",
+                "  081109 000002 1 INFO dfs.DataNode: leading and trailing spaces  ",
+                "081109  000003\t1 INFO dfs.DataNode:  whitespace between headers",
+                "081109 000004 1 INFO dfs.DataNode:no space after the colon",
+                "",
+                "081109 000006 1 INFO dfs.DataNode: tab\tinside the content",
+                "081109 000007 1 INFO dfs.DataNode: caf\u00e9",
+                "  not a log line  "]
+    restored = ["081109 000001 1 INFO dfs.DataNode: Verification succeeded for  blk_1",
+                "081109 000002 1 INFO dfs.DataNode: leading and trailing spaces",
+                "081109 000003 1 INFO dfs.DataNode: whitespace between headers",
+                "081109 000004 1 INFO dfs.DataNode:no space after the colon",
+                "",
+                "081109 000006 1 INFO dfs.DataNode: tab\tinside the content",
+                "081109 000007 1 INFO dfs.DataNode: caf<NASCII>",
+                "not a log line"]
+    log_path = tmp_path / "HDFS.log"
+    log_path.write_text("\n".join(original) + "\n", encoding="utf-8")
+    templates_path = tmp_path / "HDFS_templates.txt"
+    templates_path.write_text("\n".join(TEMPLATES) + "\n")
+    archive_path = zip_file(tmp_path, str(log_path), str(templates_path), level=level)
+    assert Unziplog(archive_path).read_lines() == restored
+
+
+def append_file(tmp_path, log_path, templates_path):
+    zipper = Ziplog(logformat=LOGFORMAT, outdir=str(tmp_path / "out"), outname="HDFS", level=3, block_lines=1000,
+                    metrics=RunMetrics(quiet=True), run_report=False)
+    zipper.zip_file(log_path, templates_path, append=True)
+    return zipper.archive_path()
+
+
+def test_append_blocks(tmp_path):
+    log_path, templates_path, lines = write_log(tmp_path)
+    archive_path = zip_file(tmp_path, log_path, templates_path, level=3, block_lines=1000)
+    (tmp_path / "more").mkdir()
+    more_path, _, more_lines = write_log(tmp_path / "more", n_lines=1500, seed=1)
+    for _ in range(3):
+        append_file(tmp_path, more_path, templates_path)
+        lines = lines + more_lines
+        assert Unziplog(archive_path).read_lines() == lines
+
+
+def interrupted_append(tmp_path, log_path, templates_path, n_members):
+    added = []
+    add = container.ContainerWriter.add
+
+    def add_then_exit(writer, name, content):
+        if len(added) == n_members:
+            os._exit(1)
+        added.append(name)
+        add(writer, name, content)
+
+    container.ContainerWriter.add = add_then_exit
+    append_file(tmp_path, log_path, templates_path)
+    os._exit(0)
+
+
+@pytest.mark.parametrize("n_members", [0, 5, 30])
+def test_interrupted_append(tmp_path, n_members):
+    log_path, templates_path, lines = write_log(tmp_path)
+    archive_path = zip_file(tmp_path, log_path, templates_path, level=3, block_lines=1000)
+    (tmp_path / "more").mkdir()
+    more_path, _, more_lines = write_log(tmp_path / "more", n_lines=2500, seed=1)
+    process = mp.get_context("fork").Process(target=interrupted_append,
+                                             args=(tmp_path, more_path, templates_path, n_members))
+    process.start()
+    process.join()
+    assert process.exitcode == 1
+    # the torn tail is ignored, and dropped by the next append
+    assert Unziplog(archive_path).read_lines() == lines
+    append_file(tmp_path, more_path, templates_path)
+    assert Unziplog(archive_path).read_lines() == lines + more_lines
+
+
+@pytest.mark.parametrize("level", [1, 3])
+@pytest.mark.parametrize("kwargs", [{}, {"column_kernel": True, "column_codec": True},
+                                    {"column_kernel": True, "auto_tune": True, "n_workers": 2}],
+                         ids=["tar", "lzc codec", "lzc auto"])
+def test_chunked_column_files(tmp_path, monkeypatch, level, kwargs):
+    # column files are encoded and copied in small pieces
+    monkeypatch.setattr(logzipper, "CODEC_CHUNK_ROWS", 300)
+    monkeypatch.setattr(logzipper, "READ_SIZE", 1000)
+    monkeypatch.setattr(container, "READ_SIZE", 1000)
+    log_path, templates_path, lines = write_log(tmp_path)
+    zipper = Ziplog(logformat=LOGFORMAT, outdir=str(tmp_path / "out"), outname="HDFS", level=level,
+                    tmp_dir=str(tmp_path / "tmp"), metrics=RunMetrics(quiet=True), run_report=False, **kwargs)
+    zipper.zip_file(log_path, templates_path, chunk_lines=700)
+    unzipper = Unziplog(zipper.archive_path())
+    assert unzipper.read_lines() == lines
+    if "column_codec" in kwargs:
+        assert any(".num." in name for name in unzipper.reader.container.names())
+
+
+def test_template_bundle(tmp_path):
+    # a saved bundle can be given in place of the templates file
+    log_path, templates_path, lines = write_log(tmp_path)
+    bundle_path = str(tmp_path / "HDFS.bundle")
+    PatternMatch(tmp_dir="", outdir=str(tmp_path), logformat=None).compile_templates(TEMPLATES, bundle_path)
+    archive_path = zip_file(tmp_path, log_path, bundle_path, column_kernel=True)
+    assert Unziplog(archive_path).read_lines() == lines
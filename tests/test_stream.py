@@ -0,0 +1,66 @@
+import json
+import multiprocessing as mp
+import os
+import pytest
+from logzip import container
+from logzip.logzipper import Ziplog
+from logzip.logunzipper import Unziplog
+from logzip.metrics import RunMetrics
+from test_roundtrip import LOGFORMAT, write_log
+
+
+def zip_stream(tmp_path, lines, templates_path, flush_lines=500):
+    zipper = Ziplog(logformat=LOGFORMAT, outdir=str(tmp_path / "out"), outname="stream", level=3,
+                    metrics=RunMetrics(quiet=True), run_report=False)
+    zipper.zip_stream(iter([line + "\n" for line in lines]), templates_path, flush_lines=flush_lines)
+    return zipper.archive_path()
+
+
+def n_blocks(archive_path):
+    return json.loads(Unziplog(archive_path).reader.read("block_index.json"))["n_blocks"]
+
+
+def test_flush_and_reopen(tmp_path):
+    _, templates_path, lines = write_log(tmp_path, n_lines=2400)
+    archive_path = zip_stream(tmp_path, lines[:1300], templates_path)
+    assert Unziplog(archive_path).read_lines() == lines[:1300]
+    assert n_blocks(archive_path) == 3
+    # a stream into an existing archive continues it
+    zip_stream(tmp_path, lines[1300:], templates_path)
+    assert Unziplog(archive_path).read_lines() == lines
+    assert n_blocks(archive_path) == 6
+
+
+def interrupted_stream(tmp_path, lines, templates_path, n_flushes, n_members):
+    commit = container.ContainerWriter.commit
+    add = container.ContainerWriter.add
+    flushes = []
+
+    def count_commit(writer):
+        commit(writer)
+        flushes.append(writer.offset)
+
+    def add_then_exit(writer, name, content):
+        if len(flushes) == n_flushes and len(writer.added) == n_members:
+            os._exit(1)
+        add(writer, name, content)
+
+    container.ContainerWriter.commit = count_commit
+    container.ContainerWriter.add = add_then_exit
+    zip_stream(tmp_path, lines, templates_path)
+    os._exit(0)
+
+
+@pytest.mark.parametrize("n_flushes,n_members", [(1, 0), (2, 7), (3, 20)])
+def test_interrupted_flush(tmp_path, n_flushes, n_members):
+    _, templates_path, lines = write_log(tmp_path, n_lines=2400)
+    process = mp.get_context("fork").Process(target=interrupted_stream,
+                                             args=(tmp_path, lines, templates_path, n_flushes, n_members))
+    process.start()
+    process.join()
+    assert process.exitcode == 1
+    archive_path = str(tmp_path / "out" / "stream.lzc")
+    assert Unziplog(archive_path).read_lines() == lines[:500 * n_flushes]
+    # the stream can go on from the last complete flush
+    zip_stream(tmp_path, lines[500 * n_flushes:], templates_path)
+    assert Unziplog(archive_path).read_lines() == lines
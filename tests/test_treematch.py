@@ -0,0 +1,122 @@
+import os
+import random
+import struct
+import subprocess
+import sys
+import pytest
+from logzip import treematch
+from logzip.treematch import PatternMatch, CompiledMatchTree, TemplateBundle, match_template, message_split, tree_match
+
+HDFS_TEMPLATES = [
+    "Receiving block <*> src: <*> dest: <*>",
+    "Received block <*> of size <*> from <*>",
+    "PacketResponder <*> for block <*> terminating",
+    "BLOCK* NameSystem.addStoredBlock: blockMap updated: <*> is added to <*> size <*>",
+    "BLOCK* NameSystem.allocateBlock: <*> <*>",
+    "Verification succeeded for <*>",
+    "Deleting block <*> file <*>",
+    "<*> Served block <*> to <*>",
+    "<*>:Got exception while serving <*> to <*>:",
+    "BLOCK* ask <*> to delete <*>",
+    "BLOCK* NameSystem.delete: <*> is added to invalidSet of <*>",
+    "writeBlock <*> received exception <*>",
+    "Starting thread to transfer block <*> to <*>",
+    "<*>",
+]
+
+PARAMETERS = ["blk_-1608999687919862906", "/10.250.19.102:54106", "/10.250.10.6:50010", "91178", "", " ",
+              "/mnt/hadoop/dfs/data/current/subdir19/blk_-1608999687919862906",
+              "java.io.IOException: Connection reset by peer", "blk_1 blk_2", "to", "block"]
+
+
+def build_tree(templates, outdir):
+    matcher = PatternMatch(tmp_dir="", outdir=str(outdir), logformat=None)
+    return matcher.compile_templates(templates).match_tree
+
+
+def fill(template, rng):
+    message = template
+    while "<*>" in message:
+        message = message.replace("<*>", rng.choice(PARAMETERS), 1)
+    return message
+
+
+def assert_same(match_tree, compiled_tree, message):
+    log_tokens = message_split(message)
+    assert compiled_tree.match_template(log_tokens) == match_template(match_tree, log_tokens), message
+
+
+def test_hdfs_templates(tmp_path):
+    match_tree = build_tree(HDFS_TEMPLATES, tmp_path)
+    compiled_tree = CompiledMatchTree(match_tree)
+    rng = random.Random(0)
+    for _ in range(2000):
+        assert_same(match_tree, compiled_tree, fill(rng.choice(HDFS_TEMPLATES), rng))
+
+
+def test_unmatched_messages(tmp_path):
+    match_tree = build_tree(HDFS_TEMPLATES[:-1], tmp_path)
+    compiled_tree = CompiledMatchTree(match_tree)
+    rng = random.Random(1)
+    for _ in range(500):
+        tokens = message_split(fill(rng.choice(HDFS_TEMPLATES), rng))
+        rng.shuffle(tokens)
+        assert_same(match_tree, compiled_tree, "".join(tokens))
+    assert compiled_tree.match_template(message_split("Unknown event")) == (None, None)
+
+
+@pytest.mark.parametrize("template,message,parameters", [
+    ("<*> Served block <*> to <*>", "/10.250.19.102:50010 Served block blk_1 to /10.250.10.6",
+     ("/10.250.19.102:50010", "blk_1", "/10.250.10.6")),
+    ("<*>:Got exception while serving <*> to <*>:", "10.250.19.102:50010:Got exception while serving blk_1 to /10.250.10.6:",
+     ("10.250.19.102:50010", "blk_1", "/10.250.10.6")),
+    ("Verification succeeded for <*>", "Verification succeeded for ", ("",)),
+    ("Deleting block <*> file <*>", "Deleting block  file ", ("", "")),
+    ("Received block <*> of size <*> from <*>", "Received block blk_1 of size  from /10.250.10.6",
+     ("blk_1", "", "/10.250.10.6")),
+    ("<*> <*> done", "a b done", ("a", "b")),
+])
+def test_edges(tmp_path, template, message, parameters):
+    match_tree = build_tree(HDFS_TEMPLATES + [template], tmp_path)
+    compiled_tree = CompiledMatchTree(match_tree)
+    assert_same(match_tree, compiled_tree, message)
+    assert compiled_tree.match_template(message_split(message)) == (template, parameters)
+
+
+def test_recursion_limit(tmp_path):
+    # only the recursive matcher (compiled=False) raises the recursion limit, not the import
+    code = "import logzip.treematch, sys; print(sys.getrecursionlimit())"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")).stdout
+    assert int(output) < 1000000
+    match_tree = build_tree(HDFS_TEMPLATES, tmp_path)
+    message = "Verification succeeded for " + " ".join(["blk"] * 2000)
+    assert tree_match(match_tree, [message])[message][0] == "Verification succeeded for <*>"
+
+
+def test_bundle(tmp_path):
+    bundle_path = str(tmp_path / "HDFS.bundle")
+    matcher = PatternMatch(tmp_dir="", outdir=str(tmp_path), logformat=None)
+    bundle = matcher.compile_templates(HDFS_TEMPLATES, bundle_path=bundle_path)
+    assert TemplateBundle.is_bundle(bundle_path)
+    loaded = TemplateBundle.load(bundle_path)
+    assert (loaded.templates, loaded.templates_hash) == (HDFS_TEMPLATES, bundle.templates_hash)
+    rng = random.Random(0)
+    messages = [fill(rng.choice(HDFS_TEMPLATES), rng) for _ in range(200)]
+    assert tree_match(loaded.compiled_tree, messages) == tree_match(bundle.compiled_tree, messages)
+    assert tree_match(loaded.match_tree, messages) == tree_match(bundle.compiled_tree, messages)
+
+
+def test_bundle_rejected(tmp_path):
+    bundle_path = tmp_path / "HDFS.bundle"
+    PatternMatch(tmp_dir="", outdir=str(tmp_path), logformat=None).compile_templates(HDFS_TEMPLATES, str(bundle_path))
+    data = bundle_path.read_bytes()
+    not_bundle = tmp_path / "HDFS_templates.txt"
+    not_bundle.write_text("\n".join(HDFS_TEMPLATES))
+    assert not TemplateBundle.is_bundle(str(not_bundle))
+    with pytest.raises(RuntimeError, match="not a template bundle"):
+        TemplateBundle.load(str(not_bundle))
+    magic_size = len(treematch.BUNDLE_MAGIC)
+    bundle_path.write_bytes(data[:magic_size] + struct.pack(">H", treematch.BUNDLE_VERSION + 1) + data[magic_size + 2:])
+    with pytest.raises(RuntimeError, match="version"):
+        TemplateBundle.load(str(bundle_path))